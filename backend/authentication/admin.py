@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TestResult, User, PatientProfile, DoctorProfile, Prediction, TreatmentPlan, Notification
+from .models import TestResult, User, PatientProfile, DoctorProfile, Prediction, TreatmentPlan, Notification, ModelVersion, TrainingJob, BackgroundJob
 
 # Register your models here.
-admin.site.register([User, PatientProfile, DoctorProfile, Prediction, TreatmentPlan, TestResult, Notification])
+admin.site.register([User, PatientProfile, DoctorProfile, Prediction, TreatmentPlan, TestResult, Notification, ModelVersion, TrainingJob, BackgroundJob])
@@ -0,0 +1,221 @@
+"""
+Single-file, versioned model bundles.
+
+A bundle holds everything needed to score test results: the diabetes network,
+the compiled heart failure trees and the preprocessing tables. It is written
+by `manage.py build_model_bundle` from the loose artifacts in models/.
+
+Layout:
+    8 bytes    magic, b'PGNSBNDL'
+    8 bytes    manifest length, little-endian
+    manifest   UTF-8 JSON: format, version, metadata and the dtype, shape and
+               offset of every array
+    arrays     raw little-endian array data, each starting on a 64-byte boundary
+
+The whole file is memory-mapped read-only and the arrays are views into the
+mapping, so opening a bundle reads almost nothing and the pages are shared by
+every process that has the same bundle open.
+"""
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from .engines import DenseNetwork, TreeEnsemble
+from .features import DIABETES_COLUMNS, HEART_COLUMNS, FeatureVectorizer, build_categories
+
+MAGIC = b'PGNSBNDL'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+MANIFEST_LENGTH = struct.Struct('<Q')
+
+TREE_ARRAYS = ('feature', 'threshold', 'left', 'right', 'default_left', 'value', 'roots', 'children')
+
+
+class BundleError(ValueError):
+    """The file is not a model bundle this code can read"""
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_bundle(path, arrays, metadata):
+    """
+    Write the named arrays and JSON metadata to path and return the bundle version.
+
+    The version is a hash of the contents, so rebuilding a bundle from the
+    same artifacts gives the same version. The file is written next to path
+    and renamed into place, so readers never see a partial bundle.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in sorted(arrays.items())}
+
+    digest = hashlib.sha256()
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+        digest.update(f'{name}:{array.dtype.str}:{array.shape}'.encode())
+        digest.update(array.tobytes())
+    digest.update(json.dumps(metadata, sort_keys=True).encode())
+    version = digest.hexdigest()[:16]
+
+    manifest = json.dumps({
+        'format': FORMAT_VERSION,
+        'version': version,
+        'metadata': metadata,
+        'arrays': entries,
+    }, sort_keys=True).encode()
+    data_start = _align(len(MAGIC) + MANIFEST_LENGTH.size + len(manifest))
+
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as bundle_file:
+        bundle_file.write(MAGIC + MANIFEST_LENGTH.pack(len(manifest)) + manifest)
+        for name, array in arrays.items():
+            bundle_file.write(b'\0' * (data_start + entries[name]['offset'] - bundle_file.tell()))
+            bundle_file.write(array.tobytes())
+    os.replace(temporary_path, path)
+    return version
+
+
+def _network_arrays(diabetes_network):
+    arrays = {}
+    for index, (kernel, bias, _) in enumerate(diabetes_network.layers):
+        arrays[f'diabetes/{index}/kernel'] = kernel
+        arrays[f'diabetes/{index}/bias'] = bias
+    return arrays
+
+
+def _network_metadata(diabetes_network):
+    return {'activations': [activation for _, _, activation in diabetes_network.layers]}
+
+
+def _ensemble_arrays(heart_failure_ensemble, heart_failure_booster=None):
+    arrays = {f'heart_failure/{name}': getattr(heart_failure_ensemble, name) for name in TREE_ARRAYS}
+    if heart_failure_booster is not None:
+        # The XGBoost JSON model rides along so the booster can be warm-started by retraining
+        arrays['heart_failure/booster'] = np.frombuffer(bytes(heart_failure_booster), dtype=np.uint8)
+    return arrays
+
+
+def _ensemble_metadata(heart_failure_ensemble):
+    return {
+        'base_margin': float(heart_failure_ensemble.base_margin),
+        'objective': heart_failure_ensemble.objective,
+    }
+
+
+def pack_models(diabetes_network, heart_failure_ensemble, diabetes_scaler, heart_failure_scaler, heart_failure_encoder,
+                heart_failure_booster=None):
+    """
+    Return the arrays and metadata of a bundle holding the given models and preprocessing.
+
+    heart_failure_booster is the optional XGBoost JSON the ensemble was compiled from, as bytes.
+    """
+    arrays = {
+        'preprocessing/diabetes_mean': diabetes_scaler.mean_.astype(np.float64),
+        'preprocessing/diabetes_scale': diabetes_scaler.scale_.astype(np.float64),
+        'preprocessing/heart_mean': heart_failure_scaler.mean_.astype(np.float64),
+        'preprocessing/heart_scale': heart_failure_scaler.scale_.astype(np.float64),
+    }
+    arrays.update(_network_arrays(diabetes_network))
+    arrays.update(_ensemble_arrays(heart_failure_ensemble, heart_failure_booster))
+
+    metadata = {
+        'preprocessing': {
+            'diabetes_columns': list(DIABETES_COLUMNS),
+            'heart_columns': list(HEART_COLUMNS),
+            'encoder_classes': {
+                name: [str(label) for label in encoder.classes_]
+                for name, encoder in heart_failure_encoder.items()
+            },
+        },
+        'diabetes': _network_metadata(diabetes_network),
+        'heart_failure': _ensemble_metadata(heart_failure_ensemble),
+    }
+    return arrays, metadata
+
+
+def replace_heart_failure_model(bundle, heart_failure_ensemble, heart_failure_booster=None):
+    """Return the arrays and metadata of a copy of bundle with a different heart failure model"""
+    arrays = {name: array for name, array in bundle.arrays.items() if not name.startswith('heart_failure/')}
+    arrays.update(_ensemble_arrays(heart_failure_ensemble, heart_failure_booster))
+    return arrays, {**bundle.metadata, 'heart_failure': _ensemble_metadata(heart_failure_ensemble)}
+
+
+def replace_diabetes_model(bundle, diabetes_network):
+    """Return the arrays and metadata of a copy of bundle with a different diabetes network"""
+    arrays = {name: array for name, array in bundle.arrays.items() if not name.startswith('diabetes/')}
+    arrays.update(_network_arrays(diabetes_network))
+    return arrays, {**bundle.metadata, 'diabetes': _network_metadata(diabetes_network)}
+
+
+class ModelBundle:
+    """A bundle opened read-only, with its arrays memory-mapped"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        except ValueError:
+            raise BundleError(f'{path} is empty')
+
+        header_size = len(MAGIC) + MANIFEST_LENGTH.size
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise BundleError(f'{path} is not a model bundle')
+        (manifest_length,) = MANIFEST_LENGTH.unpack(bytes(buffer[len(MAGIC):header_size]))
+        manifest = json.loads(bytes(buffer[header_size:header_size + manifest_length]))
+        if manifest['format'] != FORMAT_VERSION:
+            raise BundleError(f"Unsupported bundle format {manifest['format']}, expected {FORMAT_VERSION}")
+
+        self.version = manifest['version']
+        self.metadata = manifest['metadata']
+        data_start = _align(header_size + manifest_length)
+        self.arrays = {}
+        for name, entry in manifest['arrays'].items():
+            dtype = np.dtype(entry['dtype'])
+            start = data_start + entry['offset']
+            size = int(np.prod(entry['shape'])) * dtype.itemsize
+            self.arrays[name] = buffer[start:start + size].view(dtype).reshape(entry['shape'])
+
+        preprocessing = self.metadata['preprocessing']
+        if (tuple(preprocessing['diabetes_columns']) != DIABETES_COLUMNS
+                or tuple(preprocessing['heart_columns']) != HEART_COLUMNS):
+            raise BundleError(f'{path} was built for different model inputs')
+
+    def diabetes_network(self):
+        activations = self.metadata['diabetes']['activations']
+        return DenseNetwork([
+            (self.arrays[f'diabetes/{index}/kernel'], self.arrays[f'diabetes/{index}/bias'], activation)
+            for index, activation in enumerate(activations)
+        ])
+
+    def heart_failure_ensemble(self):
+        return TreeEnsemble(
+            **{name: self.arrays[f'heart_failure/{name}'] for name in TREE_ARRAYS},
+            base_margin=self.metadata['heart_failure']['base_margin'],
+            objective=self.metadata['heart_failure']['objective'],
+        )
+
+    def heart_failure_booster(self):
+        """Return the XGBoost booster the trees were compiled from, or None if the bundle has none"""
+        if 'heart_failure/booster' not in self.arrays:
+            return None
+
+        import xgboost as xgb
+        booster = xgb.Booster()
+        booster.load_model(bytearray(self.arrays['heart_failure/booster']))
+        return booster
+
+    def vectorizer(self):
+        return FeatureVectorizer(
+            self.arrays['preprocessing/diabetes_mean'],
+            self.arrays['preprocessing/diabetes_scale'],
+            self.arrays['preprocessing/heart_mean'],
+            self.arrays['preprocessing/heart_scale'],
+            build_categories(self.metadata['preprocessing']['encoder_classes']),
+        )
@@ -0,0 +1,267 @@
+"""
+Caches for inference results and treatment recommendations.
+
+A cache is a backend (an in-process LRU for a single node, or a Django cache
+shared between workers and nodes) wrapped by a class that knows how to build
+keys for one kind of result and counts hits and misses.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .features import feature_hash
+
+
+class LocalLRUCache:
+    """A size-bounded, thread-safe in-process LRU cache with an optional TTL in seconds"""
+
+    def __init__(self, max_entries, timeout=None):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                expires_at, value = entry
+                if expires_at is not None and expires_at <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, mapping):
+        expires_at = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (expires_at, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """Stores entries in one of the caches configured in settings.CACHES"""
+
+    def __init__(self, alias, timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_many(self, keys):
+        return self.cache.get_many(keys)
+
+    def set_many(self, mapping):
+        self.cache.set_many(mapping, timeout=self.timeout)
+
+    def clear(self):
+        self.cache.clear()
+
+
+def build_backend(config):
+    """Create the backend described by a cache settings dict, or None when caching is off"""
+    backend = config.get('BACKEND', 'local')
+    if backend == 'none':
+        return None
+    if backend == 'local':
+        return LocalLRUCache(config.get('MAX_ENTRIES', 10000), config.get('TIMEOUT'))
+    if backend == 'django':
+        return DjangoCacheBackend(config.get('CACHE_ALIAS', 'default'), config.get('TIMEOUT'))
+    raise ValueError(f'Unknown cache backend: {backend}')
+
+
+class PredictionCache:
+    """
+    Caches model probabilities keyed by the encoded feature vector.
+
+    Keys hash the scaled float32 inputs of every model together with the
+    model version, so entries from other artifacts are never returned and a
+    new model version starts with a cold cache.
+    """
+
+    KEY_PREFIX = 'prediction'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        return cls(build_backend(settings.PREDICTION_CACHE))
+
+    def key(self, model_version, rows):
+        return f'{self.KEY_PREFIX}:{model_version}:{feature_hash(*rows)}'
+
+    def get_or_predict(self, model_version, features, outputs, predict):
+        """
+        Return the {output: probabilities} of every row of the {block name:
+        scaled rows} features, for each name in outputs.
+
+        predict(features) is only called with the rows that are not cached,
+        or whose cached entry lacks one of the outputs, and its results are
+        stored.
+        """
+        if self.backend is None:
+            return predict(features)
+
+        keys = [self.key(model_version, rows) for rows in zip(*features.values())]
+        cached = self.backend.get_many(keys)
+
+        probabilities = {output: np.empty(len(keys), dtype=np.float32) for output in outputs}
+        missing = []
+        for i, key in enumerate(keys):
+            entry = cached.get(key)
+            if entry is None or any(output not in entry for output in outputs):
+                missing.append(i)
+                continue
+            for output in outputs:
+                probabilities[output][i] = entry[output]
+
+        with self._lock:
+            self._hits += len(keys) - len(missing)
+            self._misses += len(missing)
+
+        if missing:
+            scored = predict({name: rows[missing] for name, rows in features.items()})
+            for output in outputs:
+                probabilities[output][missing] = scored[output]
+            self.backend.set_many({
+                keys[i]: {output: float(probabilities[output][i]) for output in outputs}
+                for i in missing
+            })
+
+        return probabilities
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            stats = {
+                'backend': settings.PREDICTION_CACHE.get('BACKEND', 'local'),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0,
+            }
+        if isinstance(self.backend, LocalLRUCache):
+            stats['entries'] = len(self.backend)
+            stats['max_entries'] = self.backend.max_entries
+        return stats
+
+
+prediction_cache = PredictionCache.from_settings()
+
+
+class RecommendationCache:
+    """
+    Caches treatment recommendations keyed by a normalized clinical signature.
+
+    The signature holds the condition and the categorical prompt inputs as
+    they are, and the numeric ones (confidence, age and vitals) in buckets of
+    the widths in settings.RECOMMENDATION_CACHE['BUCKETS'], so near-identical
+    patients share one Gemini response. Inputs without a width are kept
+    exact. Changing the prompt calls for a new VERSION, which keys entries
+    apart from the old ones.
+    """
+
+    KEY_PREFIX = 'recommendation'
+
+    def __init__(self, backend, buckets, version=1):
+        self.backend = backend
+        self.buckets = buckets
+        self.version = version
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        config = settings.RECOMMENDATION_CACHE
+        return cls(build_backend(config), config.get('BUCKETS', {}), config.get('VERSION', 1))
+
+    def signature(self, test_result, prediction):
+        """The prompt inputs of a prediction, numeric ones replaced by the index of their bucket"""
+        inputs = {
+            'confidence': prediction.confidence,
+            'age': test_result.patient.age,
+            'gender': test_result.patient.user.gender,
+            'glucose': test_result.glucose,
+            'blood_pressure': test_result.blood_pressure,
+            'bmi': test_result.bmi,
+            'cholesterol': test_result.cholesterol,
+            'max_hr': test_result.max_hr,
+            'fasting_bs': test_result.fasting_bs,
+            'resting_ecg': test_result.resting_ecg,
+            'exercise_angina': test_result.exercise_angina,
+            'chest_pain_type': test_result.chest_pain_type,
+        }
+        for name, width in self.buckets.items():
+            if width and inputs.get(name) is not None:
+                inputs[name] = int(inputs[name] // width)
+        return prediction.condition, inputs
+
+    def key(self, test_result, prediction):
+        signature = json.dumps(self.signature(test_result, prediction), sort_keys=True)
+        return f'{self.KEY_PREFIX}:{self.version}:{hashlib.blake2b(signature.encode(), digest_size=16).hexdigest()}'
+
+    def get_many(self, predictions):
+        """The cached recommendations of predictions (with their test result loaded), as {prediction id: recommendation}"""
+        if self.backend is None:
+            return {}
+        keys = {prediction.id: self.key(prediction.test_result, prediction) for prediction in predictions}
+        cached = self.backend.get_many(list(set(keys.values())))
+        found = {prediction_id: cached[key] for prediction_id, key in keys.items() if key in cached}
+        with self._lock:
+            self._hits += len(found)
+            self._misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, predictions, recommendations):
+        """Store the {prediction id: recommendation} generated for predictions"""
+        if self.backend is None:
+            return
+        self.backend.set_many({
+            self.key(prediction.test_result, prediction): recommendations[prediction.id]
+            for prediction in predictions
+            if prediction.id in recommendations
+        })
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            stats = {
+                'backend': settings.RECOMMENDATION_CACHE.get('BACKEND', 'local'),
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0,
+            }
+        if isinstance(self.backend, LocalLRUCache):
+            stats['entries'] = len(self.backend)
+            stats['max_entries'] = self.backend.max_entries
+        return stats
+
+
+recommendation_cache = RecommendationCache.from_settings()
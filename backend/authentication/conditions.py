@@ -0,0 +1,114 @@
+"""
+Registry of the condition models scored for every test result.
+
+Each condition is declared in settings.PREDICTION_CONDITIONS with the block of
+scaled inputs it takes (see features.FEATURE_BLOCKS) and the function that
+scores those rows. The test results are encoded and scaled once for all of
+them, and the models run concurrently in a thread pool: the engines spend
+their time in NumPy, TensorFlow or XGBoost with the GIL released, so adding a
+condition adds little to the latency of a request.
+
+Which predictions are stored for a set of confidences, including the
+'Healthy' prediction made when no condition is likely, is decided by
+conditions_from_confidences() from the same settings.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .features import FEATURE_BLOCKS
+from .timing import stage
+
+# Confidence (in percent) from which a condition is reported, unless configured otherwise
+CONDITION_THRESHOLD = 50
+
+
+class ConditionModel:
+    """One condition: the label stored on its predictions, its input block and its scoring function"""
+
+    def __init__(self, key, condition, features, predict, threshold=CONDITION_THRESHOLD, stage=None):
+        if features not in FEATURE_BLOCKS:
+            raise ValueError(f"Unknown feature block {features!r} for condition {key!r}")
+        self.key = key
+        self.condition = condition
+        self.features = features
+        # predict(rows, models) returns one probability per row of the features block
+        self.predict = import_string(predict) if isinstance(predict, str) else predict
+        self.threshold = threshold
+        # Name of the StageTimer stage the model is timed under
+        self.stage = stage or f'{key}_model'
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config['KEY'],
+            config['CONDITION'],
+            config['FEATURES'],
+            config['PREDICT'],
+            config.get('THRESHOLD', CONDITION_THRESHOLD),
+            config.get('STAGE')
+        )
+
+
+condition_models = [ConditionModel.from_config(config) for config in settings.PREDICTION_CONDITIONS]
+
+# Condition keys with a column of their own on PatientRiskSummary, which ranks
+# patients by them; they must be configured, other conditions only count
+# towards its risk_confidence
+RISK_SUMMARY_CONDITIONS = {
+    'diabetes': 'diabetes_confidence',
+    'heart_disease': 'heart_disease_confidence',
+}
+_missing = set(RISK_SUMMARY_CONDITIONS) - {condition.key for condition in condition_models}
+if _missing:
+    raise ImproperlyConfigured(
+        f"PREDICTION_CONDITIONS must include the conditions of PatientRiskSummary: {', '.join(sorted(_missing))}"
+    )
+
+# Shared by every request; the calling thread scores one condition itself
+_executor = ThreadPoolExecutor(max_workers=settings.CONDITION_MODEL_THREADS, thread_name_prefix='condition-model')
+
+
+def score_conditions(models, features, conditions=None, timer=None):
+    """
+    Score the {block name: scaled rows} features with every condition model.
+
+    Returns a {condition key: probabilities} dict. The models run
+    concurrently; models is the LoadedModels the features were encoded with.
+    """
+    conditions = condition_models if conditions is None else conditions
+
+    def run(condition):
+        with stage(timer, condition.stage):
+            return condition.predict(features[condition.features], models)
+
+    futures = [(condition.key, _executor.submit(run, condition)) for condition in conditions[1:]]
+    probabilities = {conditions[0].key: run(conditions[0])} if conditions else {}
+    for key, future in futures:
+        probabilities[key] = future.result()
+    return probabilities
+
+
+def conditions_from_confidences(confidences):
+    """
+    Return the (condition, confidence) pairs to store for one test result's
+    {condition key: confidence in percent}.
+
+    Every condition at or above its threshold is reported. When none is, the
+    HEALTHY_PREDICTION condition is reported instead, with the mean distance
+    of the confidences from 100%.
+    """
+    reported = [
+        (condition.condition, confidences[condition.key])
+        for condition in condition_models
+        if confidences[condition.key] >= condition.threshold
+    ]
+    healthy = settings.HEALTHY_PREDICTION
+    if not reported and healthy and condition_models:
+        total = 0
+        for condition in condition_models:
+            total = total + 100 - confidences[condition.key]
+        reported.append((healthy['CONDITION'], total / len(condition_models)))
+    return reported
@@ -0,0 +1,226 @@
+"""
+Drift monitoring of the model inputs.
+
+Every raw model input of incoming test results is counted into a fixed
+histogram, stored as one FeatureHistogramBin row per bin. Recording a test
+result is a single UPDATE of one bin per feature, so the cost per row is
+constant and the table is never rescanned.
+
+Numeric inputs are binned by their distance from the training mean in
+training standard deviations. Categorical inputs get one bin per category.
+The expected fraction of each bin of a two-valued input comes from its scaler,
+whose mean is the fraction of ones. The other inputs have no baseline until
+`manage.py reset_drift_baseline --data-csv` loads the histograms of an actual
+training set: measurements such as insulin and skin thickness pile up at 0 and
+are far from normal, so a baseline assumed from the mean and standard
+deviation alone would raise false alerts. Inputs without a baseline are
+counted, but get no PSI or KS and raise no alerts.
+
+Every DRIFT_MONITOR['CHECK_EVERY'] test results, the population stability
+index (PSI) of each input is compared with DRIFT_MONITOR['PSI_ALERT'] and the
+admins are notified once per input.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from .features import CATEGORICAL_ENCODERS, DIABETES_COLUMNS, HEART_COLUMNS, RAW_COLUMNS
+from .models import DriftAlert, FeatureHistogramBin, Notification, NotificationType, User, UserRoleChoices
+
+# Bin edges of numeric inputs, in training standard deviations from the training mean
+Z_EDGES = np.array([-3, -2, -1.5, -1, -0.5, 0, 0.5, 1, 1.5, 2, 3], dtype=np.float64)
+
+# Inputs with one bin per encoded value; sex is encoded as 0 or 1
+CATEGORICAL_FEATURES = ('sex',) + tuple(CATEGORICAL_ENCODERS)
+
+# Floor of the bin fractions in the PSI, so empty bins do not make it infinite
+PSI_EPSILON = 1e-4
+
+# Preprocessing versions whose histogram rows are known to exist
+_initialized = set()
+
+
+def _statistics(vectorizer):
+    """Training mean and standard deviation of each raw column, from the first scaler that uses it"""
+    columns = DIABETES_COLUMNS + HEART_COLUMNS
+    means = np.concatenate([vectorizer.diabetes_mean, vectorizer.heart_mean])
+    scales = np.concatenate([vectorizer.diabetes_scale, vectorizer.heart_scale])
+    return {column: (means[columns.index(column)], scales[columns.index(column)]) for column in RAW_COLUMNS}
+
+
+def bin_count(vectorizer, feature):
+    if feature == 'sex':
+        return 2
+    if feature in CATEGORICAL_FEATURES:
+        return len(vectorizer.categories[feature])
+    return len(Z_EDGES) + 1
+
+
+def bin_rows(vectorizer, raw):
+    """The bin of every input of a raw (rows, RAW_COLUMNS) matrix"""
+    raw = np.asarray(raw, dtype=np.float64).reshape(-1, len(RAW_COLUMNS))
+    statistics = _statistics(vectorizer)
+    bins = np.empty(raw.shape, dtype=np.int64)
+    for column, feature in enumerate(RAW_COLUMNS):
+        if feature in CATEGORICAL_FEATURES:
+            bins[:, column] = np.clip(raw[:, column], 0, bin_count(vectorizer, feature) - 1)
+        else:
+            mean, scale = statistics[feature]
+            bins[:, column] = np.searchsorted(Z_EDGES, (raw[:, column] - mean) / scale, side='right')
+    return bins
+
+
+def baseline_fractions(vectorizer):
+    """
+    The expected bin fractions of every input implied by the scalers, as
+    {feature: list}. Only two-valued inputs have one; the fractions of numeric
+    inputs and of categories with more than two values are None.
+    """
+    statistics = _statistics(vectorizer)
+    baseline = {}
+    for feature in RAW_COLUMNS:
+        if feature in CATEGORICAL_FEATURES and bin_count(vectorizer, feature) == 2:
+            # The training mean of a 0/1 input is the fraction of ones
+            share = float(np.clip(statistics[feature][0], 0, 1))
+            baseline[feature] = [1 - share, share]
+        else:
+            baseline[feature] = [None] * bin_count(vectorizer, feature)
+    return baseline
+
+
+def reset_histograms(vectorizer, baseline=None):
+    """
+    Replace the histograms of the vectorizer's preprocessing with empty ones
+    and clear its alerts. baseline maps features to bin fractions and
+    defaults to baseline_fractions().
+    """
+    version = vectorizer.preprocessing_version
+    baseline = {**baseline_fractions(vectorizer), **(baseline or {})}
+    FeatureHistogramBin.objects.filter(preprocessing_version=version).delete()
+    DriftAlert.objects.filter(preprocessing_version=version).delete()
+    FeatureHistogramBin.objects.bulk_create([
+        FeatureHistogramBin(preprocessing_version=version, feature=feature, bin=index, baseline_fraction=fraction)
+        for feature, fractions in baseline.items()
+        for index, fraction in enumerate(fractions)
+    ])
+    _initialized.add(version)
+
+
+def ensure_histograms(vectorizer):
+    """Create the histogram rows of the vectorizer's preprocessing, with the implied baseline, if missing"""
+    version = vectorizer.preprocessing_version
+    if version in _initialized:
+        return
+    FeatureHistogramBin.objects.bulk_create([
+        FeatureHistogramBin(preprocessing_version=version, feature=feature, bin=index, baseline_fraction=fraction)
+        for feature, fractions in baseline_fractions(vectorizer).items()
+        for index, fraction in enumerate(fractions)
+    ], ignore_conflicts=True)
+    _initialized.add(version)
+
+
+def record_test_result(test_result, vectorizer):
+    """Count the inputs of a new test result, and check for drift every CHECK_EVERY test results"""
+    try:
+        raw = vectorizer.raw_row(test_result)
+    except ValueError:
+        # Values the encoders do not know are not model inputs
+        return
+    ensure_histograms(vectorizer)
+
+    bins = Q()
+    for feature, index in zip(RAW_COLUMNS, bin_rows(vectorizer, raw)[0]):
+        bins |= Q(feature=feature, bin=int(index))
+    FeatureHistogramBin.objects.filter(bins, preprocessing_version=vectorizer.preprocessing_version).update(
+        count=F('count') + 1)
+
+    if test_result.id % settings.DRIFT_MONITOR['CHECK_EVERY'] == 0:
+        check_drift(vectorizer.preprocessing_version)
+
+
+def population_stability_index(actual, expected):
+    actual = np.maximum(actual, PSI_EPSILON)
+    expected = np.maximum(expected, PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def drift_report(preprocessing_version):
+    """
+    The histogram and drift scores of every input. psi and ks (the largest
+    gap between the cumulative fractions, for numeric inputs) are None until
+    the input has a baseline and at least one test result has been counted.
+    """
+    histograms = {}
+    for row in FeatureHistogramBin.objects.filter(preprocessing_version=preprocessing_version).order_by('feature', 'bin'):
+        histograms.setdefault(row.feature, []).append(row)
+
+    report = []
+    for feature in RAW_COLUMNS:
+        rows = histograms.get(feature)
+        if not rows:
+            continue
+        counts = np.array([row.count for row in rows], dtype=np.float64)
+        samples = int(counts.sum())
+        has_baseline = all(row.baseline_fraction is not None for row in rows)
+
+        psi = ks = None
+        if samples and has_baseline:
+            actual = counts / samples
+            expected = np.array([row.baseline_fraction for row in rows])
+            psi = round(population_stability_index(actual, expected), 5)
+            if feature not in CATEGORICAL_FEATURES:
+                ks = round(float(np.max(np.abs(np.cumsum(actual) - np.cumsum(expected)))), 5)
+
+        report.append({
+            'feature': feature,
+            'samples': samples,
+            'psi': psi,
+            'ks': ks,
+            'bins': [
+                {
+                    'bin': row.bin,
+                    'count': row.count,
+                    'fraction': round(row.count / samples, 5) if samples else None,
+                    'baseline_fraction': row.baseline_fraction,
+                }
+                for row in rows
+            ],
+        })
+    return report
+
+
+def check_drift(preprocessing_version):
+    """Notify the admins of every input whose PSI crossed the threshold, once per input"""
+    config = settings.DRIFT_MONITOR
+    alerts = []
+    for entry in drift_report(preprocessing_version):
+        if entry['psi'] is None or entry['samples'] < config['MIN_SAMPLES'] or entry['psi'] < config['PSI_ALERT']:
+            continue
+        try:
+            with transaction.atomic():
+                alert = DriftAlert.objects.create(
+                    preprocessing_version=preprocessing_version,
+                    feature=entry['feature'],
+                    psi=entry['psi'],
+                    samples=entry['samples']
+                )
+        except IntegrityError:
+            # Already raised for this input
+            continue
+        alerts.append(alert)
+
+    if alerts:
+        admins = User.objects.filter(Q(is_staff=True) | Q(user_role=UserRoleChoices.admin_user), is_active=True)
+        Notification.objects.bulk_create([
+            Notification(
+                user=admin,
+                message=f"Model input drift detected in {alert.feature}: PSI {alert.psi:.3f} "
+                        f"over {alert.samples} test results",
+                notification_type=NotificationType.DRIFT_ALERT,
+                priority='high'
+            )
+            for alert in alerts
+            for admin in admins
+        ])
+    return alerts
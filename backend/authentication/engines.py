@@ -0,0 +1,241 @@
+"""
+Lightweight inference engines that run the trained models without their frameworks.
+
+DenseNetwork reproduces the forward pass of the Keras diabetes model in plain
+NumPy, so web workers do not have to import TensorFlow to serve it.
+TreeEnsemble evaluates the XGBoost heart failure booster from flat node arrays,
+so scoring a row does not need a DMatrix.
+"""
+import io
+import json
+import re
+import zipfile
+from collections import Counter
+
+import numpy as np
+
+
+def _sigmoid(x):
+    with np.errstate(over='ignore'):
+        return 1 / (1 + np.exp(-x))
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': _sigmoid,
+    'tanh': np.tanh,
+}
+
+# Layers that are the identity at inference time
+PASSTHROUGH_LAYERS = {'InputLayer', 'Dropout'}
+
+
+def _weights_path(class_name, seen):
+    """Name Keras gives a layer inside model.weights.h5: snake_case class name plus a per-class index"""
+    name = re.sub(r'(?<!^)(?=[A-Z])', '_', class_name).lower()
+    index = seen[class_name]
+    seen[class_name] += 1
+    return f'layers/{name}_{index}' if index else f'layers/{name}'
+
+
+class DenseNetwork:
+    """
+    Forward pass of a Sequential stack of Dense layers.
+
+    Each layer is a (kernel, bias, activation) tuple; inputs and weights are
+    float32, as in Keras.
+    """
+
+    def __init__(self, layers):
+        self.layers = [
+            (np.ascontiguousarray(kernel, dtype=np.float32), np.asarray(bias, dtype=np.float32), activation)
+            for kernel, bias, activation in layers
+        ]
+        for _, _, activation in self.layers:
+            if activation not in ACTIVATIONS:
+                raise ValueError(f'Unsupported activation: {activation}')
+
+    @classmethod
+    def from_keras_file(cls, path):
+        """Read the layer configuration and weights of a .keras archive"""
+        import h5py
+
+        with zipfile.ZipFile(path) as archive:
+            config = json.loads(archive.read('config.json'))
+            weights = archive.read('model.weights.h5')
+
+        if config['class_name'] != 'Sequential':
+            raise ValueError(f"Only Sequential models are supported, got {config['class_name']}")
+
+        layers = []
+        seen = Counter()
+        with h5py.File(io.BytesIO(weights), 'r') as weights_file:
+            for layer in config['config']['layers']:
+                class_name = layer['class_name']
+                if class_name in PASSTHROUGH_LAYERS:
+                    _weights_path(class_name, seen)
+                    continue
+                if class_name != 'Dense':
+                    raise ValueError(f'Unsupported layer: {class_name}')
+
+                variables = weights_file[_weights_path(class_name, seen)]['vars']
+                kernel = variables['0'][()]
+                if layer['config'].get('use_bias', True):
+                    bias = variables['1'][()]
+                else:
+                    bias = np.zeros(kernel.shape[1], dtype=np.float32)
+                layers.append((kernel, bias, layer['config'].get('activation') or 'linear'))
+
+        return cls(layers)
+
+    @property
+    def n_features(self):
+        return self.layers[0][0].shape[0]
+
+    def predict(self, features):
+        """Return the network output for each row, shaped (rows, units) like Keras predict()"""
+        x = np.asarray(features, dtype=np.float32)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        for kernel, bias, activation in self.layers:
+            x = ACTIVATIONS[activation](x @ kernel + bias)
+        return x
+
+
+# Objectives whose prediction is the logistic transform of the margin
+LOGISTIC_OBJECTIVES = {'binary:logistic', 'reg:logistic'}
+IDENTITY_OBJECTIVES = {'reg:squarederror', 'reg:linear'}
+
+
+class TreeEnsemble:
+    """
+    A gradient boosted tree ensemble compiled into flat node arrays.
+
+    All trees share one set of arrays indexed by global node id. Leaves point
+    back at themselves, so every row can take the same number of steps
+    (the depth of the deepest tree) and the traversal stays fully vectorized.
+    """
+
+    CHUNK_ROWS = 256
+
+    def __init__(self, feature, threshold, left, right, default_left, value, roots, base_margin, objective, children=None):
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold, dtype=np.float32)
+        self.left = np.asarray(left, dtype=np.intp)
+        self.right = np.asarray(right, dtype=np.intp)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.value = np.asarray(value, dtype=np.float32)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        # Left and right children interleaved, so a step is a single gather at 2 * node + go_right
+        if children is None:
+            children = np.stack([self.left, self.right], axis=1).ravel()
+        self.children = np.asarray(children, dtype=np.intp)
+        self.base_margin = np.float32(base_margin)
+        self.objective = objective
+        if objective not in LOGISTIC_OBJECTIVES | IDENTITY_OBJECTIVES:
+            raise ValueError(f'Unsupported objective: {objective}')
+        self.depth = self._max_depth()
+
+    @classmethod
+    def from_xgboost_json(cls, path):
+        """Compile a model saved with Booster.save_model() in JSON format"""
+        with open(path) as model_file:
+            return cls.from_xgboost_model(json.load(model_file))
+
+    @classmethod
+    def from_xgboost_model(cls, model):
+        """Compile a parsed XGBoost JSON model, e.g. json.loads(booster.save_raw('json'))"""
+        learner = model['learner']
+
+        booster = learner['gradient_booster']
+        if booster['name'] != 'gbtree':
+            raise ValueError(f"Only gbtree boosters are supported, got {booster['name']}")
+        model_param = learner['learner_model_param']
+        if int(model_param.get('num_class', 0)) > 1 or int(model_param.get('num_target', 1)) > 1:
+            raise ValueError('Only single-output models are supported')
+
+        feature, threshold, left, right, default_left, value, roots = [], [], [], [], [], [], []
+        for tree in booster['model']['trees']:
+            if any(split_type != 0 for split_type in tree['split_type']):
+                raise ValueError('Categorical splits are not supported')
+
+            offset = len(feature)
+            roots.append(offset)
+            for node, left_child in enumerate(tree['left_children']):
+                if left_child == -1:
+                    # Leaves store their output in split_conditions and loop back to themselves
+                    feature.append(0)
+                    threshold.append(0)
+                    left.append(offset + node)
+                    right.append(offset + node)
+                    default_left.append(True)
+                    value.append(tree['split_conditions'][node])
+                else:
+                    feature.append(tree['split_indices'][node])
+                    threshold.append(tree['split_conditions'][node])
+                    left.append(offset + left_child)
+                    right.append(offset + tree['right_children'][node])
+                    default_left.append(bool(tree['default_left'][node]))
+                    value.append(0)
+
+        objective = learner['objective']['name']
+        base_score = float(model_param['base_score'])
+        if objective in LOGISTIC_OBJECTIVES:
+            base_margin = np.log(base_score / (1 - base_score))
+        else:
+            base_margin = base_score
+
+        return cls(feature, threshold, left, right, default_left, value, roots, base_margin, objective)
+
+    def _max_depth(self):
+        depth = 0
+        nodes = self.roots
+        # Follow both children of every internal node until only leaves remain
+        while True:
+            internal = nodes[self.left[nodes] != nodes]
+            if not len(internal):
+                return depth
+            nodes = np.concatenate([self.left[internal], self.right[internal]])
+            depth += 1
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def leaves(self, features):
+        """Return the leaf node reached in every tree, shaped (rows, trees)"""
+        x = np.asarray(features, dtype=np.float32)
+        if x.ndim == 1:
+            x = x.reshape(1, -1)
+        # Walking a few hundred rows at a time keeps the gathered node arrays in cache
+        return np.concatenate([
+            self._leaves(x[start:start + self.CHUNK_ROWS])
+            for start in range(0, len(x), self.CHUNK_ROWS)
+        ]) if len(x) else np.empty((0, self.n_trees), dtype=np.intp)
+
+    def _leaves(self, x):
+        flat = np.ascontiguousarray(x).ravel()
+        row_offsets = (np.arange(len(x)) * x.shape[1])[:, None]
+        has_missing = np.isnan(flat).any()
+
+        nodes = np.broadcast_to(self.roots, (len(x), self.n_trees))
+        for _ in range(self.depth):
+            values = flat[row_offsets + self.feature[nodes]]
+            # XGBoost sends a row left when its value is below the threshold,
+            # and missing values follow the default direction
+            go_right = values >= self.threshold[nodes]
+            if has_missing:
+                go_right |= np.isnan(values) & ~self.default_left[nodes]
+            nodes = self.children[2 * nodes + go_right]
+        return nodes
+
+    def predict_margin(self, features):
+        return self.value[self.leaves(features)].sum(axis=1, dtype=np.float32) + self.base_margin
+
+    def predict(self, features):
+        """Return one prediction per row, matching Booster.predict()"""
+        margin = self.predict_margin(features)
+        if self.objective in LOGISTIC_OBJECTIVES:
+            return _sigmoid(margin)
+        return margin
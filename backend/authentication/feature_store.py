@@ -0,0 +1,137 @@
+"""
+Persisted model inputs of test results.
+
+TestResult.feature_vector holds the scaled diabetes and heart feature rows of a
+test result as float32 bytes, and feature_version the preprocessing_version of
+the vectorizer that produced them. The vector is written when the test result
+is submitted, so batch consumers read one column instead of joining the
+patient and user rows and encoding every field again.
+
+A vector is stale when its version differs from the vectorizer in use, or was
+cleared because the patient's age or gender changed. Stale vectors are
+recomputed the first time they are read and saved back.
+"""
+import numpy as np
+from django.db.models import Q, prefetch_related_objects
+
+from .features import DIABETES_COLUMNS, HEART_COLUMNS
+from .models import TestResult
+
+VECTOR_WIDTH = len(DIABETES_COLUMNS) + len(HEART_COLUMNS)
+
+
+def pack(diabetes_features, heart_features):
+    """One float32 byte string per row of the scaled diabetes and heart matrices"""
+    return [row.tobytes() for row in np.hstack([diabetes_features, heart_features]).astype(np.float32)]
+
+
+def unpack(blobs):
+    """The scaled (diabetes, heart) matrices of a list of packed vectors"""
+    matrix = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(-1, VECTOR_WIDTH)
+    split = len(DIABETES_COLUMNS)
+    return np.ascontiguousarray(matrix[:, :split]), np.ascontiguousarray(matrix[:, split:])
+
+
+def is_fresh(feature_vector, feature_version, vectorizer):
+    return feature_vector is not None and feature_version == vectorizer.preprocessing_version
+
+
+def assign_features(test_result, vectorizer):
+    """Set the feature vector of a TestResult instance; the caller saves it"""
+    test_result.feature_vector = pack(*vectorizer.transform([test_result]))[0]
+    test_result.feature_version = vectorizer.preprocessing_version
+
+
+def test_result_features(test_results, vectorizer):
+    """
+    The scaled (diabetes, heart) matrices of TestResult instances, from their
+    stored vectors. Stale vectors are computed from the instances and saved.
+    """
+    stale = [
+        test_result for test_result in test_results
+        if not is_fresh(test_result.feature_vector, test_result.feature_version, vectorizer)
+    ]
+    if stale:
+        # Two queries for all the stale rows, unless the caller used select_related
+        prefetch_related_objects(stale, 'patient__user')
+        for test_result, blob in zip(stale, pack(*vectorizer.transform(stale))):
+            test_result.feature_vector = blob
+            test_result.feature_version = vectorizer.preprocessing_version
+        TestResult.objects.bulk_update(stale, ['feature_vector', 'feature_version'])
+    return unpack([test_result.feature_vector for test_result in test_results])
+
+
+def refresh_features(test_result_ids, vectorizer):
+    """
+    Recompute and save the vectors of test results by id. Returns {id: vector};
+    test results with values the encoders do not know are left out.
+    """
+    vectors = {}
+    updated = []
+    for test_result in TestResult.objects.select_related('patient__user').filter(id__in=test_result_ids):
+        try:
+            assign_features(test_result, vectorizer)
+        except ValueError:
+            continue
+        vectors[test_result.id] = test_result.feature_vector
+        updated.append(test_result)
+    TestResult.objects.bulk_update(updated, ['feature_vector', 'feature_version'])
+    return vectors
+
+
+def split_scorable(test_results, vectorizer):
+    """
+    Split TestResult instances into those that have features and those with
+    values the encoders do not know. Stale vectors are recomputed and saved
+    on the way, so scoring the first list reads no patients.
+    """
+    stale = [
+        test_result for test_result in test_results
+        if not is_fresh(test_result.feature_vector, test_result.feature_version, vectorizer)
+    ]
+    refreshed = refresh_features([test_result.id for test_result in stale], vectorizer) if stale else {}
+    unscorable = set()
+    for test_result in stale:
+        if test_result.id in refreshed:
+            test_result.feature_vector = refreshed[test_result.id]
+            test_result.feature_version = vectorizer.preprocessing_version
+        else:
+            unscorable.add(test_result.id)
+    return (
+        [test_result for test_result in test_results if test_result.id not in unscorable],
+        [test_result for test_result in test_results if test_result.id in unscorable],
+    )
+
+
+def stale_test_results(queryset, vectorizer):
+    """The test results of a queryset whose vector is missing or from another preprocessing"""
+    return queryset.filter(Q(feature_vector__isnull=True) | ~Q(feature_version=vectorizer.preprocessing_version))
+
+
+def refresh_stale_features(queryset, vectorizer, chunk_size=1000):
+    """Recompute the stale vectors of a queryset of test results up front, one chunk at a time"""
+    stale_ids = list(stale_test_results(queryset, vectorizer).values_list('id', flat=True).distinct())
+    for start in range(0, len(stale_ids), chunk_size):
+        refresh_features(stale_ids[start:start + chunk_size], vectorizer)
+
+
+def stored_features(rows, vectorizer, refresh=True):
+    """
+    The scaled (diabetes, heart) matrices of values() rows holding 'id',
+    'feature_vector' and 'feature_version'.
+
+    Returns the indices of the rows that have features, and the matrices for
+    those rows. Stale vectors are recomputed with one query for all of them,
+    or skipped when refresh is False, e.g. while the rows are still being
+    read from a cursor.
+    """
+    stale = {row['id'] for row in rows if not is_fresh(row['feature_vector'], row['feature_version'], vectorizer)}
+    refreshed = refresh_features(stale, vectorizer) if stale and refresh else {}
+
+    indices, blobs = [], []
+    for index, row in enumerate(rows):
+        blob = refreshed.get(row['id']) if row['id'] in stale else row['feature_vector']
+        if blob is not None:
+            indices.append(index)
+            blobs.append(blob)
+    return np.array(indices, dtype=np.int64), *unpack(blobs)
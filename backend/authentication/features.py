@@ -0,0 +1,173 @@
+"""
+Feature preprocessing for the prediction models.
+
+FeatureVectorizer replaces the per-field LabelEncoder and StandardScaler calls
+with lookup tables and one affine transform over the whole batch.
+"""
+import hashlib
+import json
+
+import numpy as np
+
+# Raw columns gathered from a test result, in the order they are read
+RAW_COLUMNS = (
+    'glucose',
+    'blood_pressure',
+    'skin_thickness',
+    'insulin',
+    'bmi',
+    'age',
+    'sex',
+    'chest_pain_type',
+    'cholesterol',
+    'fasting_bs',
+    'resting_ecg',
+    'max_hr',
+    'exercise_angina',
+)
+
+# Model inputs, in the order the scalers were fitted on
+DIABETES_COLUMNS = ('glucose', 'blood_pressure', 'skin_thickness', 'insulin', 'bmi', 'age')
+HEART_COLUMNS = (
+    'age', 'sex', 'chest_pain_type', 'blood_pressure', 'cholesterol',
+    'fasting_bs', 'resting_ecg', 'max_hr', 'exercise_angina',
+)
+
+# Blocks of scaled model inputs, in the order scale() returns them. Each
+# condition model declares the block it takes (see conditions.py).
+FEATURE_BLOCKS = {'diabetes': DIABETES_COLUMNS, 'heart': HEART_COLUMNS}
+
+# Categorical test result fields and the encoder that was fitted on each
+CATEGORICAL_ENCODERS = {
+    'chest_pain_type': 'chest_pain_encoder',
+    'fasting_bs': 'label_encoder',
+    'resting_ecg': 'resting_ecg_encoder',
+    'exercise_angina': 'label_encoder',
+}
+
+# Fields to pass to TestResult.objects.values() for transform_rows()
+VALUE_FIELDS = (
+    'glucose', 'blood_pressure', 'skin_thickness', 'insulin', 'bmi', 'cholesterol',
+    'fasting_bs', 'resting_ecg', 'max_hr', 'exercise_angina', 'chest_pain_type',
+    'patient__age', 'patient__user__gender',
+)
+
+
+def feature_hash(*rows):
+    """Hex digest identifying the encoded float32 feature rows of one test result"""
+    digest = hashlib.blake2b(digest_size=16)
+    for row in rows:
+        digest.update(np.ascontiguousarray(row, dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def build_categories(encoder_classes):
+    """Map each categorical field to a {label: code} table from the classes of its encoder"""
+    return {
+        field: {label: index for index, label in enumerate(encoder_classes[encoder])}
+        for field, encoder in CATEGORICAL_ENCODERS.items()
+    }
+
+
+class FeatureVectorizer:
+    """
+    Maps test results straight to the scaled diabetes and heart feature matrices.
+
+    Categorical fields are encoded with lookup tables built from the fitted
+    LabelEncoders. Both scalers are folded into a single gather, subtract and
+    divide over the raw matrix, using the same float64 arithmetic as
+    StandardScaler, so the output equals the sklearn path.
+    """
+
+    def __init__(self, diabetes_mean, diabetes_scale, heart_mean, heart_scale, categories):
+        self.categories = categories
+        self.diabetes_mean = np.asarray(diabetes_mean, dtype=np.float64)
+        self.diabetes_scale = np.asarray(diabetes_scale, dtype=np.float64)
+        self.heart_mean = np.asarray(heart_mean, dtype=np.float64)
+        self.heart_scale = np.asarray(heart_scale, dtype=np.float64)
+
+        # Each output column gathers one raw column, then is centered and scaled
+        self._columns = np.array([RAW_COLUMNS.index(column) for column in DIABETES_COLUMNS + HEART_COLUMNS])
+        self._mean = np.concatenate([self.diabetes_mean, self.heart_mean])
+        self._scale = np.concatenate([self.diabetes_scale, self.heart_scale])
+
+        # Identifies the preprocessing, so vectors scaled by another vectorizer can be recognised
+        digest = hashlib.blake2b(digest_size=8)
+        for array in (self._mean, self._scale):
+            digest.update(array.tobytes())
+        digest.update(json.dumps(categories, sort_keys=True, default=str).encode())
+        self.preprocessing_version = digest.hexdigest()
+
+    @classmethod
+    def from_artifacts(cls, diabetes_scaler, heart_failure_scaler, heart_failure_encoder):
+        """Build the vectorizer from the fitted scalers and label encoders"""
+        return cls(
+            diabetes_scaler.mean_, diabetes_scaler.scale_,
+            heart_failure_scaler.mean_, heart_failure_scaler.scale_,
+            build_categories({name: encoder.classes_ for name, encoder in heart_failure_encoder.items()})
+        )
+
+    def _encode(self, field, value):
+        try:
+            return self.categories[field][value]
+        except KeyError:
+            raise ValueError(f'Unknown value {value!r} for {field}')
+
+    def raw_row(self, test_result):
+        """Return the unscaled model inputs of a TestResult instance, in RAW_COLUMNS order"""
+        return (
+            test_result.glucose,
+            test_result.blood_pressure,
+            test_result.skin_thickness,
+            test_result.insulin,
+            test_result.bmi,
+            test_result.patient.age,
+            float(test_result.patient.user.gender == 'Male'),
+            self._encode('chest_pain_type', test_result.chest_pain_type),
+            test_result.cholesterol,
+            self._encode('fasting_bs', test_result.fasting_bs),
+            self._encode('resting_ecg', test_result.resting_ecg),
+            test_result.max_hr,
+            self._encode('exercise_angina', test_result.exercise_angina),
+        )
+
+    def raw_value_row(self, row):
+        """Return the unscaled model inputs of a TestResult.objects.values(*VALUE_FIELDS) row"""
+        return (
+            row['glucose'],
+            row['blood_pressure'],
+            row['skin_thickness'],
+            row['insulin'],
+            row['bmi'],
+            row['patient__age'],
+            float(row['patient__user__gender'] == 'Male'),
+            self._encode('chest_pain_type', row['chest_pain_type']),
+            row['cholesterol'],
+            self._encode('fasting_bs', row['fasting_bs']),
+            self._encode('resting_ecg', row['resting_ecg']),
+            row['max_hr'],
+            self._encode('exercise_angina', row['exercise_angina']),
+        )
+
+    def scale(self, raw):
+        """Scale a raw (rows, RAW_COLUMNS) matrix into the float32 diabetes and heart matrices"""
+        raw = np.asarray(raw, dtype=np.float64).reshape(-1, len(RAW_COLUMNS))
+        scaled = ((raw[:, self._columns] - self._mean) / self._scale).astype(np.float32)
+        split = len(DIABETES_COLUMNS)
+        return np.ascontiguousarray(scaled[:, :split]), np.ascontiguousarray(scaled[:, split:])
+
+    def scale_blocks(self, raw):
+        """scale(), as a {block name: matrix} dict keyed by FEATURE_BLOCKS"""
+        return dict(zip(FEATURE_BLOCKS, self.scale(raw)))
+
+    def transform_blocks(self, test_results):
+        """transform(), as a {block name: matrix} dict keyed by FEATURE_BLOCKS"""
+        return dict(zip(FEATURE_BLOCKS, self.transform(test_results)))
+
+    def transform(self, test_results):
+        """Return the scaled (diabetes, heart) matrices for TestResult instances"""
+        return self.scale([self.raw_row(test_result) for test_result in test_results])
+
+    def transform_rows(self, rows):
+        """Return the scaled (diabetes, heart) matrices for values() rows"""
+        return self.scale([self.raw_value_row(row) for row in rows])
@@ -0,0 +1,235 @@
+import numpy as np
+from django.db import connection
+from django.utils import timezone
+
+from .caches import prediction_cache
+from .conditions import (
+    RISK_SUMMARY_CONDITIONS, condition_models, conditions_from_confidences, score_conditions,
+)
+from .feature_store import test_result_features
+from .features import CATEGORICAL_ENCODERS, FEATURE_BLOCKS, RAW_COLUMNS, feature_hash
+from .inference_server import inference_client
+from .model_loader import get_models
+from .models import PatientRiskSummary, Prediction
+from .timing import stage
+
+# Conditions the inference server scores, in the order of the arrays it returns
+SERVER_CONDITIONS = ('diabetes', 'heart_disease')
+
+# Raw columns a what-if curve can vary: measurements take a numeric range,
+# categorical fields are evaluated at every category
+WHAT_IF_NUMERIC_FEATURES = tuple(
+    column for column in RAW_COLUMNS if column not in CATEGORICAL_ENCODERS and column != 'sex'
+)
+WHAT_IF_CATEGORICAL_FEATURES = tuple(CATEGORICAL_ENCODERS)
+
+# Columns of a PatientRiskSummary upsert, the patient and test result first
+RISK_SUMMARY_FIELDS = (
+    'patient', 'test_result', *RISK_SUMMARY_CONDITIONS.values(), 'risk_confidence', 'model_version', 'updated_at',
+)
+# Summaries written per INSERT statement, well below the bound parameter limits
+RISK_SUMMARY_UPSERT_ROWS = 500
+
+
+def to_confidence(probabilities):
+    """Convert model probabilities to percentages truncated to one decimal place"""
+    return np.trunc(probabilities * 1000).astype(np.float64) / 10
+
+
+def score_test_results(test_results, models=None, use_cache=True, timer=None):
+    """
+    Run every condition model once over a list of test results.
+
+    Returns a {condition key: confidences} dict holding the confidence (in
+    percent) of each condition for each test result, in input order, and the
+    version of the models that scored them. The features are the vectors
+    stored on the test results. Rows whose features were scored before are
+    served from the prediction cache; the rest are scored by predict_features().
+
+    models defaults to the serving version. Bulk jobs pass use_cache=False so
+    they do not evict the entries of interactive requests. A StageTimer
+    passed as timer receives the time spent encoding and in each model, the
+    hash of every encoded input row and the number of rows served from the
+    prediction cache.
+    """
+    models = models or get_models()
+    with stage(timer, 'encode'):
+        features = dict(zip(FEATURE_BLOCKS, test_result_features(test_results, models.vectorizer)))
+    if timer is not None:
+        timer.details['input_hashes'] = [feature_hash(*rows) for rows in zip(*features.values())]
+
+    scored = []
+
+    def predict(rows):
+        # Only called with the rows that missed the prediction cache
+        scored.append(len(next(iter(rows.values()))))
+        return predict_features(models, rows, timer)
+
+    if use_cache:
+        outputs = [condition.key for condition in condition_models]
+        probabilities = prediction_cache.get_or_predict(models.version, features, outputs, predict)
+    else:
+        probabilities = predict(features)
+    if timer is not None:
+        timer.details['cache_hits'] = len(test_results) - sum(scored)
+
+    return {key: to_confidence(values) for key, values in probabilities.items()}, models.version
+
+
+def predict_features(models, features, timer=None):
+    """
+    Return the {condition key: probabilities} of {block name: scaled rows} features.
+
+    The conditions the inference server knows are scored there when one is
+    configured; the others, or all of them when the server is unavailable,
+    are scored in-process by conditions.score_conditions().
+    """
+    conditions = condition_models
+    probabilities = {}
+    if inference_client is not None:
+        with stage(timer, 'inference_server'):
+            result = inference_client.predict(models.version, features['diabetes'], features['heart'])
+        if result is not None:
+            keys = {condition.key for condition in conditions}
+            probabilities = {key: values for key, values in zip(SERVER_CONDITIONS, result) if key in keys}
+            conditions = [condition for condition in conditions if condition.key not in probabilities]
+    if conditions:
+        probabilities.update(score_conditions(models, features, conditions, timer))
+    return probabilities
+
+
+def what_if(test_result, feature, values=None, models=None):
+    """
+    Risk curves of a test result with one raw feature set to each of values,
+    one per condition model.
+
+    The perturbed rows are built as one matrix and each model scores the
+    whole grid in a single call. Categorical features are evaluated at every
+    category, so values is only used for numeric features.
+    """
+    models = models or get_models()
+    vectorizer = models.vectorizer
+    baseline = vectorizer.raw_row(test_result)
+    column = RAW_COLUMNS.index(feature)
+
+    if feature in WHAT_IF_CATEGORICAL_FEATURES:
+        labels = list(vectorizer.categories[feature])
+        codes = [vectorizer.categories[feature][label] for label in labels]
+    else:
+        labels = [float(value) for value in values]
+        codes = labels
+
+    grid = np.tile(np.asarray(baseline, dtype=np.float64), (len(codes), 1))
+    grid[:, column] = codes
+    probabilities = predict_features(models, vectorizer.scale_blocks(grid))
+
+    if feature in WHAT_IF_CATEGORICAL_FEATURES:
+        current = getattr(test_result, feature)
+    else:
+        current = float(baseline[column])
+    return {
+        'feature': feature,
+        'current_value': current,
+        'values': labels,
+        **{key: to_confidence(values).tolist() for key, values in probabilities.items()},
+        'model_version': models.version,
+    }
+
+
+def build_predictions(test_result, confidences, model_version=''):
+    """
+    Build the (unsaved) predictions for a single scored test result from its
+    {condition key: confidence}, as decided by conditions_from_confidences()
+    """
+    return [
+        Prediction(
+            patient_id=test_result.patient_id,
+            test_result=test_result,
+            condition=condition,
+            confidence=confidence,
+            model_version=model_version
+        )
+        for condition, confidence in conditions_from_confidences(confidences)
+    ]
+
+
+def predict_test_results(test_results, models=None, use_cache=True):
+    """
+    Score a batch of test results in one vectorized pass and store the predictions.
+
+    The features are read from the vectors stored on the test results; stale
+    ones are recomputed, with their patients fetched in one go.
+    Returns the created predictions, grouped in input order.
+    """
+    test_results = list(test_results)
+    if not test_results:
+        return []
+
+    confidences, model_version = score_test_results(test_results, models, use_cache)
+    return save_predictions(test_results, confidences, model_version)
+
+
+def save_predictions(test_results, confidences, model_version=''):
+    """
+    Store the predictions of scored test results and update the risk summaries
+    of their patients. confidences is the {condition key: confidences} dict of
+    score_test_results(). Returns the created predictions, grouped in input order.
+    """
+    predictions = []
+    for i, test_result in enumerate(test_results):
+        predictions.extend(build_predictions(
+            test_result,
+            {key: float(values[i]) for key, values in confidences.items()},
+            model_version
+        ))
+    predictions = Prediction.objects.bulk_create(predictions)
+    update_risk_summaries(test_results, confidences, model_version)
+    return predictions
+
+
+def update_risk_summaries(test_results, confidences, model_version=''):
+    """
+    Upsert the PatientRiskSummary of each patient from their latest scored test result.
+
+    A summary only moves forward: scoring an older test result of a patient,
+    as a rescore does, leaves a summary of a newer one in place. The check is
+    part of the upsert, so concurrent writers cannot replace a newer summary
+    with an older one.
+    """
+    latest = {}
+    for i, test_result in enumerate(test_results):
+        current = latest.get(test_result.patient_id)
+        if current is None or test_result.id >= test_results[current].id:
+            latest[test_result.patient_id] = i
+    if not latest:
+        return
+
+    updated_at = connection.ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (
+            patient_id,
+            test_results[i].id,
+            *(float(confidences[key][i]) for key in RISK_SUMMARY_CONDITIONS),
+            max(float(values[i]) for values in confidences.values()),
+            model_version,
+            updated_at,
+        )
+        for patient_id, i in latest.items()
+    ]
+
+    quote = connection.ops.quote_name
+    table = quote(PatientRiskSummary._meta.db_table)
+    columns = [quote(PatientRiskSummary._meta.get_field(name).column) for name in RISK_SUMMARY_FIELDS]
+    patient, test_result = columns[:2]
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    # ON CONFLICT ... DO UPDATE ... WHERE reads the same on SQLite and PostgreSQL
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), RISK_SUMMARY_UPSERT_ROWS):
+            chunk = rows[start:start + RISK_SUMMARY_UPSERT_ROWS]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([placeholders] * len(chunk))} "
+                f"ON CONFLICT ({patient}) DO UPDATE SET "
+                f"{', '.join(f'{column} = excluded.{column}' for column in columns[1:])} "
+                f"WHERE excluded.{test_result} >= {table}.{test_result}",
+                [value for row in chunk for value in row]
+            )
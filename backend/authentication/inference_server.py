@@ -0,0 +1,209 @@
+"""
+A standalone inference server shared by all web workers on a host.
+
+`manage.py run_inference_server` owns the models and answers requests over a
+Unix socket. Web workers send the scaled feature matrices through an
+InferenceClient and fall back to scoring in-process when the server is not
+running.
+
+Every message is a 4-byte big-endian header length, a JSON header and a raw
+float32 payload. A request carries the diabetes and heart feature matrices
+and the model version the client encoded them for, which the server scores
+them with; the response carries one diabetes and one heart probability per
+row.
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .model_loader import model_handle, predict_diabetes, predict_heart_failure
+
+logger = logging.getLogger(__name__)
+
+HEADER_LENGTH = struct.Struct('!I')
+
+
+class InferenceServerError(Exception):
+    """The inference server could not be reached or refused the request"""
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, header, payload=b''):
+    encoded = json.dumps(header).encode()
+    sock.sendall(HEADER_LENGTH.pack(len(encoded)) + encoded + payload)
+
+
+def receive_message(sock):
+    """Return the header and payload of the next message"""
+    (length,) = HEADER_LENGTH.unpack(_receive_exactly(sock, HEADER_LENGTH.size))
+    header = json.loads(_receive_exactly(sock, length))
+    payload = _receive_exactly(sock, header.get('payload_bytes', 0))
+    return header, payload
+
+
+def _send_arrays(sock, header, *arrays):
+    payload = b''.join(np.ascontiguousarray(array, dtype=np.float32).tobytes() for array in arrays)
+    send_message(sock, {**header, 'payload_bytes': len(payload)}, payload)
+
+
+def _split_payload(payload, *shapes):
+    arrays, offset = [], 0
+    for shape in shapes:
+        size = int(np.prod(shape)) * 4
+        arrays.append(np.frombuffer(payload, dtype=np.float32, count=size // 4, offset=offset).reshape(shape))
+        offset += size
+    return arrays
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    """Serves predict requests on one client connection until it closes"""
+
+    def handle(self):
+        while True:
+            try:
+                header, payload = receive_message(self.request)
+            except (ConnectionError, OSError):
+                return
+
+            try:
+                # Score with the version the client encoded the rows for, which
+                # can differ from ours for a moment while workers swap versions
+                models = model_handle.get_version(header['version'])
+                diabetes_features, heart_features = _split_payload(
+                    payload, header['diabetes_shape'], header['heart_failure_shape'])
+
+                # The schedulers merge rows from concurrent connections into one batch
+                diabetes_pred = predict_diabetes(diabetes_features, models)
+                heart_pred = predict_heart_failure(heart_features, models)
+            except Exception as e:
+                send_message(self.request, {'ok': False, 'error': str(e)})
+                continue
+
+            _send_arrays(self.request, {'ok': True, 'version': models.version}, diabetes_pred, heart_pred)
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class InferenceClient:
+    """
+    Sends feature matrices to the inference server over a pool of connections.
+
+    predict() returns None instead of raising when the server cannot be used,
+    and the client then waits retry_interval seconds before trying again so
+    that workers do not pay a connection attempt on every request.
+    """
+
+    def __init__(self, socket_path, pool_size=8, timeout=5.0, retry_interval=5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._unavailable_until = 0
+
+    @classmethod
+    def from_settings(cls):
+        config = settings.INFERENCE_SERVER
+        if not config['ENABLED']:
+            return None
+        return cls(config['SOCKET_PATH'], config['POOL_SIZE'], config['TIMEOUT'], config['RETRY_INTERVAL'])
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, sock):
+        try:
+            self._pool.put_nowait(sock)
+        except queue.Full:
+            sock.close()
+
+    def request(self, model_version, diabetes_features, heart_features):
+        """Score the rows on the server; raises InferenceServerError on any failure"""
+        try:
+            sock = self._acquire()
+        except OSError as e:
+            raise InferenceServerError(f'Cannot connect to {self.socket_path}: {e}')
+
+        try:
+            _send_arrays(sock, {
+                'version': model_version,
+                'diabetes_shape': list(diabetes_features.shape),
+                'heart_failure_shape': list(heart_features.shape),
+            }, diabetes_features, heart_features)
+            header, payload = receive_message(sock)
+        except (OSError, ConnectionError, ValueError) as e:
+            sock.close()
+            raise InferenceServerError(f'Inference server request failed: {e}')
+
+        self._release(sock)
+        if not header['ok']:
+            raise InferenceServerError(header['error'])
+        rows = len(diabetes_features)
+        return tuple(_split_payload(payload, (rows,), (rows,)))
+
+    def predict(self, model_version, diabetes_features, heart_features):
+        """Return (diabetes, heart) probabilities from the server, or None if it is unavailable"""
+        if time.monotonic() < self._unavailable_until:
+            return None
+        try:
+            return self.request(model_version, diabetes_features, heart_features)
+        except InferenceServerError as e:
+            logger.warning('Scoring in-process: %s', e)
+            self._unavailable_until = time.monotonic() + self.retry_interval
+            return None
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def serve(socket_path):
+    """Load the models and serve requests on socket_path until interrupted"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server = InferenceServer(socket_path, InferenceRequestHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+inference_client = InferenceClient.from_settings()
@@ -0,0 +1,171 @@
+"""
+Durable background jobs, stored in the BackgroundJob table and run by
+`manage.py run_workers`.
+
+enqueue() inserts the job rows in the caller's transaction, so a job exists
+only once the work that requested it has committed, and is lost with it on a
+rollback. Workers claim due jobs with a conditional UPDATE, which behaves the
+same on SQLite and PostgreSQL: of several workers racing for a job, one
+updates the row and the others update nothing and try the next one.
+
+A claimed job is locked for BACKGROUND_JOBS['VISIBILITY_TIMEOUT'] seconds; if
+its worker dies, the job is claimed again once the lock expires. A failed
+attempt is retried after an exponential backoff with jitter, up to the job's
+max_attempts, after which the job fails and the FAILED_HANDLERS entry of its
+kind is called.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import BackgroundJob
+
+
+class JobError(Exception):
+    """Raised by a job handler for an attempt that failed and should be retried"""
+
+
+def enqueue(kind, payloads, max_attempts=None, delay=0):
+    """Insert one job of a kind per payload, due in delay seconds"""
+    config = settings.BACKGROUND_JOBS
+    if kind not in config['HANDLERS']:
+        raise ValueError(f'Unknown job kind {kind!r}')
+    run_after = timezone.now() + timedelta(seconds=delay)
+    return BackgroundJob.objects.bulk_create([
+        BackgroundJob(
+            kind=kind,
+            payload=payload,
+            max_attempts=max_attempts or config['MAX_ATTEMPTS'],
+            run_after=run_after
+        )
+        for payload in payloads
+    ])
+
+
+def _claimable(now):
+    """Queued jobs that are due, and running jobs whose worker let the lock expire"""
+    return Q(status='queued', run_after__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def claim(worker, kinds=None, candidates=10):
+    """Lock the next due job for worker, or return None when there is none"""
+    now = timezone.now()
+    due = BackgroundJob.objects.filter(_claimable(now))
+    if kinds:
+        due = due.filter(kind__in=kinds)
+
+    locked_until = now + timedelta(seconds=settings.BACKGROUND_JOBS['VISIBILITY_TIMEOUT'])
+    for job_id in due.order_by('run_after', 'id').values_list('id', flat=True)[:candidates]:
+        claimed = BackgroundJob.objects.filter(_claimable(now), id=job_id).update(
+            status='running',
+            attempts=F('attempts') + 1,
+            locked_until=locked_until,
+            locked_by=worker,
+            updated_at=now
+        )
+        if claimed:
+            return BackgroundJob.objects.get(id=job_id)
+    return None
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that failed attempts times"""
+    config = settings.BACKGROUND_JOBS
+    delay = min(config['BACKOFF_MAX_SECONDS'], config['BACKOFF_SECONDS'] * 2 ** (attempts - 1))
+    # Jitter spreads out the retries of jobs that failed together, e.g. during an outage
+    return random.uniform(delay / 2, delay)
+
+
+def _finish(job, worker, **fields):
+    """
+    Record the outcome of an attempt. Returns False, and records nothing, when
+    the lock expired and another worker has claimed the job since.
+    """
+    fields['updated_at'] = timezone.now()
+    recorded = BackgroundJob.objects.filter(id=job.id, locked_by=worker, attempts=job.attempts).update(**fields)
+    for name, value in fields.items():
+        setattr(job, name, value)
+    return bool(recorded)
+
+
+def _fail(job, worker, error):
+    if _finish(job, worker, status='failed', last_error=error, locked_until=None, finished_at=timezone.now()):
+        failed = settings.BACKGROUND_JOBS['FAILED_HANDLERS'].get(job.kind)
+        if failed:
+            import_string(failed)(job.payload)
+
+
+def run(job, worker):
+    """Run a job claimed by worker and record the outcome; returns True when it succeeded"""
+    if job.attempts > job.max_attempts:
+        # The worker of the last attempt died or overran the visibility timeout
+        _fail(job, worker, job.last_error or 'Visibility timeout expired on the last attempt')
+        return False
+
+    try:
+        import_string(settings.BACKGROUND_JOBS['HANDLERS'][job.kind])(job.payload)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        if job.attempts >= job.max_attempts:
+            _fail(job, worker, error)
+        else:
+            _finish(
+                job, worker,
+                status='queued',
+                last_error=error,
+                locked_until=None,
+                run_after=timezone.now() + timedelta(seconds=backoff(job.attempts))
+            )
+        return False
+
+    _finish(job, worker, status='succeeded', locked_until=None, finished_at=timezone.now())
+    return True
+
+
+def purge_finished_jobs():
+    """Delete the succeeded jobs older than BACKGROUND_JOBS['KEEP_SUCCEEDED_DAYS']; failed jobs are kept"""
+    cutoff = timezone.now() - timedelta(days=settings.BACKGROUND_JOBS['KEEP_SUCCEEDED_DAYS'])
+    deleted, _ = BackgroundJob.objects.filter(status='succeeded', finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def queue_stats():
+    """
+    Queue depth per job kind: the jobs in each status, the queued jobs that are
+    due and the age in seconds of the oldest, and the running jobs whose lock
+    has expired.
+    """
+    now = timezone.now()
+    stats = {}
+
+    def kind_stats(kind):
+        return stats.setdefault(kind, {
+            **{status: 0 for status, _ in BackgroundJob.STATUS_CHOICES},
+            'due': 0,
+            'oldest_due_seconds': None,
+            'expired_locks': 0,
+        })
+
+    for row in BackgroundJob.objects.values('kind', 'status').annotate(jobs=Count('id')).order_by():
+        kind_stats(row['kind'])[row['status']] = row['jobs']
+
+    due = (
+        BackgroundJob.objects.filter(status='queued', run_after__lte=now)
+        .values('kind').annotate(jobs=Count('id'), oldest=Min('run_after')).order_by()
+    )
+    for row in due:
+        entry = kind_stats(row['kind'])
+        entry['due'] = row['jobs']
+        entry['oldest_due_seconds'] = round((now - row['oldest']).total_seconds(), 1)
+
+    expired = (
+        BackgroundJob.objects.filter(status='running', locked_until__lt=now)
+        .values('kind').annotate(jobs=Count('id')).order_by()
+    )
+    for row in expired:
+        kind_stats(row['kind'])['expired_locks'] = row['jobs']
+    return stats
@@ -0,0 +1,189 @@
+"""
+Clients of the language model that writes treatment plans.
+
+Treatment plans only need two calls: generate() returns the text of a
+response, and stream() yields it in chunks as it is generated. The client is
+chosen by settings.LLM_CLIENT['BACKEND']:
+
+- 'gemini' calls the Gemini API.
+- 'fake' answers locally with canned treatment text after a simulated
+  latency, failing at a configured rate. It makes the prediction and plan
+  paths runnable, and measurable under load, on a machine with no network
+  access or API key.
+"""
+import math
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+
+
+class LLMError(Exception):
+    """A call to the language model failed or timed out"""
+
+
+class GeminiClient:
+    """The Gemini API; the SDK is imported and configured on first use, which takes most of a second"""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=settings.GEMINI_API_KEY)
+                self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt, timeout=None):
+        request_options = {'timeout': timeout} if timeout else None
+        return self.model.generate_content(prompt, request_options=request_options).text
+
+    def stream(self, prompt, timeout=None):
+        request_options = {'timeout': timeout} if timeout else None
+        for chunk in self.model.generate_content(prompt, stream=True, request_options=request_options):
+            yield chunk.text
+
+
+# Canned responses of the fake client, in the layout the treatment plan parsers expect
+FAKE_RESPONSES = {
+    'Diabetes': (
+        "Start metformin alongside a structured diet and exercise programme, and review glucose "
+        "control in three months.\n\n"
+        "Key Medications:\n- Metformin 500 mg twice daily with meals\n- Consider an SGLT2 inhibitor if HbA1c stays above target\n"
+        "Lifestyle Changes:\n- 150 minutes of moderate exercise per week\n- Reduce refined carbohydrates and sugary drinks\n"
+        "Follow-up:\n- HbA1c and fasting glucose in 3 months\n"
+        "Critical Warning Signs:\n- Excessive thirst or urination\n- Blurred vision\n- Confusion or fainting\n"
+    ),
+    'Heart Disease': (
+        "Begin a statin and blood pressure control, and refer to cardiology for further "
+        "assessment of the chest pain.\n\n"
+        "Key Medications:\n- Atorvastatin 20 mg daily\n- Low-dose aspirin unless contraindicated\n"
+        "Lifestyle Changes:\n- Stop smoking\n- Low-salt, low-saturated-fat diet\n"
+        "Follow-up:\n- Cardiology review within 4 weeks\n"
+        "Critical Warning Signs:\n- Chest pain at rest\n- Shortness of breath\n- Pain spreading to the arm or jaw\n"
+    ),
+}
+FAKE_DEFAULT_RESPONSE = (
+    "No treatment is needed now; keep up a healthy lifestyle and routine check-ups.\n\n"
+    "Key Medications:\n- None\n"
+    "Lifestyle Changes:\n- Balanced diet and regular exercise\n"
+    "Follow-up:\n- Routine check-up in 12 months\n"
+    "Critical Warning Signs:\n- Any new chest pain or unusual thirst\n"
+)
+
+
+class FakeLLMClient:
+    """
+    A local stand-in for Gemini. Each call takes a latency drawn from LATENCY,
+    fails with LLMError at ERROR_RATE, and answers with the FAKE_RESPONSES
+    text of the condition named in the prompt. stream() sends the first of
+    CHUNKS chunks after FIRST_CHUNK_MS and spreads the rest of the latency
+    over the others.
+    """
+
+    def __init__(self, latency, first_chunk_ms=300, chunks=8, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.first_chunk_ms = first_chunk_ms
+        self.chunks = max(1, chunks)
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.get('LATENCY', {'DISTRIBUTION': 'constant', 'MEDIAN_MS': 0}),
+            config.get('FIRST_CHUNK_MS', 300),
+            config.get('CHUNKS', 8),
+            config.get('ERROR_RATE', 0.0),
+            config.get('SEED')
+        )
+
+    def sample_latency(self):
+        """Seconds a call takes, drawn from the LATENCY distribution"""
+        latency = self.latency
+        distribution = latency.get('DISTRIBUTION', 'constant')
+        with self._lock:
+            if distribution == 'constant':
+                ms = latency['MEDIAN_MS']
+            elif distribution == 'uniform':
+                ms = self._random.uniform(latency['MIN_MS'], latency['MAX_MS'])
+            elif distribution == 'lognormal':
+                # Long-tailed like real API latencies, with MEDIAN_MS as the median
+                ms = self._random.lognormvariate(0, latency.get('SIGMA', 0.5)) * latency['MEDIAN_MS']
+            else:
+                raise ValueError(f'Unknown latency distribution: {distribution}')
+        ms = max(ms, latency.get('MIN_MS', 0))
+        if latency.get('MAX_MS') is not None:
+            ms = min(ms, latency['MAX_MS'])
+        return ms / 1000
+
+    def _fails(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _response(self, prompt):
+        condition = re.search(r'^Condition: (.+)$', prompt, re.MULTILINE)
+        return FAKE_RESPONSES.get(condition.group(1).strip() if condition else None, FAKE_DEFAULT_RESPONSE)
+
+    def _wait(self, seconds, deadline):
+        """Sleep, raising LLMError instead when the call would pass its deadline"""
+        if deadline is not None and time.monotonic() + seconds > deadline:
+            time.sleep(max(0.0, deadline - time.monotonic()))
+            raise LLMError('Fake LLM call timed out')
+        time.sleep(seconds)
+
+    def generate(self, prompt, timeout=None):
+        deadline = time.monotonic() + timeout if timeout else None
+        self._wait(self.sample_latency(), deadline)
+        if self._fails():
+            raise LLMError('Fake LLM error')
+        return self._response(prompt)
+
+    def stream(self, prompt, timeout=None):
+        deadline = time.monotonic() + timeout if timeout else None
+        latency = self.sample_latency()
+        first_chunk = min(self.first_chunk_ms / 1000, latency)
+        text = self._response(prompt)
+        size = math.ceil(len(text) / self.chunks)
+        failing_chunk = None
+        if self._fails():
+            with self._lock:
+                failing_chunk = self._random.randrange(self.chunks)
+
+        self._wait(first_chunk, deadline)
+        for index, start in enumerate(range(0, len(text), size)):
+            if index:
+                self._wait((latency - first_chunk) / (self.chunks - 1), deadline)
+            if index == failing_chunk:
+                raise LLMError('Fake LLM error')
+            yield text[start:start + size]
+
+
+def build_client(config):
+    """Create the client described by settings.LLM_CLIENT"""
+    backend = config.get('BACKEND', 'gemini')
+    if backend == 'gemini':
+        return GeminiClient(config.get('MODEL', 'gemini-1.5-flash'))
+    if backend == 'fake':
+        return FakeLLMClient.from_config(config.get('FAKE', {}))
+    raise ValueError(f'Unknown LLM backend: {backend}')
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = build_client(settings.LLM_CLIENT)
+    return _client
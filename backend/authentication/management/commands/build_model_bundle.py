@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.bundle import ModelBundle, pack_models, write_bundle
+from authentication.engines import DenseNetwork, TreeEnsemble
+from authentication.features import RAW_COLUMNS, FeatureVectorizer
+from authentication.model_loader import MODELS_DIR, load_diabetes_scaler, load_heart_failure_encoder, load_heart_failure_scaler
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert the Keras model, XGBoost booster, scalers and label encoders in models/ '
+        'into a single memory-mappable model bundle, and check that the bundle reproduces them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.MODEL_BUNDLE_PATH or os.path.join(MODELS_DIR, 'prognosys.bundle'),
+                            help='Path of the bundle to write')
+        parser.add_argument('--samples', type=int, default=1000,
+                            help='Number of random rows used to check the written bundle')
+
+    def handle(self, *args, **options):
+        diabetes_network = DenseNetwork.from_keras_file(os.path.join(MODELS_DIR, 'diabetes_model.keras'))
+        booster_path = os.path.join(MODELS_DIR, 'xgb_heart.json')
+        heart_failure_ensemble = TreeEnsemble.from_xgboost_json(booster_path)
+        with open(booster_path, 'rb') as booster_file:
+            heart_failure_booster = booster_file.read()
+        diabetes_scaler = load_diabetes_scaler()
+        heart_failure_scaler = load_heart_failure_scaler()
+        heart_failure_encoder = load_heart_failure_encoder()
+
+        arrays, metadata = pack_models(
+            diabetes_network, heart_failure_ensemble, diabetes_scaler, heart_failure_scaler, heart_failure_encoder,
+            heart_failure_booster)
+        version = write_bundle(options['output'], arrays, metadata)
+
+        # The bundle stores the exact arrays, so its outputs must be identical
+        bundle = ModelBundle(options['output'])
+        rng = np.random.default_rng(0)
+        raw = rng.normal(size=(options['samples'], len(RAW_COLUMNS)))
+        vectorizer = FeatureVectorizer.from_artifacts(diabetes_scaler, heart_failure_scaler, heart_failure_encoder)
+        diabetes_features, heart_features = vectorizer.scale(raw)
+        bundle_diabetes, bundle_heart = bundle.vectorizer().scale(raw)
+
+        if not (np.array_equal(diabetes_features, bundle_diabetes) and np.array_equal(heart_features, bundle_heart)):
+            raise CommandError('Bundle preprocessing differs from the scalers')
+        if not np.array_equal(diabetes_network.predict(diabetes_features), bundle.diabetes_network().predict(diabetes_features)):
+            raise CommandError('Bundle diabetes network differs from the Keras model')
+        if not np.array_equal(heart_failure_ensemble.predict(heart_features), bundle.heart_failure_ensemble().predict(heart_features)):
+            raise CommandError('Bundle heart failure trees differ from the XGBoost booster')
+
+        size = os.path.getsize(options['output'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote model bundle {version} to {options['output']} ({size / 1024:.1f} KiB)"))
@@ -0,0 +1,89 @@
+import os
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.engines import DenseNetwork, TreeEnsemble
+from authentication.model_loader import MODELS_DIR, load_diabetes_scaler, load_heart_failure_encoder, load_heart_failure_scaler
+
+
+class Command(BaseCommand):
+    help = (
+        'Check that the NumPy diabetes engine and the compiled heart failure evaluator '
+        'match the Keras model and XGBoost booster on reference datasets drawn from the '
+        'training distributions of the scalers.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=10000,
+                            help='Number of reference rows to score')
+        parser.add_argument('--tolerance', type=float, default=1e-5,
+                            help='Maximum allowed absolute difference between probabilities')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        failures = [
+            name for name, check in [('diabetes', self.check_diabetes), ('heart_failure', self.check_heart_failure)]
+            if not check(rng, options)
+        ]
+
+        if failures:
+            raise CommandError(f"Engine output differs from the reference model beyond the tolerance: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS('Inference engines match the reference models'))
+
+    def check_diabetes(self, rng, options):
+        import tensorflow as tf
+
+        model_path = os.path.join(MODELS_DIR, 'diabetes_model.keras')
+        keras_model = tf.keras.models.load_model(model_path)
+        engine = DenseNetwork.from_keras_file(model_path)
+
+        # Sample raw feature rows around the means and spreads the scaler was
+        # fitted on (the measurements are never negative), then scale them
+        # exactly as the prediction path does.
+        scaler = load_diabetes_scaler()
+        raw = rng.normal(scaler.mean_, scaler.scale_, size=(options['samples'], len(scaler.mean_)))
+        features = scaler.transform(np.clip(raw, 0, None))
+
+        expected = keras_model.predict(features, batch_size=1024, verbose=0)[:, 0]
+        return self._compare('diabetes', expected, engine.predict(features)[:, 0], engine.predict, features, options)
+
+    def check_heart_failure(self, rng, options):
+        import xgboost as xgb
+
+        model_path = os.path.join(MODELS_DIR, 'xgb_heart.json')
+        booster = xgb.Booster()
+        booster.load_model(model_path)
+        engine = TreeEnsemble.from_xgboost_json(model_path)
+
+        # Continuous measurements are drawn like the diabetes features; binary
+        # columns use the positive rate the scaler saw and multi-class columns
+        # are drawn uniformly over the encoder classes.
+        scaler = load_heart_failure_scaler()
+        encoders = load_heart_failure_encoder()
+        samples = options['samples']
+        raw = np.clip(rng.normal(scaler.mean_, scaler.scale_, size=(samples, len(scaler.mean_))), 0, None)
+        for column in (1, 5, 8):
+            raw[:, column] = rng.random(samples) < scaler.mean_[column]
+        raw[:, 2] = rng.integers(len(encoders['chest_pain_encoder'].classes_), size=samples)
+        raw[:, 6] = rng.integers(len(encoders['resting_ecg_encoder'].classes_), size=samples)
+        features = scaler.transform(raw)
+
+        expected = booster.predict(xgb.DMatrix(features))
+        return self._compare('heart_failure', expected, engine.predict(features), engine.predict, features, options)
+
+    def _compare(self, name, expected, actual, predict, features, options):
+        max_error = float(np.abs(expected - actual).max())
+        self.stdout.write(f'{name}: max abs error {max_error:.2e} over {len(features)} rows '
+                          f'(tolerance {options["tolerance"]:.0e})')
+        self.stdout.write(f'{name}: single-row latency {self._single_row_latency(predict, features):.1f}us')
+        return max_error <= options['tolerance']
+
+    def _single_row_latency(self, predict, features, repeats=2000):
+        rows = [features[i % len(features)].reshape(1, -1) for i in range(repeats)]
+        start = time.perf_counter()
+        for row in rows:
+            predict(row)
+        return (time.perf_counter() - start) / repeats * 1e6
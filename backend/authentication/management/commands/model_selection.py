@@ -0,0 +1,121 @@
+import csv
+import json
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication import model_selection, registry
+from authentication.bundle import replace_diabetes_model, replace_heart_failure_model, write_bundle
+from authentication.training import DIABETES_LABELS, HEART_LABELS, load_training_data, serving_bundle
+
+LEADERBOARD_COLUMNS = [
+    'rank', 'eligible', 'accuracy', 'accuracy_std', 'logloss', 'logloss_std', 'auc', 'auc_std',
+    'single_row_us', 'batch_1000_ms', 'params',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Cross-validate a grid of diabetes or heart failure candidates in a process pool and '
+        'print a leaderboard of accuracy and serving latency. Features go through the same '
+        'preprocessing as generate_prediction. Candidates slower to serve than the current '
+        'model are ranked last and are never exported.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['diabetes', 'heart_failure'], required=True)
+        parser.add_argument('--data-csv',
+                            help='CSV of test result fields, age, gender and a diabetes/heart_disease 0-1 column; '
+                                 'defaults to the reviewed predictions in the database')
+        parser.add_argument('--folds', type=int, default=5)
+        parser.add_argument('--workers', type=int, help='Worker processes (defaults to every core)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--max-latency-ratio', type=float, default=1.1,
+                            help='Largest single-row latency allowed, relative to the serving model')
+        parser.add_argument('--max-single-row-us', type=float,
+                            help='Largest single-row latency allowed in microseconds (overrides --max-latency-ratio)')
+        parser.add_argument('--output', help='Write the leaderboard to this CSV file')
+        parser.add_argument('--export', help='Write a bundle with the best eligible candidate to this path')
+        parser.add_argument('--register', action='store_true', help='Register the exported bundle')
+        parser.add_argument('--activate', action='store_true', help='Register and activate the exported bundle')
+
+    def handle(self, *args, **options):
+        model = options['model']
+        bundle = serving_bundle()
+        vectorizer = bundle.vectorizer()
+
+        if options['data_csv']:
+            rows, labels = model_selection.read_csv_rows(options['data_csv'], model_selection.LABEL_COLUMNS[model])
+            diabetes_features, heart_features = vectorizer.transform_rows(rows)
+        else:
+            condition_labels = DIABETES_LABELS if model == 'diabetes' else HEART_LABELS
+            diabetes_features, heart_features, labels, _ = load_training_data(vectorizer, condition_labels, 2000)
+        features = diabetes_features if model == 'diabetes' else heart_features
+
+        if len(np.unique(labels)) < 2 or np.bincount(labels.astype(int)).min() < options['folds']:
+            raise CommandError(f'Each class needs at least {options["folds"]} labelled rows for {options["folds"]}-fold cross-validation')
+        self.stdout.write(f'{len(labels)} rows ({int(labels.sum())} positive), '
+                          f"{len(model_selection.candidates(model_selection.GRIDS[model]))} candidates, {options['folds']} folds")
+
+        # The serving model is the reference every candidate is compared with
+        serving_engine = bundle.diabetes_network() if model == 'diabetes' else bundle.heart_failure_ensemble()
+        serving_single_us, serving_batch_ms = model_selection.measure_latency(serving_engine, features)
+        serving_metrics = model_selection.score(model_selection.predict(serving_engine, features), labels)
+        self.stdout.write(
+            f"Serving model {bundle.version}: accuracy {serving_metrics['accuracy']:.4f} on all rows (not cross-validated), "
+            f'{serving_single_us:.1f}us per row, {serving_batch_ms:.2f}ms per 1000 rows')
+
+        max_single_row_us = options['max_single_row_us'] or serving_single_us * options['max_latency_ratio']
+        leaderboard = model_selection.rank(
+            model_selection.run_selection(model, features, labels, options['folds'], options['workers'], seed=options['seed']),
+            max_single_row_us
+        )
+
+        self.print_leaderboard(leaderboard, max_single_row_us)
+        if options['output']:
+            self.write_leaderboard(leaderboard, options['output'])
+        if options['export']:
+            self.export(bundle, leaderboard, options)
+
+    def print_leaderboard(self, leaderboard, max_single_row_us):
+        self.stdout.write(f'Latency limit: {max_single_row_us:.1f}us per row')
+        self.stdout.write(f"{'rank':>4}  {'accuracy':>15}  {'logloss':>8}  {'auc':>6}  {'row us':>8}  {'1k ms':>7}  params")
+        for entry in leaderboard:
+            auc = f"{entry['auc']:.4f}" if entry['auc'] is not None else '-'
+            self.stdout.write(
+                f"{entry['rank']:>4}  {entry['accuracy']:.4f} ±{entry['accuracy_std']:.4f}  {entry['logloss']:>8.4f}  "
+                f"{auc:>6}  {entry['single_row_us']:>8.1f}  {entry['batch_1000_ms']:>7.2f}  "
+                f"{json.dumps(entry['params'])}{'' if entry['eligible'] else '  (too slow)'}"
+            )
+
+    def write_leaderboard(self, leaderboard, path):
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=LEADERBOARD_COLUMNS, extrasaction='ignore')
+            writer.writeheader()
+            for entry in leaderboard:
+                writer.writerow({**entry, 'params': json.dumps(entry['params'])})
+        self.stdout.write(f'Wrote leaderboard to {path}')
+
+    def export(self, bundle, leaderboard, options):
+        winner = leaderboard[0]
+        if not winner['eligible']:
+            raise CommandError('No candidate is as fast to serve as the current model; nothing exported')
+
+        if winner['model'] == 'diabetes':
+            arrays, metadata = replace_diabetes_model(bundle, winner['engine'])
+        else:
+            arrays, metadata = replace_heart_failure_model(bundle, winner['engine'], winner['booster_json'])
+        version = write_bundle(options['export'], arrays, metadata)
+        self.stdout.write(self.style.SUCCESS(f"Exported {winner['model']} candidate {json.dumps(winner['params'])} "
+                                             f"as bundle {version} to {options['export']}"))
+
+        if options['register'] or options['activate']:
+            metrics = {key: winner[key] for key in LEADERBOARD_COLUMNS if key not in ('rank', 'eligible')}
+            model_version = registry.register_bundle(
+                options['export'],
+                description=f"model_selection {winner['model']} candidate based on {bundle.version}",
+                metrics=metrics,
+                activate=options['activate']
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Registered model version {model_version.version}{' (active)' if model_version.is_active else ''}"))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.bundle import BundleError
+from authentication.registry import register_bundle
+
+
+class Command(BaseCommand):
+    help = (
+        'Add a model bundle to the registry. With --activate every worker switches to it '
+        'within MODEL_REGISTRY["POLL_INTERVAL"] seconds, without a restart.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('bundle', nargs='?', default=settings.MODEL_BUNDLE_PATH,
+                            help='Path of the bundle to register (defaults to MODEL_BUNDLE_PATH)')
+        parser.add_argument('--description', default='')
+        parser.add_argument('--activate', action='store_true',
+                            help='Make the bundle the active model version')
+
+    def handle(self, *args, **options):
+        try:
+            model_version = register_bundle(options['bundle'], options['description'], activate=options['activate'])
+        except (OSError, BundleError) as e:
+            raise CommandError(f"Cannot register {options['bundle']}: {e}")
+
+        state = 'active' if model_version.is_active else 'inactive'
+        self.stdout.write(self.style.SUCCESS(f'Registered model version {model_version.version} ({state})'))
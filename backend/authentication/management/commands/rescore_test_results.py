@@ -0,0 +1,123 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, transaction
+from django.db.models.functions import Mod
+
+from authentication.feature_store import split_scorable
+from authentication.inference import predict_test_results
+from authentication.model_loader import get_models, model_handle
+from authentication.models import RescoreCheckpoint, TestResult
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-score every test result with a model version and store the new predictions. '
+        'Test results are read in id order, one chunk at a time, and the progress of each '
+        'shard is checkpointed so an interrupted run resumes where it stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model-version',
+                            help='Registered model version to score with (defaults to the serving version)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Test results scored and inserted per transaction')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Split the table into this many shards and score each in its own process')
+        parser.add_argument('--shard', type=int,
+                            help='Only score test results whose id modulo --shards equals this value')
+        parser.add_argument('--shards', type=int, default=1)
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore existing checkpoints and start from the first test result')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        try:
+            models = model_handle.get_version(options['model_version']) if options['model_version'] else get_models()
+        except LookupError as e:
+            raise CommandError(str(e))
+
+        if options['shard'] is None and options['processes'] > 1:
+            return self.run_processes(models.version, options)
+
+        shard = options['shard'] or 0
+        shards = options['shards'] if options['shard'] is not None else 1
+        if not 0 <= shard < shards:
+            raise CommandError('--shard must be between 0 and --shards - 1')
+        self.rescore(models, shard, shards, options)
+
+    def run_processes(self, model_version, options):
+        """Run one child process per shard and wait for all of them"""
+        processes = options['processes']
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'rescore_test_results',
+            '--model-version', model_version,
+            '--chunk-size', str(options['chunk_size']),
+            '--shards', str(processes),
+        ]
+        if options['restart']:
+            command.append('--restart')
+
+        children = [subprocess.Popen(command + ['--shard', str(shard)]) for shard in range(processes)]
+        failed = [shard for shard, child in enumerate(children) if child.wait() != 0]
+        if failed:
+            raise CommandError(f"Shards {', '.join(map(str, failed))} failed; run the command again to resume them")
+        self.stdout.write(self.style.SUCCESS(f'Rescored all test results with model version {model_version}'))
+
+    def rescore(self, models, shard, shards, options):
+        checkpoint, _ = RescoreCheckpoint.objects.get_or_create(
+            model_version=models.version, shard=shard, shards=shards)
+        if options['restart']:
+            checkpoint.last_test_result_id = 0
+            checkpoint.processed = 0
+            checkpoint.completed = False
+            checkpoint.save()
+        if checkpoint.completed:
+            self.stdout.write(f'Shard {shard + 1}/{shards} already rescored with {models.version}; use --restart to redo it')
+            return
+
+        # Stored feature vectors make the patient and user join unnecessary
+        test_results = TestResult.objects.order_by('id')
+        if shards > 1:
+            test_results = test_results.annotate(rescore_shard=Mod('id', shards)).filter(rescore_shard=shard)
+
+        started = time.monotonic()
+        start_count = checkpoint.processed
+        skipped = 0
+        while True:
+            # Keyset pagination: each chunk is an index range scan, however far in we are
+            chunk = list(test_results.filter(id__gt=checkpoint.last_test_result_id)[:options['chunk_size']])
+            if not chunk:
+                break
+
+            # Rows with values the encoders do not know cannot be scored; one must not stop the shard
+            scorable, unscorable = split_scorable(chunk, models.vectorizer)
+            if unscorable:
+                skipped += len(unscorable)
+                self.stderr.write(f"Shard {shard + 1}/{shards}: skipped test results with unknown categories: "
+                                  f"{', '.join(str(test_result.id) for test_result in unscorable)}")
+
+            # The predictions and the checkpoint commit together, so a chunk is never stored twice
+            with transaction.atomic():
+                predict_test_results(scorable, models, use_cache=False)
+                checkpoint.last_test_result_id = chunk[-1].id
+                checkpoint.processed += len(chunk)
+                checkpoint.save(update_fields=['last_test_result_id', 'processed', 'updated_at'])
+
+            # With DEBUG on every query is kept on the connection
+            reset_queries()
+            rate = (checkpoint.processed - start_count) / max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'Shard {shard + 1}/{shards}: {checkpoint.processed} test results '
+                              f'(up to id {checkpoint.last_test_result_id}, {rate:.0f}/s)')
+
+        checkpoint.completed = True
+        checkpoint.save(update_fields=['completed', 'updated_at'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Shard {shard + 1}/{shards}: rescored {checkpoint.processed} test results with model version {models.version}'
+            + (f'; skipped {skipped} with unknown categories in this run' if skipped else '')))
@@ -0,0 +1,41 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication.drift import bin_count, bin_rows, reset_histograms
+from authentication.features import RAW_COLUMNS
+from authentication.model_loader import get_models
+from authentication.model_selection import read_csv_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Empty the drift histograms of the serving preprocessing and set their baseline. '
+        'The baseline is the histogram of --data-csv when given; without it only two-valued '
+        'inputs get a baseline, from the scalers, and the other inputs raise no drift alerts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-csv',
+                            help='CSV of training test result fields, age and gender, as read by model_selection')
+
+    def handle(self, *args, **options):
+        vectorizer = get_models().vectorizer
+
+        baseline = None
+        if options['data_csv']:
+            try:
+                rows, _ = read_csv_rows(options['data_csv'])
+                bins = bin_rows(vectorizer, [vectorizer.raw_value_row(row) for row in rows])
+            except (OSError, KeyError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['data_csv']}: {e}")
+            if not len(bins):
+                raise CommandError(f"{options['data_csv']} has no rows")
+            baseline = {
+                feature: list(np.bincount(bins[:, column], minlength=bin_count(vectorizer, feature)) / len(bins))
+                for column, feature in enumerate(RAW_COLUMNS)
+            }
+
+        reset_histograms(vectorizer, baseline)
+        source = f"{len(bins)} rows of {options['data_csv']}" if baseline else 'the scalers'
+        self.stdout.write(self.style.SUCCESS(
+            f'Reset the drift histograms of preprocessing {vectorizer.preprocessing_version} with a baseline from {source}'))
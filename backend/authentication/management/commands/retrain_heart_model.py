@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from django.utils import timezone
+
+from authentication.models import TrainingJob
+from authentication.training import run_training_job, update_job
+
+
+class Command(BaseCommand):
+    help = (
+        'Retrain the heart failure model on reviewed predictions, warm-starting from the '
+        'serving booster, and register the result as a new model version.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', type=int,
+                            help='TrainingJob to run (started by the retrain endpoint); a new job is created if omitted')
+        parser.add_argument('--activate', action='store_true',
+                            help='Activate the new version when creating a job')
+
+    def handle(self, *args, **options):
+        if options['job'] is not None:
+            try:
+                job = TrainingJob.objects.get(pk=options['job'])
+            except TrainingJob.DoesNotExist:
+                raise CommandError(f"Training job {options['job']} not found")
+        else:
+            try:
+                job = TrainingJob.objects.create(activate=options['activate'])
+            except IntegrityError:
+                raise CommandError('Another training job is queued or running')
+
+        try:
+            model_version = run_training_job(job)
+        except Exception as e:
+            update_job(job, status='failed', message=str(e), finished_at=timezone.now())
+            raise CommandError(f'Training job {job.pk} failed: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Training job {job.pk} registered model version {model_version.version}'
+            f"{' (active)' if model_version.is_active else ''}"
+        ))
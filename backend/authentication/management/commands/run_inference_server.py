@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from authentication.inference_server import serve
+from authentication.model_loader import get_models, warmup
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the prediction models once and serve them to the web workers on this host '
+        'over a Unix socket. Workers use it when INFERENCE_SERVER["ENABLED"] is set.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.INFERENCE_SERVER['SOCKET_PATH'],
+                            help='Path of the Unix socket to listen on')
+
+    def handle(self, *args, **options):
+        models = get_models().ensure_models()
+        warmup()
+
+        self.stdout.write(f"Serving model {models.version} on {options['socket']}")
+        try:
+            serve(options['socket'])
+        except KeyboardInterrupt:
+            self.stdout.write('Inference server stopped')
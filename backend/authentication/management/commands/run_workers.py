@@ -0,0 +1,118 @@
+import os
+import signal
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from authentication.caches import recommendation_cache
+from authentication.jobs import claim, purge_finished_jobs, queue_stats, run
+from authentication.similarity import purge_deleted_test_results
+
+# Seconds between purges of old succeeded jobs and deleted test result records, and queue depth and cache reports
+HOUSEKEEPING_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        'Run background jobs (see authentication/jobs.py) with a pool of worker threads. '
+        'Several copies can run on any number of hosts; each job is run by one worker at a time. '
+        'SIGTERM or Ctrl-C stops the workers once their current job is done.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.BACKGROUND_JOBS['WORKERS'],
+                            help='Number of jobs run concurrently')
+        parser.add_argument('--kind', action='append', dest='kinds',
+                            help='Only run jobs of this kind; may be repeated')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no job is due instead of waiting for more')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+        unknown = set(options['kinds'] or ()) - set(settings.BACKGROUND_JOBS['HANDLERS'])
+        if unknown:
+            raise CommandError(f"Unknown job kinds: {', '.join(sorted(unknown))}")
+
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(f'{prefix}:{index}', options['kinds'], options['burst'], stop),
+                name=f'job-worker-{index}'
+            )
+            for index in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} job workers on {prefix}")
+
+        housekeeping = 0
+        while any(thread.is_alive() for thread in threads):
+            if time.monotonic() - housekeeping >= HOUSEKEEPING_INTERVAL and not options['burst']:
+                housekeeping = time.monotonic()
+                self.housekeeping()
+            # Returns as soon as the thread exits, so --burst does not linger
+            next(thread for thread in threads if thread.is_alive()).join(timeout=1)
+        for thread in threads:
+            thread.join()
+        connection.close()
+        self.stdout.write('Job workers stopped')
+
+    def housekeeping(self):
+        try:
+            purged = purge_finished_jobs()
+            purged_deletions = purge_deleted_test_results()
+            stats = queue_stats()
+        except DatabaseError as e:
+            self.stderr.write(f'Housekeeping failed: {e}')
+            return
+        if purged:
+            self.stdout.write(f'Purged {purged} succeeded jobs')
+        if purged_deletions:
+            self.stdout.write(f'Purged {purged_deletions} deleted test result records')
+        for kind, entry in sorted(stats.items()):
+            self.stdout.write(
+                f"{kind}: {entry['due']} due (oldest {entry['oldest_due_seconds']}s), "
+                f"{entry['running']} running, {entry['failed']} failed"
+            )
+        cache = recommendation_cache.stats()
+        self.stdout.write(
+            f"Recommendation cache: {cache['hits']} hits, {cache['misses']} misses "
+            f"(hit rate {cache['hit_rate']:.1%}) in this process"
+        )
+
+    def work(self, worker, kinds, burst, stop):
+        poll_interval = settings.BACKGROUND_JOBS['POLL_INTERVAL']
+        try:
+            while not stop.is_set():
+                try:
+                    job = claim(worker, kinds)
+                    if job is None:
+                        if burst:
+                            return
+                        stop.wait(poll_interval)
+                        continue
+                    started = time.monotonic()
+                    succeeded = run(job, worker)
+                except DatabaseError as e:
+                    # Drop the connection and open a new one; a job left running is claimed again when its lock expires
+                    self.stderr.write(f'{worker}: database error: {e}')
+                    connection.close()
+                    stop.wait(poll_interval)
+                    continue
+
+                self.stdout.write(
+                    f"{worker}: {job.kind} job {job.id} {job.status} after attempt {job.attempts} "
+                    f"in {time.monotonic() - started:.2f}s" + ('' if succeeded else f': {job.last_error}')
+                )
+        finally:
+            connection.close()
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0014_trainingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RescoreCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_version', models.CharField(max_length=64)),
+                ('shard', models.IntegerField(default=0)),
+                ('shards', models.IntegerField(default=1)),
+                ('last_test_result_id', models.BigIntegerField(default=0)),
+                ('processed', models.IntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('model_version', 'shard', 'shards')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0015_rescorecheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PredictionTiming',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_version', models.CharField(blank=True, max_length=64)),
+                ('input_hash', models.CharField(blank=True, max_length=32)),
+                ('cache_hit', models.BooleanField(default=False)),
+                ('fetch_ms', models.FloatField(blank=True, null=True)),
+                ('encode_ms', models.FloatField(blank=True, null=True)),
+                ('diabetes_model_ms', models.FloatField(blank=True, null=True)),
+                ('heart_model_ms', models.FloatField(blank=True, null=True)),
+                ('inference_server_ms', models.FloatField(blank=True, null=True)),
+                ('save_ms', models.FloatField(blank=True, null=True)),
+                ('treatment_plan_ms', models.FloatField(blank=True, null=True)),
+                ('total_ms', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('test_result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prediction_timings', to='authentication.testresult')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0016_predictiontiming'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatientRiskSummary',
+            fields=[
+                ('patient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='risk_summary', serialize=False, to='authentication.patientprofile')),
+                ('diabetes_confidence', models.FloatField()),
+                ('heart_disease_confidence', models.FloatField()),
+                ('risk_confidence', models.FloatField()),
+                ('model_version', models.CharField(blank=True, max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('test_result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='authentication.testresult')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-risk_confidence'], name='risk_summary_risk_idx'), models.Index(fields=['-diabetes_confidence'], name='risk_summary_diabetes_idx'), models.Index(fields=['-heart_disease_confidence'], name='risk_summary_heart_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0017_patientrisksummary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('test_results', 'New Test Results Available'), ('appointment', 'Appointment Reminder/Update'), ('critical_alert', 'Critical Patient Alert'), ('prescription', 'Prescription Update'), ('patient_update', 'Patient Information Update'), ('treatment_plan', 'Treatment Plan Update'), ('drift_alert', 'Model Input Drift Alert')], default='patient_update', max_length=50),
+        ),
+        migrations.CreateModel(
+            name='DriftAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('preprocessing_version', models.CharField(max_length=32)),
+                ('feature', models.CharField(max_length=50)),
+                ('psi', models.FloatField()),
+                ('samples', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'unique_together': {('preprocessing_version', 'feature')},
+            },
+        ),
+        migrations.CreateModel(
+            name='FeatureHistogramBin',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('preprocessing_version', models.CharField(max_length=32)),
+                ('feature', models.CharField(max_length=50)),
+                ('bin', models.PositiveSmallIntegerField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('baseline_fraction', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'unique_together': {('preprocessing_version', 'feature', 'bin')},
+            },
+        ),
+    ]
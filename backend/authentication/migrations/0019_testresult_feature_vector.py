@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0018_drift_monitor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testresult',
+            name='feature_vector',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testresult',
+            name='feature_version',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:08
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_planned_predictions(apps, schema_editor):
+    Prediction = apps.get_model('authentication', 'Prediction')
+    TreatmentPlan = apps.get_model('authentication', 'TreatmentPlan')
+    Prediction.objects.filter(
+        id__in=TreatmentPlan.objects.values('prediction_id')
+    ).update(plan_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0019_testresult_feature_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='plan_status',
+            field=models.CharField(choices=[('none', 'Not requested'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='none', max_length=20),
+        ),
+        migrations.RunPython(mark_planned_predictions, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=5)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['run_after', 'id'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='authenticat_status_d1b1d5_idx'), models.Index(fields=['status', 'locked_until'], name='authenticat_status_565c74_idx')],
+            },
+        ),
+    ]
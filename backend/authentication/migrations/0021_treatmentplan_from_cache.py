@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0020_background_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='treatmentplan',
+            name='from_cache',
+            field=models.BooleanField(default=False),
+        ),
+    ]
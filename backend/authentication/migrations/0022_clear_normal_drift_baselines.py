@@ -0,0 +1,40 @@
+import math
+
+from django.db import migrations
+
+# Bin edges of numeric inputs when the normal baseline was stored, in standard deviations
+Z_EDGES = [-3, -2, -1.5, -1, -0.5, 0, 0.5, 1, 1.5, 2, 3]
+
+
+def clear_normal_baselines(apps, schema_editor):
+    """
+    Clear the baseline of the histograms whose baseline is the normal
+    distribution assumed for numeric inputs, rather than one loaded with
+    reset_drift_baseline --data-csv, and the alerts it raised.
+    """
+    FeatureHistogramBin = apps.get_model('authentication', 'FeatureHistogramBin')
+    DriftAlert = apps.get_model('authentication', 'DriftAlert')
+    cdf = [0.0] + [0.5 * (1 + math.erf(edge / math.sqrt(2))) for edge in Z_EDGES] + [1.0]
+    normal = [high - low for low, high in zip(cdf, cdf[1:])]
+
+    histograms = {}
+    for row in FeatureHistogramBin.objects.order_by('preprocessing_version', 'feature', 'bin'):
+        histograms.setdefault((row.preprocessing_version, row.feature), []).append(row.baseline_fraction)
+    for (version, feature), fractions in histograms.items():
+        if len(fractions) == len(normal) and all(
+            fraction is not None and abs(fraction - expected) < 1e-9 for fraction, expected in zip(fractions, normal)
+        ):
+            FeatureHistogramBin.objects.filter(preprocessing_version=version, feature=feature).update(
+                baseline_fraction=None)
+            DriftAlert.objects.filter(preprocessing_version=version, feature=feature).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0021_treatmentplan_from_cache'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_normal_baselines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:29
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_extra_active_jobs(apps, schema_editor):
+    """Keep only the newest queued or running training job active, so the constraint can be created"""
+    TrainingJob = apps.get_model('authentication', 'TrainingJob')
+    active = TrainingJob.objects.filter(status__in=['queued', 'running']).order_by('-created_at', '-id')
+    newest = active.first()
+    if newest is not None:
+        now = timezone.now()
+        active.exclude(pk=newest.pk).update(
+            status='failed', message='Superseded by a newer training job', finished_at=now, updated_at=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0022_clear_normal_drift_baselines'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_extra_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='trainingjob',
+            constraint=models.UniqueConstraint(models.Value(True), condition=models.Q(('status__in', ['queued', 'running'])), name='one_active_training_job'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0024_similarity_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='plan_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
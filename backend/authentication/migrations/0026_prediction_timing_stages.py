@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+# Stage columns replaced by the stages field
+STAGES = ('fetch', 'encode', 'diabetes_model', 'heart_model', 'inference_server', 'save', 'treatment_plan', 'total')
+
+
+def copy_stage_columns(apps, schema_editor):
+    """Move the milliseconds of each stage column into stages, leaving out the stages a request skipped"""
+    PredictionTiming = apps.get_model('authentication', 'PredictionTiming')
+    timings = list(PredictionTiming.objects.all())
+    for timing in timings:
+        timing.stages = {
+            name: getattr(timing, f'{name}_ms') for name in STAGES if getattr(timing, f'{name}_ms') is not None
+        }
+    PredictionTiming.objects.bulk_update(timings, ['stages'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0025_plan_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictiontiming',
+            name='stages',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.RunPython(copy_stage_columns, migrations.RunPython.noop),
+    ] + [
+        migrations.RemoveField(
+            model_name='predictiontiming',
+            name=f'{name}_ms',
+        )
+        for name in STAGES
+    ]
@@ -1,22 +1,47 @@
-import tensorflow as tf
-import xgboost as xgb
+import hashlib
+import logging
 import numpy as np
 import joblib
 import os
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from pathlib import Path
 
+from django.conf import settings
+
+from . import registry
+from .bundle import ModelBundle
+from .engines import DenseNetwork, TreeEnsemble
+from .features import FeatureVectorizer
+
+logger = logging.getLogger(__name__)
+
 # Get the absolute path to the models directory
 BASE_DIR = Path(__file__).resolve().parent.parent
 MODELS_DIR = os.path.join(BASE_DIR, 'models')
 
+# TensorFlow and XGBoost are imported inside the loaders so that management
+# commands and other code paths that never run inference do not pay for them.
 def load_diabetes_model():
     model_path = os.path.join(MODELS_DIR, 'diabetes_model.keras')
+    if settings.DIABETES_INFERENCE_ENGINE == 'numpy':
+        return DenseNetwork.from_keras_file(model_path)
+
+    import tensorflow as tf
     return tf.keras.models.load_model(model_path)
 
 # Load XGBoost model for Heart Failure
 def load_heart_failure_model():
-    model = xgb.Booster()
     model_path = os.path.join(MODELS_DIR, 'xgb_heart.json')
+    if settings.HEART_INFERENCE_ENGINE == 'compiled':
+        return TreeEnsemble.from_xgboost_json(model_path)
+
+    import xgboost as xgb
+    model = xgb.Booster()
     model.load_model(model_path)
     return model
 
@@ -34,9 +59,407 @@ def load_heart_failure_encoder():
     resting_ecg_encoder_path = os.path.join(MODELS_DIR, 'resting_ecg_encoder.pkl')
     return {"label_encoder": joblib.load(encoder_path), "chest_pain_encoder": joblib.load(chest_pain_encoder_path), "resting_ecg_encoder": joblib.load(resting_ecg_encoder_path)}
 
-# Load models once when the server starts
-diabetes_model = load_diabetes_model()
-heart_failure_model = load_heart_failure_model()
-diabetes_scaler = load_diabetes_scaler()
-heart_failure_scaler = load_heart_failure_scaler()
-heart_failure_encoder = load_heart_failure_encoder()
+# Every file the loaders read; their contents identify the model version
+ARTIFACT_FILES = (
+    'diabetes_model.keras',
+    'xgb_heart.json',
+    'scaler.pkl',
+    'heart_scaler.pkl',
+    'label_encoder.pkl',
+    'chest_pain_encoder.pkl',
+    'resting_ecg_encoder.pkl',
+)
+
+def artifact_version():
+    """Identify the artifacts and inference engines in use by a hash of their contents"""
+    digest = hashlib.sha256()
+    for name in ARTIFACT_FILES:
+        with open(os.path.join(MODELS_DIR, name), 'rb') as artifact:
+            digest.update(artifact.read())
+    # The engines agree to ~1e-7, which can still move a confidence across a rounding step
+    digest.update(f'{settings.DIABETES_INFERENCE_ENGINE}/{settings.HEART_INFERENCE_ENGINE}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def uses_bundle():
+    """The bundle holds the NumPy and compiled engines; the reference engines need the loose artifacts"""
+    return (
+        bool(settings.MODEL_BUNDLE_PATH)
+        and settings.DIABETES_INFERENCE_ENGINE == 'numpy'
+        and settings.HEART_INFERENCE_ENGINE == 'compiled'
+    )
+
+
+def _load_concurrently(loaders):
+    """Run the loaders in a thread pool; they spend most of their time in I/O and native code"""
+    # The pickles and xgboost all import sklearn; importing it once up front
+    # keeps several loader threads from importing the same package at once.
+    import sklearn.preprocessing  # noqa: F401
+
+    with ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix='model-loader') as executor:
+        futures = {name: executor.submit(loader) for name, loader in loaders.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+class LoadedModels:
+    """
+    The models and preprocessing used to score test results.
+
+    Processes that send their rows to the inference server only need the
+    preprocessing, so when loading from the loose artifacts the two models can
+    be left out and loaded later by ensure_models() if the process has to fall
+    back to scoring locally. A bundle always provides both, since opening it
+    only maps the file.
+    """
+
+    PREPROCESSING_LOADERS = {
+        'diabetes_scaler': load_diabetes_scaler,
+        'heart_failure_scaler': load_heart_failure_scaler,
+        'heart_failure_encoder': load_heart_failure_encoder,
+        'version': artifact_version,
+    }
+    MODEL_LOADERS = {
+        'diabetes_model': load_diabetes_model,
+        'heart_failure_model': load_heart_failure_model,
+    }
+
+    def __init__(self, version, vectorizer, diabetes_model=None, heart_failure_model=None):
+        self.version = version
+        self.vectorizer = vectorizer
+        self.diabetes_model = diabetes_model
+        self.heart_failure_model = heart_failure_model
+        self._models_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, with_models=True):
+        """Load from the bundle, or from the loose artifacts when a reference engine is selected"""
+        if uses_bundle():
+            return cls.from_bundle(settings.MODEL_BUNDLE_PATH)
+        return cls.from_artifacts(with_models)
+
+    @classmethod
+    def from_bundle(cls, path):
+        bundle = ModelBundle(path)
+        return cls(bundle.version, bundle.vectorizer(), bundle.diabetes_network(), bundle.heart_failure_ensemble())
+
+    @classmethod
+    def from_artifacts(cls, with_models=True):
+        """Load every artifact concurrently"""
+        loaders = dict(cls.PREPROCESSING_LOADERS)
+        if with_models:
+            loaders.update(cls.MODEL_LOADERS)
+        loaded = _load_concurrently(loaders)
+        vectorizer = FeatureVectorizer.from_artifacts(
+            loaded['diabetes_scaler'], loaded['heart_failure_scaler'], loaded['heart_failure_encoder'])
+        return cls(loaded['version'], vectorizer, loaded.get('diabetes_model'), loaded.get('heart_failure_model'))
+
+    @property
+    def models_loaded(self):
+        return self.diabetes_model is not None and self.heart_failure_model is not None
+
+    def ensure_models(self):
+        """Load the diabetes and heart failure models if they were left out"""
+        if not self.models_loaded:
+            with self._models_lock:
+                if not self.models_loaded:
+                    loaded = _load_concurrently(self.MODEL_LOADERS)
+                    self.heart_failure_model = loaded['heart_failure_model']
+                    self.diabetes_model = loaded['diabetes_model']
+        return self
+
+    def run_diabetes_model(self, features):
+        model = self.ensure_models().diabetes_model
+        if isinstance(model, DenseNetwork):
+            return model.predict(features)[:, 0]
+        return model.predict(features, batch_size=len(features), verbose=0)[:, 0]
+
+    def run_heart_failure_model(self, features):
+        model = self.ensure_models().heart_failure_model
+        if isinstance(model, TreeEnsemble):
+            return model.predict(features)
+
+        import xgboost as xgb
+        return model.predict(xgb.DMatrix(features))
+
+
+class ModelHandle:
+    """
+    Holds the models this process serves and follows the active registry version.
+
+    The active version is looked up at most once every
+    MODEL_REGISTRY['POLL_INTERVAL'] seconds. A swap replaces a single
+    reference, so a request that already holds the previous LoadedModels
+    finishes on it, and while one thread loads a new version the others keep
+    serving the current one.
+    """
+
+    # Recently served versions kept open for requests that still refer to them
+    RETAINED_VERSIONS = 4
+
+    def __init__(self):
+        self._models = None
+        # Registry version the current models came from, None for MODEL_BUNDLE_PATH
+        self._active_version = None
+        self._next_check = 0
+        self._lock = threading.Lock()
+        self._retained = OrderedDict()
+
+    @property
+    def loaded(self):
+        return self._models is not None
+
+    def get(self):
+        models = self._models
+        if models is not None and time.monotonic() < self._next_check:
+            return models
+
+        # Only one thread checks the registry; the others keep the current models
+        if not self._lock.acquire(blocking=models is None):
+            return models
+        try:
+            if self._models is None or time.monotonic() >= self._next_check:
+                self._refresh()
+            return self._models
+        finally:
+            self._lock.release()
+
+    def get_version(self, version):
+        """Return the models of a specific version, opening its registered bundle if needed"""
+        models = self.get()
+        if models.version == version:
+            return models
+
+        with self._lock:
+            models = self._retained.get(version)
+            if models is None:
+                model_version = registry.registered_version(version)
+                if model_version is None:
+                    raise LookupError(f'Model version {version} is not registered')
+                models = LoadedModels.from_bundle(registry.bundle_file(model_version))
+                self._retain(models)
+        return models
+
+    def _refresh(self):
+        self._next_check = time.monotonic() + settings.MODEL_REGISTRY['POLL_INTERVAL']
+        active = registry.active_version() if uses_bundle() else None
+        active_version = active.version if active is not None else None
+        if self._models is not None and active_version == self._active_version:
+            return
+
+        try:
+            if active is None:
+                models = LoadedModels.load(with_models=not settings.INFERENCE_SERVER['ENABLED'])
+            else:
+                models = self._retained.get(active.version) or LoadedModels.from_bundle(registry.bundle_file(active))
+        except Exception:
+            if self._models is None:
+                raise
+            logger.exception('Could not load model version %s, still serving %s', active_version, self._models.version)
+            return
+
+        self._retain(models)
+        self._models = models
+        self._active_version = active_version
+        logger.info('Serving model version %s', models.version)
+
+    def _retain(self, models):
+        self._retained[models.version] = models
+        self._retained.move_to_end(models.version)
+        while len(self._retained) > self.RETAINED_VERSIONS:
+            self._retained.popitem(last=False)
+
+
+model_handle = ModelHandle()
+
+
+def get_models():
+    """Return the models to score with, loading them on the first call"""
+    return model_handle.get()
+
+
+class InferenceScheduler:
+    """
+    Collects concurrent predict calls for a model into one batched call.
+
+    Callers block in submit() while a background thread gathers requests for
+    up to max_wait_ms or until max_batch_size rows are queued, runs the model
+    once over the concatenated rows and hands each caller its slice. A caller
+    waits at most timeout seconds for its slice.
+    """
+
+    def __init__(self, name, max_wait_ms, max_batch_size, timeout=None):
+        self.name = name
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._requests = 0
+        self._batches = 0
+        self._rows = 0
+        self._largest_batch = 0
+        self._batch_sizes = Counter()
+
+    def submit(self, predict_fn, features):
+        """Run predict_fn over features, batched with any concurrent callers"""
+        features = np.asarray(features)
+
+        # Large requests are already batched and waiting would only add latency
+        if self.max_wait <= 0 or len(features) >= self.max_batch_size:
+            self._record_batch(1, len(features))
+            return predict_fn(features)
+
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((predict_fn, features, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # The worker skips a cancelled request that has not been run yet
+            future.cancel()
+            raise TimeoutError(f'The {self.name} model did not answer within {self.timeout}s')
+
+    def stats(self):
+        """Return queue depth and batch size counters"""
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_wait_ms': self.max_wait * 1000,
+                'max_batch_size': self.max_batch_size,
+                'requests': self._requests,
+                'batches': self._batches,
+                'rows': self._rows,
+                'mean_batch_size': round(self._rows / self._batches, 2) if self._batches else 0,
+                'largest_batch': self._largest_batch,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+            }
+
+    def _ensure_worker(self):
+        with self._lock:
+            # Threads do not survive a fork, so each worker process starts its own
+            if self._worker is not None and self._worker_pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(
+                target=self._run,
+                args=(self._queue,),
+                name=f'inference-scheduler-{self.name}',
+                daemon=True
+            )
+            self._worker.start()
+
+    def _record_batch(self, requests, rows):
+        with self._lock:
+            self._requests += requests
+            self._batches += 1
+            self._rows += rows
+            self._largest_batch = max(self._largest_batch, rows)
+            # Bucket batch sizes by powers of two to keep the counter small
+            self._batch_sizes[1 << max(rows - 1, 0).bit_length()] += 1
+
+    def _collect(self, pending):
+        batch = [pending.get()]
+        rows = len(batch[0][1])
+        deadline = time.monotonic() + self.max_wait
+
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            rows += len(item[1])
+
+        return batch
+
+    def _run(self, pending):
+        while True:
+            batch = self._collect(pending)
+
+            # Requests queued against different models (e.g. during a reload) run
+            # separately; requests whose caller timed out are dropped
+            groups = {}
+            for item in batch:
+                if not item[2].cancelled():
+                    groups.setdefault(item[0], []).append(item)
+
+            for predict_fn, items in groups.items():
+                # Any error, including one from mismatched feature shapes, goes to the
+                # callers of the group; the thread must survive to serve the next batch
+                try:
+                    features = np.concatenate([item[1] for item in items])
+                    self._record_batch(len(items), len(features))
+                    result = predict_fn(features)
+                    offset = 0
+                    for _, item_features, future in items:
+                        if not future.done():
+                            future.set_result(result[offset:offset + len(item_features)])
+                        offset += len(item_features)
+                except Exception as e:
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+
+
+diabetes_scheduler = InferenceScheduler(
+    'diabetes',
+    # The NumPy engine answers a single row faster than a batch could be collected
+    max_wait_ms=settings.INFERENCE_BATCH_MAX_WAIT_MS if settings.DIABETES_INFERENCE_ENGINE == 'keras' else 0,
+    max_batch_size=settings.INFERENCE_BATCH_MAX_SIZE,
+    timeout=settings.INFERENCE_BATCH_TIMEOUT
+)
+heart_failure_scheduler = InferenceScheduler(
+    'heart_failure',
+    max_wait_ms=settings.INFERENCE_BATCH_MAX_WAIT_MS if settings.HEART_INFERENCE_ENGINE == 'xgboost' else 0,
+    max_batch_size=settings.INFERENCE_BATCH_MAX_SIZE,
+    timeout=settings.INFERENCE_BATCH_TIMEOUT
+)
+
+
+def predict_diabetes(features, models=None):
+    """
+    Return the diabetes probability for each row of scaled features.
+
+    Pass the LoadedModels the features were encoded with so that a model swap
+    in the middle of a request cannot mix versions.
+    """
+    models = models or get_models()
+    return diabetes_scheduler.submit(models.run_diabetes_model, features)
+
+
+def predict_heart_failure(features, models=None):
+    """Return the heart disease probability for each row of scaled features"""
+    models = models or get_models()
+    return heart_failure_scheduler.submit(models.run_heart_failure_model, features)
+
+
+def inference_stats():
+    """Return the micro-batching counters for each model"""
+    return {
+        'diabetes': diabetes_scheduler.stats(),
+        'heart_failure': heart_failure_scheduler.stats(),
+    }
+
+
+def warmup():
+    """
+    Load the models and run a dummy inference through each of them.
+
+    With the Keras engine the first predict() call traces the TensorFlow graph,
+    so running it here keeps that cost off the first real request. Call this
+    before a worker starts accepting traffic.
+    """
+    models = get_models()
+    if not models.models_loaded:
+        # Rows are scored by the inference server; only the preprocessing is needed here
+        return
+
+    # The training means scale to an all-zero row
+    predict_diabetes(np.zeros((1, len(models.vectorizer.diabetes_mean)), dtype=np.float32), models)
+    predict_heart_failure(np.zeros((1, len(models.vectorizer.heart_mean)), dtype=np.float32), models)
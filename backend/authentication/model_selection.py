@@ -0,0 +1,216 @@
+"""
+Cross-validated model selection for the diabetes and heart failure models.
+
+Candidates are trained in a process pool and scored through the engines that
+serve them (DenseNetwork and TreeEnsemble), so the accuracy and latency in the
+leaderboard are those of the model as deployed. Diabetes candidates are
+scikit-learn MLPs, whose ReLU layers and logistic output map exactly onto a
+DenseNetwork; heart failure candidates are XGBoost boosters.
+"""
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .engines import DenseNetwork, TreeEnsemble
+
+DIABETES_GRID = {
+    'hidden_layer_sizes': [(16,), (32, 16), (64, 32)],
+    'alpha': [1e-4, 1e-3, 1e-2],
+}
+HEART_GRID = {
+    'max_depth': [3, 4, 6],
+    'eta': [0.05, 0.1, 0.3],
+    'num_boost_round': [50, 100, 200],
+}
+GRIDS = {'diabetes': DIABETES_GRID, 'heart_failure': HEART_GRID}
+
+# Label column of each model in a model_selection CSV
+LABEL_COLUMNS = {'diabetes': 'diabetes', 'heart_failure': 'heart_disease'}
+
+# CSV columns that map to the patient fields of TestResult.objects.values(*VALUE_FIELDS)
+CSV_PATIENT_COLUMNS = {'age': 'patient__age', 'gender': 'patient__user__gender'}
+NUMERIC_FIELDS = {'glucose', 'blood_pressure', 'skin_thickness', 'insulin', 'bmi', 'cholesterol', 'max_hr', 'patient__age'}
+
+
+def read_csv_rows(path, label_column=None):
+    """
+    Read a CSV of test result fields plus age, gender and a 0/1 label column.
+
+    Returns the rows in TestResult.objects.values(*VALUE_FIELDS) form and the
+    labels, or None for the labels when label_column is None.
+    """
+    rows, labels = [], []
+    with open(path, newline='') as csv_file:
+        for record in csv.DictReader(csv_file):
+            row = {CSV_PATIENT_COLUMNS.get(column, column): value for column, value in record.items()}
+            for field in NUMERIC_FIELDS:
+                row[field] = float(row[field])
+            rows.append(row)
+            if label_column is not None:
+                labels.append(float(record[label_column]))
+    return rows, np.array(labels, dtype=np.float32) if label_column is not None else None
+
+
+def candidates(grid):
+    """Every combination of the grid's parameters"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def fit_candidate(model, params, features, labels, nthread=1):
+    """
+    Train one candidate and compile it to its serving engine.
+
+    Returns the engine and, for heart failure, the XGBoost JSON it was compiled from.
+    """
+    if model == 'diabetes':
+        from sklearn.neural_network import MLPClassifier
+
+        classifier = MLPClassifier(
+            hidden_layer_sizes=params['hidden_layer_sizes'],
+            alpha=params['alpha'],
+            activation='relu',
+            max_iter=500,
+            random_state=0
+        ).fit(features, labels)
+        activations = ['relu'] * (len(classifier.coefs_) - 1) + ['sigmoid']
+        return DenseNetwork(list(zip(classifier.coefs_, classifier.intercepts_, activations))), None
+
+    import xgboost as xgb
+
+    booster = xgb.train(
+        {
+            'objective': 'binary:logistic',
+            'tree_method': 'hist',
+            'max_depth': params['max_depth'],
+            'eta': params['eta'],
+            'nthread': nthread,
+        },
+        xgb.DMatrix(features, label=labels),
+        num_boost_round=params['num_boost_round']
+    )
+    booster_json = booster.save_raw('json')
+    return TreeEnsemble.from_xgboost_model(json.loads(booster_json)), bytes(booster_json)
+
+
+def predict(engine, features):
+    """Probabilities from either engine, one per row"""
+    if isinstance(engine, DenseNetwork):
+        return engine.predict(features)[:, 0]
+    return engine.predict(features)
+
+
+def score(probabilities, labels):
+    from sklearn.metrics import log_loss, roc_auc_score
+
+    metrics = {
+        'accuracy': float(np.mean((probabilities >= 0.5) == labels)),
+        'logloss': float(log_loss(labels, np.clip(probabilities, 1e-7, 1 - 1e-7), labels=[0, 1])),
+    }
+    # AUC is undefined for a fold with a single class
+    metrics['auc'] = float(roc_auc_score(labels, probabilities)) if len(np.unique(labels)) == 2 else None
+    return metrics
+
+
+# Data shared with the pool workers, set once per worker by _init_worker
+_worker_data = {}
+
+
+def _init_worker(features, labels):
+    _worker_data['features'] = features
+    _worker_data['labels'] = labels
+
+
+def _evaluate_fold(task):
+    model, index, params, train, validation = task
+    features, labels = _worker_data['features'], _worker_data['labels']
+    engine, _ = fit_candidate(model, params, features[train], labels[train])
+    return index, score(predict(engine, features[validation]), labels[validation])
+
+
+def _fit_full(task):
+    model, index, params = task
+    engine, booster_json = fit_candidate(model, params, _worker_data['features'], _worker_data['labels'])
+    return index, engine, booster_json
+
+
+def measure_latency(engine, features, repeats=500, batch_rows=1000):
+    """Median single-row latency in microseconds and the time to score batch_rows rows in milliseconds"""
+    rows = [features[i % len(features)].reshape(1, -1) for i in range(repeats)]
+    single = []
+    for row in rows:
+        start = time.perf_counter()
+        predict(engine, row)
+        single.append(time.perf_counter() - start)
+
+    batch = np.resize(features, (batch_rows, features.shape[1]))
+    batch_times = []
+    for _ in range(5):
+        start = time.perf_counter()
+        predict(engine, batch)
+        batch_times.append(time.perf_counter() - start)
+
+    return float(np.median(single) * 1e6), float(np.median(batch_times) * 1e3)
+
+
+def run_selection(model, features, labels, folds=5, workers=None, grid=None, seed=0):
+    """
+    Cross-validate every candidate of the grid and refit each on all the data.
+
+    Returns one leaderboard entry per candidate, unsorted, with the mean and
+    standard deviation of each metric over the folds, the serving latency of
+    the refitted model, and the refitted engine itself.
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    params_list = candidates(grid or GRIDS[model])
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(features, labels))
+    fold_tasks = [
+        (model, index, params, train, validation)
+        for index, params in enumerate(params_list)
+        for train, validation in splits
+    ]
+
+    fold_metrics = [[] for _ in params_list]
+    fitted = [None] * len(params_list)
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(features, labels)) as executor:
+        for index, metrics in executor.map(_evaluate_fold, fold_tasks):
+            fold_metrics[index].append(metrics)
+        for index, engine, booster_json in executor.map(_fit_full, [(model, i, p) for i, p in enumerate(params_list)]):
+            fitted[index] = (engine, booster_json)
+
+    # Latency is measured after the pool has shut down so candidates do not compete for cores
+    leaderboard = []
+    for index, params in enumerate(params_list):
+        engine, booster_json = fitted[index]
+        single_row_us, batch_ms = measure_latency(engine, features)
+        entry = {'model': model, 'params': params, 'engine': engine, 'booster_json': booster_json,
+                 'single_row_us': round(single_row_us, 2), 'batch_1000_ms': round(batch_ms, 3)}
+        for metric in ('accuracy', 'logloss', 'auc'):
+            values = [m[metric] for m in fold_metrics[index] if m[metric] is not None]
+            entry[metric] = round(float(np.mean(values)), 5) if values else None
+            entry[f'{metric}_std'] = round(float(np.std(values)), 5) if values else None
+        leaderboard.append(entry)
+    return leaderboard
+
+
+def rank(leaderboard, max_single_row_us=None):
+    """
+    Sort by accuracy, then log loss, then single-row latency.
+
+    Candidates slower than max_single_row_us are kept in the leaderboard but
+    marked ineligible and ranked after every eligible one.
+    """
+    for entry in leaderboard:
+        entry['eligible'] = max_single_row_us is None or entry['single_row_us'] <= max_single_row_us
+    leaderboard.sort(key=lambda entry: (
+        not entry['eligible'], -entry['accuracy'], entry['logloss'], entry['single_row_us']))
+    for position, entry in enumerate(leaderboard, start=1):
+        entry['rank'] = position
+    return leaderboard
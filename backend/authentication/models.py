@@ -5,6 +5,7 @@ from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 
 from datetime import datetime
+from django.utils import timezone
 
 from django.contrib import admin
 
@@ -149,6 +150,7 @@ class NotificationType(models.TextChoices):
     PRESCRIPTION = 'prescription', 'Prescription Update'
     PATIENT_UPDATE = 'patient_update', 'Patient Information Update'
     TREATMENT_PLAN = 'treatment_plan', 'Treatment Plan Update'
+    DRIFT_ALERT = 'drift_alert', 'Model Input Drift Alert'
 
 
 
@@ -418,6 +420,16 @@ class TestResult(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Scaled model inputs as float32 bytes, and the preprocessing version that produced them (see feature_store.py)
+
+    feature_vector = models.BinaryField(null=True, blank=True)
+
+    feature_version = models.CharField(max_length=32, blank=True, default='')
+
+    # Set on every save, and by updates that clear the feature vector, so other processes find edited rows
+
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
 
 
     def __str__(self):
@@ -567,11 +579,244 @@ class Prediction(models.Model):
         ],
         default='pending'
     )
+    # Version of the models that produced the confidence (see ModelVersion)
+    model_version = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # Progress of the treatment plan, which is generated by a background job (see jobs.py)
+    plan_status = models.CharField(
+        max_length=20,
+        choices=[
+            ('none', 'Not requested'),
+            ('pending', 'Pending'),
+            ('ready', 'Ready'),
+            ('failed', 'Failed')
+        ],
+        default='none'
+    )
+    # When the plan was last set pending; a claim older than TREATMENT_PLANS['CLAIM_TIMEOUT'] has expired
+    plan_claimed_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.condition} - {self.patient.user.get_full_name()}"
 
 
+class PredictionTiming(models.Model):
+    """Time spent in each stage of generating the predictions for one test result"""
+    test_result = models.ForeignKey(TestResult, on_delete=models.CASCADE, related_name='prediction_timings')
+    model_version = models.CharField(max_length=64, blank=True)
+    # Hash of the encoded feature vector, to compare runs on identical inputs
+    input_hash = models.CharField(max_length=32, blank=True)
+    # Whether the probabilities were served from the prediction cache
+    cache_hit = models.BooleanField(default=False)
+    # {stage name: milliseconds}, including 'total'; stages the request skipped are absent.
+    # Condition models are timed under their configured stage (see conditions.py)
+    stages = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Timing for test result {self.test_result_id}: {self.stages.get('total', 0):.1f}ms"
+
+
+class PatientRiskSummary(models.Model):
+    """
+    Latest model confidences of a patient, one row per patient.
+
+    Written together with the predictions (see inference.save_predictions), so
+    the most at-risk patients can be read off an index instead of scanning
+    every Prediction.
+    """
+    patient = models.OneToOneField(PatientProfile, on_delete=models.CASCADE, primary_key=True, related_name='risk_summary')
+    # Most recent test result scored for the patient
+    test_result = models.ForeignKey(TestResult, on_delete=models.CASCADE, related_name='+')
+    diabetes_confidence = models.FloatField()
+    heart_disease_confidence = models.FloatField()
+    # Highest of the condition confidences
+    risk_confidence = models.FloatField()
+    model_version = models.CharField(max_length=64, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-risk_confidence'], name='risk_summary_risk_idx'),
+            models.Index(fields=['-diabetes_confidence'], name='risk_summary_diabetes_idx'),
+            models.Index(fields=['-heart_disease_confidence'], name='risk_summary_heart_idx'),
+        ]
+
+    def __str__(self):
+        return f"Risk of {self.patient.user.get_full_name()}: {self.risk_confidence}%"
+
+
+class FeatureHistogramBin(models.Model):
+    """
+    One bin of the histogram of a model input over incoming test results.
+
+    Rows are created per preprocessing version with the expected fraction of
+    the training data in the bin, and count is incremented as test results are
+    created (see drift.py).
+    """
+    preprocessing_version = models.CharField(max_length=32)
+    feature = models.CharField(max_length=50)
+    bin = models.PositiveSmallIntegerField()
+    count = models.BigIntegerField(default=0)
+    # Fraction of the training data in the bin; NULL when it is unknown
+    baseline_fraction = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('preprocessing_version', 'feature', 'bin')
+
+    def __str__(self):
+        return f"{self.feature}[{self.bin}]: {self.count}"
+
+
+class DeletedTestResult(models.Model):
+    """
+    A deleted test result, kept for SIMILARITY_INDEX['KEEP_DELETIONS_DAYS'] so
+    the similarity indexes of other processes drop it too (see similarity.py)
+    """
+    test_result_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Test result {self.test_result_id} deleted"
+
+
+class DriftAlert(models.Model):
+    """A model input whose drift score crossed the alert threshold; raised once per preprocessing version"""
+    preprocessing_version = models.CharField(max_length=32)
+    feature = models.CharField(max_length=50)
+    psi = models.FloatField()
+    samples = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('preprocessing_version', 'feature')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Drift in {self.feature} (PSI {self.psi:.3f})"
+
+
+class ModelVersion(models.Model):
+    """
+    A model bundle registered for serving.
+
+    Exactly one version can be active; workers notice a change of the active
+    row and swap to its bundle without a restart.
+    """
+    version = models.CharField(max_length=64, unique=True)
+    # Path of the bundle file, relative to MODEL_REGISTRY['DIRECTORY']
+    bundle_path = models.CharField(max_length=255)
+    description = models.TextField(blank=True)
+    metrics = models.JSONField(default=dict, blank=True)
+    is_active = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['is_active'], condition=models.Q(is_active=True), name='single_active_model_version')
+        ]
+
+    def __str__(self):
+        return f"{self.version}{' (active)' if self.is_active else ''}"
+
+
+class TrainingJob(models.Model):
+    """A model retraining run, executed by manage.py retrain_heart_model in its own process"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed')
+    ]
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    stage = models.CharField(max_length=50, blank=True)
+    # Percentage of the job completed
+    progress = models.FloatField(default=0)
+    message = models.TextField(blank=True)
+    samples = models.IntegerField(null=True, blank=True)
+    metrics = models.JSONField(default=dict, blank=True)
+    # Make the trained version active once it is registered
+    activate = models.BooleanField(default=False)
+    model_version = models.CharField(max_length=64, blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # At most one job queued or running, enforced by the database so
+            # concurrent requests cannot start two
+            models.UniqueConstraint(
+                models.Value(True),
+                condition=models.Q(status__in=['queued', 'running']),
+                name='one_active_training_job'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Training job {self.pk} ({self.status})"
+
+
+class BackgroundJob(models.Model):
+    """A unit of work run by manage.py run_workers, retried with backoff until it succeeds"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed')
+    ]
+
+    # Key of settings.BACKGROUND_JOBS['HANDLERS']
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    # Not claimed before this time, which moves forward after every failed attempt
+    run_after = models.DateTimeField(default=timezone.now)
+    # A running job whose worker has not finished by this time is claimed again
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_after', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+            models.Index(fields=['status', 'locked_until']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+
+class RescoreCheckpoint(models.Model):
+    """Progress of one shard of manage.py rescore_test_results for a model version"""
+    model_version = models.CharField(max_length=64)
+    shard = models.IntegerField(default=0)
+    shards = models.IntegerField(default=1)
+    # Test results are rescored in id order; everything up to this id is done
+    last_test_result_id = models.BigIntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['model_version', 'shard', 'shards']
+
+    def __str__(self):
+        return f"{self.model_version} shard {self.shard + 1}/{self.shards} at {self.last_test_result_id}"
+
+
 
 class TreatmentPlan(models.Model):
     prediction = models.ForeignKey(Prediction, on_delete=models.CASCADE)
@@ -581,6 +826,8 @@ class TreatmentPlan(models.Model):
     detailed_plan = models.JSONField(default=list)
     warnings = models.JSONField(default=list)
     doctor_notes = models.TextField(blank=True)
+    # Recommendation served from the recommendation cache instead of Gemini
+    from_cache = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
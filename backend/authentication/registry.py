@@ -0,0 +1,71 @@
+"""
+Registry of model bundles.
+
+Registered bundles are copied into MODEL_REGISTRY['DIRECTORY'] under their
+version and recorded as ModelVersion rows. Activating a version flips the
+is_active flag in one transaction; workers poll the active row and swap to
+the new bundle on their own (see model_loader.ModelHandle).
+"""
+import os
+import shutil
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .bundle import ModelBundle
+from .models import ModelVersion
+
+
+def bundle_file(model_version):
+    """Absolute path of the bundle of a ModelVersion"""
+    return os.path.join(settings.MODEL_REGISTRY['DIRECTORY'], model_version.bundle_path)
+
+
+def register_bundle(path, description='', metrics=None, activate=False):
+    """Copy a bundle into the registry and record it; registering the same bundle again is a no-op"""
+    version = ModelBundle(path).version
+    bundle_path = f'{version}.bundle'
+    destination = os.path.join(settings.MODEL_REGISTRY['DIRECTORY'], bundle_path)
+
+    if not os.path.exists(destination):
+        os.makedirs(settings.MODEL_REGISTRY['DIRECTORY'], exist_ok=True)
+        # Copy under a temporary name so a worker never maps a partial file
+        shutil.copyfile(path, f'{destination}.tmp')
+        os.replace(f'{destination}.tmp', destination)
+
+    model_version, _ = ModelVersion.objects.get_or_create(
+        version=version,
+        defaults={'bundle_path': bundle_path, 'description': description, 'metrics': metrics or {}}
+    )
+    if activate:
+        model_version = activate_version(version)
+    return model_version
+
+
+def activate_version(version):
+    """Make a registered version the one every worker serves"""
+    with transaction.atomic():
+        model_version = ModelVersion.objects.select_for_update().get(version=version)
+        ModelVersion.objects.filter(is_active=True).exclude(pk=model_version.pk).update(is_active=False)
+        model_version.is_active = True
+        model_version.activated_at = timezone.now()
+        model_version.save(update_fields=['is_active', 'activated_at'])
+    return model_version
+
+
+def active_version():
+    """
+    Return the active ModelVersion, or None when the registry is empty.
+
+    This is the check workers poll, so it is a single indexed lookup. It also
+    returns None before the registry table has been migrated.
+    """
+    try:
+        return ModelVersion.objects.filter(is_active=True).first()
+    except DatabaseError:
+        return None
+
+
+def registered_version(version):
+    return ModelVersion.objects.filter(version=version).first()
@@ -110,7 +110,7 @@ class PredictionSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Prediction
-        fields = ['id', 'condition', 'confidence', 'created_at', 'status', 'patient_name', 'vitals']
+        fields = ['id', 'condition', 'confidence', 'created_at', 'status', 'model_version', 'plan_status', 'patient_name', 'vitals']
     
     def get_patient_name(self, obj):
         return obj.patient.user.get_full_name()
@@ -124,6 +124,31 @@ class PredictionSerializer(serializers.ModelSerializer):
         }
 
 
+class ModelVersionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ModelVersion
+        fields = ['id', 'version', 'description', 'metrics', 'is_active', 'created_at', 'activated_at']
+
+
+class PatientRiskSummarySerializer(serializers.ModelSerializer):
+    patient_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = PatientRiskSummary
+        fields = ['patient', 'patient_name', 'test_result', 'diabetes_confidence', 'heart_disease_confidence',
+                  'risk_confidence', 'model_version', 'updated_at']
+
+    def get_patient_name(self, obj):
+        return obj.patient.user.get_full_name()
+
+
+class TrainingJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TrainingJob
+        fields = ['id', 'status', 'stage', 'progress', 'message', 'samples', 'metrics', 'activate',
+                  'model_version', 'created_at', 'started_at', 'finished_at']
+
+
 class TreatmentPlanSerializer(serializers.ModelSerializer):
     class Meta:
         model = TreatmentPlan
@@ -0,0 +1,323 @@
+"""
+Nearest-neighbour search over the scaled feature vectors of test results.
+
+Each test result is represented by its diabetes and heart feature rows, scaled
+by the serving vectorizer and concatenated, so distances are measured in the
+space the models see. The vectors live in one contiguous float32 matrix and a
+query is a single BLAS matrix-vector product plus a partial sort: about 15ms
+at a million rows on one core, with no tree index to maintain.
+
+The index is built from the stored feature vectors (see feature_store.py) in
+a background thread, when a worker starts or the serving models switch to a
+different preprocessing; queries made before it is ready raise
+SimilarityIndexNotReady. Test results saved by this process are added or
+updated when their transaction commits. Changes made by other processes are
+read before a query, at most every SIMILARITY_INDEX['SYNC_INTERVAL'] seconds:
+the test results whose updated_at is past the last one read, and the
+DeletedTestResult rows past the last deletion read. Both cursors are moved
+back by SYNC_OVERLAP seconds, so rows whose transaction committed after a
+later one are still picked up; applying a change twice is harmless.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .feature_store import stored_features
+from .features import DIABETES_COLUMNS, HEART_COLUMNS
+from .model_loader import get_models
+from .models import DeletedTestResult, TestResult
+
+logger = logging.getLogger(__name__)
+
+
+class SimilarityIndexNotReady(Exception):
+    """The index of the serving preprocessing is still being built"""
+
+
+class SimilarityIndex:
+    """Brute-force Euclidean k-nearest-neighbour index of test results"""
+
+    def __init__(self, vectorizer, chunk_size=5000):
+        self.vectorizer = vectorizer
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        # One row per feature: a matrix-vector product over long rows is several
+        # times faster than over a million rows of 15 values
+        self._vectors = np.empty((len(DIABETES_COLUMNS) + len(HEART_COLUMNS), 0), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._test_result_ids = np.empty(0, dtype=np.int64)
+        self._patient_ids = np.empty(0, dtype=np.int64)
+        self._positions = {}
+        self._size = 0
+        self._removed = 0
+        # Latest updated_at and deleted_at read from the database, and when the last sync ran
+        self._changed_at = None
+        self._deleted_at = None
+        self._synced = None
+        self._sync_lock = threading.Lock()
+
+    def __len__(self):
+        return self._size - self._removed
+
+    def _vector(self, diabetes_features, heart_features):
+        return np.hstack([diabetes_features, heart_features])
+
+    def _reserve(self, rows):
+        """Grow the arrays, doubling their capacity, so rows more vectors fit"""
+        needed = self._size + rows
+        if needed <= len(self._norms):
+            return
+        capacity = max(needed, 2 * len(self._norms), 1024)
+        vectors = np.empty((self._vectors.shape[0], capacity), dtype=np.float32)
+        vectors[:, :self._size] = self._vectors[:, :self._size]
+        self._vectors = vectors
+        self._norms = np.resize(self._norms, capacity)
+        self._test_result_ids = np.resize(self._test_result_ids, capacity)
+        self._patient_ids = np.resize(self._patient_ids, capacity)
+
+    def _store(self, test_result_ids, patient_ids, vectors):
+        """Insert or overwrite the vectors of test results; the lock must be held"""
+        positions = []
+        appended = 0
+        for test_result_id in test_result_ids:
+            position = self._positions.get(test_result_id)
+            if position is None:
+                position = self._size + appended
+                appended += 1
+                self._positions[test_result_id] = position
+            positions.append(position)
+        positions = np.array(positions, dtype=np.int64)
+
+        self._reserve(appended)
+        self._vectors[:, positions] = vectors.T
+        self._norms[positions] = np.einsum('ij,ij->i', vectors, vectors)
+        self._test_result_ids[positions] = test_result_ids
+        self._patient_ids[positions] = patient_ids
+        self._size += appended
+
+    def sync(self, force=False):
+        """
+        Apply the test results changed or deleted by any process since the
+        last sync, in chunks. Unless force is set, does nothing when the last
+        sync was less than SYNC_INTERVAL seconds ago, or another thread is
+        syncing.
+        """
+        config = settings.SIMILARITY_INDEX
+        if not self._sync_lock.acquire(blocking=force):
+            return
+        try:
+            if not force and self._synced is not None and time.monotonic() - self._synced < config['SYNC_INTERVAL']:
+                return
+            self._synced = time.monotonic()
+            overlap = timedelta(seconds=config['SYNC_OVERLAP'])
+            if self._deleted_at is None:
+                # Rows deleted before the first read are not loaded
+                self._deleted_at = timezone.now()
+            self._sync_deletions(self._deleted_at - overlap)
+            self._sync_changes(self._changed_at - overlap if self._changed_at else None)
+        finally:
+            self._sync_lock.release()
+
+    def _sync_changes(self, since):
+        queryset = TestResult.objects.order_by('updated_at', 'id').values(
+            'id', 'patient_id', 'feature_vector', 'feature_version', 'updated_at')
+        if since is not None:
+            queryset = queryset.filter(updated_at__gte=since)
+        last = None
+        while True:
+            page = queryset
+            if last is not None:
+                page = page.filter(Q(updated_at__gt=last['updated_at']) | Q(updated_at=last['updated_at'], id__gt=last['id']))
+            rows = list(page[:self.chunk_size])
+            if not rows:
+                return
+
+            # Stored vectors; rows with values the encoders do not know have none and are not indexed
+            indices, diabetes_features, heart_features = stored_features(rows, self.vectorizer)
+            test_result_ids = [rows[index]['id'] for index in indices]
+            patient_ids = [rows[index]['patient_id'] for index in indices]
+            unindexable = {row['id'] for row in rows} - set(test_result_ids)
+
+            with self._lock:
+                if test_result_ids:
+                    self._store(test_result_ids, patient_ids, self._vector(diabetes_features, heart_features))
+                for test_result_id in unindexable:
+                    self._remove(test_result_id)
+                last = rows[-1]
+                if self._changed_at is None or last['updated_at'] > self._changed_at:
+                    self._changed_at = last['updated_at']
+            if len(rows) < self.chunk_size:
+                return
+
+    def _sync_deletions(self, since):
+        kept_since = timezone.now() - timedelta(days=settings.SIMILARITY_INDEX['KEEP_DELETIONS_DAYS'])
+        if since < kept_since:
+            # Deletions this old have been purged; compare the indexed ids with the table instead
+            existing = set(TestResult.objects.values_list('id', flat=True))
+            deleted = [test_result_id for test_result_id in list(self._positions) if test_result_id not in existing]
+            latest = kept_since
+        else:
+            rows = list(DeletedTestResult.objects.filter(deleted_at__gte=since).values_list('test_result_id', 'deleted_at'))
+            deleted = [test_result_id for test_result_id, _ in rows]
+            latest = max([deleted_at for _, deleted_at in rows], default=None)
+        with self._lock:
+            for test_result_id in deleted:
+                self._remove(test_result_id)
+            if latest is not None and latest > self._deleted_at:
+                self._deleted_at = latest
+
+    def add(self, test_result):
+        """Add a test result, or replace its vector if it is already indexed"""
+        vector = self._vector(*self.vectorizer.transform([test_result]))
+        with self._lock:
+            self._store([test_result.id], [test_result.patient_id], vector)
+
+    def _remove(self, test_result_id):
+        """Drop a test result from the index; the lock must be held"""
+        position = self._positions.get(test_result_id)
+        if position is not None:
+            # The row stays in the matrix but can never be among the nearest
+            self._norms[position] = np.inf
+            self._positions[test_result_id] = None
+            self._removed += 1
+
+    def remove(self, test_result_id):
+        with self._lock:
+            self._remove(test_result_id)
+
+    def query(self, test_result, k=10, exclude_patient=True):
+        """
+        Return the k indexed test results nearest to test_result as
+        (test_result_id, distance) pairs, nearest first.
+
+        The test result itself is never returned, and neither are other test
+        results of the same patient unless exclude_patient is False.
+        """
+        self.sync()
+        query = self._vector(*self.vectorizer.transform([test_result]))[0]
+
+        # Snapshot: rows past size may be written concurrently, rows before it only change in place
+        with self._lock:
+            size = self._size
+            vectors, norms = self._vectors[:, :size], self._norms[:size]
+            test_result_ids, patient_ids = self._test_result_ids[:size], self._patient_ids[:size]
+
+        # |v - q|^2 = |v|^2 - 2 v.q + |q|^2, with the constant |q|^2 added to the winners only
+        distances = query @ vectors
+        distances *= -2
+        distances += norms
+        excluded = patient_ids == test_result.patient_id if exclude_patient else test_result_ids == test_result.id
+        distances[excluded] = np.inf
+
+        k = min(k, size)
+        if k == 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+        squared = np.maximum(distances[nearest] + query @ query, 0)
+        return [
+            (int(test_result_ids[position]), float(np.sqrt(distance)))
+            for position, distance in zip(nearest, squared)
+            if np.isfinite(distance)
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+# (process id, preprocessing version) of the index being built, if any. A
+# worker forked mid-build, e.g. by gunicorn --preload, inherits the value but
+# not the thread, so a value set by another process is ignored.
+_building = None
+
+
+def _after_fork():
+    global _index_lock
+    # The parent's build thread may have held the lock when the process forked
+    _index_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def build_similarity_index(vectorizer):
+    """Build the index of a vectorizer's preprocessing and make it the process-wide one"""
+    global _index
+    index = SimilarityIndex(vectorizer)
+    index.sync(force=True)
+    with _index_lock:
+        _index = index
+    return index
+
+
+def start_similarity_index_build(vectorizer=None):
+    """Build the index of the serving preprocessing in a background thread, unless that build is under way"""
+    global _building
+    vectorizer = vectorizer or get_models().vectorizer
+    building = (os.getpid(), vectorizer.preprocessing_version)
+    with _index_lock:
+        if _building == building:
+            return
+        _building = building
+
+    def build():
+        global _building
+        started = time.monotonic()
+        try:
+            index = build_similarity_index(vectorizer)
+            logger.info('Built the similarity index of %d test results in %.1fs', len(index), time.monotonic() - started)
+        except Exception:
+            logger.exception('Could not build the similarity index')
+        finally:
+            with _index_lock:
+                if _building == building:
+                    _building = None
+            connection.close()
+
+    threading.Thread(target=build, name='similarity-index-build', daemon=True).start()
+
+
+def get_similarity_index():
+    """
+    The process-wide index. Raises SimilarityIndexNotReady, and starts a
+    build, while there is no index of the serving preprocessing, whose
+    vectors are the only ones comparable with a query.
+    """
+    vectorizer = get_models().vectorizer
+    index = _index
+    if index is None or index.vectorizer.preprocessing_version != vectorizer.preprocessing_version:
+        start_similarity_index_build(vectorizer)
+        raise SimilarityIndexNotReady('The similarity index is being built; try again shortly')
+    return index
+
+
+def index_test_result(test_result):
+    """Add a saved test result to the index once its transaction commits"""
+    def add():
+        if _index is not None:
+            try:
+                _index.add(test_result)
+            except ValueError:
+                # Values the encoders do not know cannot be scaled; such rows are not indexed
+                pass
+    transaction.on_commit(add)
+
+
+def unindex_test_result(test_result_id):
+    """Record a deleted test result for other processes, and drop it from this one's index on commit"""
+    DeletedTestResult.objects.create(test_result_id=test_result_id)
+    transaction.on_commit(lambda: _index is not None and _index.remove(test_result_id))
+
+
+def purge_deleted_test_results():
+    """Delete the DeletedTestResult rows older than SIMILARITY_INDEX['KEEP_DELETIONS_DAYS']"""
+    cutoff = timezone.now() - timedelta(days=settings.SIMILARITY_INDEX['KEEP_DELETIONS_DAYS'])
+    deleted, _ = DeletedTestResult.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
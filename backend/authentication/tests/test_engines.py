@@ -0,0 +1,93 @@
+import importlib.util
+import os
+import unittest
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from authentication.engines import DenseNetwork, TreeEnsemble
+from authentication.model_loader import MODELS_DIR, load_diabetes_scaler, load_heart_failure_encoder, load_heart_failure_scaler
+
+TOLERANCE = 1e-5
+SAMPLES = 2000
+
+
+def installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def diabetes_features(rng, samples=SAMPLES):
+    """Scaled rows drawn around the means and spreads the diabetes scaler was fitted on"""
+    scaler = load_diabetes_scaler()
+    raw = rng.normal(scaler.mean_, scaler.scale_, size=(samples, len(scaler.mean_)))
+    return scaler.transform(np.clip(raw, 0, None))
+
+
+def heart_failure_features(rng, samples=SAMPLES):
+    """Scaled rows with valid binary and encoded categorical columns, as check_inference_parity draws them"""
+    scaler = load_heart_failure_scaler()
+    encoders = load_heart_failure_encoder()
+    raw = np.clip(rng.normal(scaler.mean_, scaler.scale_, size=(samples, len(scaler.mean_))), 0, None)
+    for column in (1, 5, 8):
+        raw[:, column] = rng.random(samples) < scaler.mean_[column]
+    raw[:, 2] = rng.integers(len(encoders['chest_pain_encoder'].classes_), size=samples)
+    raw[:, 6] = rng.integers(len(encoders['resting_ecg_encoder'].classes_), size=samples)
+    return scaler.transform(raw)
+
+
+class DenseNetworkTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model_path = os.path.join(MODELS_DIR, 'diabetes_model.keras')
+        cls.network = DenseNetwork.from_keras_file(cls.model_path)
+        cls.features = diabetes_features(np.random.default_rng(0))
+
+    @unittest.skipUnless(installed('tensorflow'), 'TensorFlow is not installed')
+    def test_matches_keras(self):
+        import tensorflow as tf
+
+        keras_model = tf.keras.models.load_model(self.model_path)
+        expected = keras_model.predict(self.features, batch_size=1024, verbose=0)
+        np.testing.assert_allclose(self.network.predict(self.features), expected, atol=TOLERANCE)
+
+    def test_single_row_matches_batch(self):
+        batch = self.network.predict(self.features[:5])
+        rows = np.concatenate([self.network.predict(row) for row in self.features[:5]])
+        np.testing.assert_allclose(rows, batch, atol=1e-7)
+
+
+class TreeEnsembleTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.model_path = os.path.join(MODELS_DIR, 'xgb_heart.json')
+        cls.ensemble = TreeEnsemble.from_xgboost_json(cls.model_path)
+        cls.features = heart_failure_features(np.random.default_rng(0))
+
+    @unittest.skipUnless(installed('xgboost'), 'XGBoost is not installed')
+    def test_matches_xgboost(self):
+        import xgboost as xgb
+
+        booster = xgb.Booster()
+        booster.load_model(self.model_path)
+        expected = booster.predict(xgb.DMatrix(self.features))
+        np.testing.assert_allclose(self.ensemble.predict(self.features), expected, atol=TOLERANCE)
+
+    @unittest.skipUnless(installed('xgboost'), 'XGBoost is not installed')
+    def test_missing_values_follow_default_direction(self):
+        import xgboost as xgb
+
+        booster = xgb.Booster()
+        booster.load_model(self.model_path)
+        features = self.features[:200].copy()
+        features[::3, 0] = np.nan
+        features[1::4, 4] = np.nan
+        expected = booster.predict(xgb.DMatrix(features, missing=np.nan))
+        np.testing.assert_allclose(self.ensemble.predict(features), expected, atol=TOLERANCE)
+
+    def test_unsupported_objective(self):
+        with self.assertRaises(ValueError):
+            TreeEnsemble(
+                self.ensemble.feature, self.ensemble.threshold, self.ensemble.left, self.ensemble.right,
+                self.ensemble.default_left, self.ensemble.value, self.ensemble.roots, 0.0, 'multi:softmax')
@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from authentication.features import FeatureVectorizer
+from authentication.model_loader import load_diabetes_scaler, load_heart_failure_encoder, load_heart_failure_scaler
+
+
+def test_result(**fields):
+    """An unsaved stand-in for a TestResult and its patient"""
+    values = {
+        'glucose': 120.0, 'blood_pressure': 80.0, 'skin_thickness': 20.0, 'insulin': 80.0, 'bmi': 28.0,
+        'cholesterol': 200.0, 'fasting_bs': 'N', 'resting_ecg': 'Normal', 'max_hr': 150,
+        'exercise_angina': 'N', 'chest_pain_type': 'ATA', 'age': 50, 'gender': 'Male',
+    }
+    values.update(fields)
+    patient = SimpleNamespace(age=values.pop('age'), user=SimpleNamespace(gender=values.pop('gender')))
+    return SimpleNamespace(patient=patient, **values)
+
+
+class FeatureVectorizerTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.diabetes_scaler = load_diabetes_scaler()
+        cls.heart_failure_scaler = load_heart_failure_scaler()
+        cls.encoders = load_heart_failure_encoder()
+        cls.vectorizer = FeatureVectorizer.from_artifacts(cls.diabetes_scaler, cls.heart_failure_scaler, cls.encoders)
+
+        rng = np.random.default_rng(0)
+        cls.test_results = [
+            test_result(
+                glucose=float(rng.uniform(70, 200)),
+                blood_pressure=float(rng.uniform(50, 160)),
+                skin_thickness=float(rng.uniform(0, 50)),
+                insulin=float(rng.uniform(0, 300)),
+                bmi=float(rng.uniform(18, 45)),
+                cholesterol=float(rng.uniform(100, 400)),
+                max_hr=int(rng.integers(70, 200)),
+                fasting_bs=str(rng.choice(['Y', 'N'])),
+                exercise_angina=str(rng.choice(['Y', 'N'])),
+                resting_ecg=str(rng.choice(cls.encoders['resting_ecg_encoder'].classes_)),
+                chest_pain_type=str(rng.choice(cls.encoders['chest_pain_encoder'].classes_)),
+                age=int(rng.integers(25, 80)),
+                gender=str(rng.choice(['Male', 'Female'])),
+            )
+            for _ in range(200)
+        ]
+
+    def sklearn_features(self, test_result):
+        """The diabetes and heart rows as the per-field LabelEncoder and StandardScaler calls build them"""
+        encoders = self.encoders
+        diabetes = [
+            test_result.glucose, test_result.blood_pressure, test_result.skin_thickness,
+            test_result.insulin, test_result.bmi, test_result.patient.age,
+        ]
+        heart = [
+            test_result.patient.age,
+            float(test_result.patient.user.gender == 'Male'),
+            int(encoders['chest_pain_encoder'].transform([test_result.chest_pain_type])[0]),
+            test_result.blood_pressure,
+            test_result.cholesterol,
+            int(encoders['label_encoder'].transform([test_result.fasting_bs])[0]),
+            int(encoders['resting_ecg_encoder'].transform([test_result.resting_ecg])[0]),
+            test_result.max_hr,
+            int(encoders['label_encoder'].transform([test_result.exercise_angina])[0]),
+        ]
+        return (
+            self.diabetes_scaler.transform([diabetes])[0].astype(np.float32),
+            self.heart_failure_scaler.transform([heart])[0].astype(np.float32),
+        )
+
+    def test_matches_sklearn(self):
+        diabetes, heart = self.vectorizer.transform(self.test_results)
+        for index, test_result in enumerate(self.test_results):
+            expected_diabetes, expected_heart = self.sklearn_features(test_result)
+            np.testing.assert_array_equal(diabetes[index], expected_diabetes)
+            np.testing.assert_array_equal(heart[index], expected_heart)
+
+    def test_value_rows_match_instances(self):
+        rows = [
+            {
+                **{field: value for field, value in vars(test_result).items() if field != 'patient'},
+                'patient__age': test_result.patient.age,
+                'patient__user__gender': test_result.patient.user.gender,
+            }
+            for test_result in self.test_results
+        ]
+        for from_rows, from_instances in zip(self.vectorizer.transform_rows(rows), self.vectorizer.transform(self.test_results)):
+            np.testing.assert_array_equal(from_rows, from_instances)
+
+    def test_unknown_category(self):
+        with self.assertRaisesMessage(ValueError, 'chest_pain_type'):
+            self.vectorizer.transform([test_result(chest_pain_type='XYZ')])
+
+    def test_preprocessing_version_follows_the_scalers(self):
+        same = FeatureVectorizer.from_artifacts(self.diabetes_scaler, self.heart_failure_scaler, self.encoders)
+        shifted = FeatureVectorizer(
+            self.vectorizer.diabetes_mean + 1, self.vectorizer.diabetes_scale,
+            self.vectorizer.heart_mean, self.vectorizer.heart_scale, self.vectorizer.categories)
+        self.assertEqual(same.preprocessing_version, self.vectorizer.preprocessing_version)
+        self.assertNotEqual(shifted.preprocessing_version, self.vectorizer.preprocessing_version)
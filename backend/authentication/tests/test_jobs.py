@@ -0,0 +1,161 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from authentication import jobs
+from authentication.models import BackgroundJob
+
+# Payloads seen by the handlers below, in call order
+calls = []
+failed = []
+
+
+def record(payload):
+    calls.append(payload)
+
+
+def fail_until(payload):
+    """Fails until it has been called payload['succeed_on'] times for the payload"""
+    calls.append(payload)
+    if calls.count(payload) < payload['succeed_on']:
+        raise jobs.JobError('not yet')
+
+
+def record_failure(payload):
+    failed.append(payload)
+
+
+TEST_JOBS = {
+    **settings.BACKGROUND_JOBS,
+    'HANDLERS': {
+        'record': 'authentication.tests.test_jobs.record',
+        'flaky': 'authentication.tests.test_jobs.fail_until',
+    },
+    'FAILED_HANDLERS': {
+        'flaky': 'authentication.tests.test_jobs.record_failure',
+    },
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF_SECONDS': 10,
+    'BACKOFF_MAX_SECONDS': 60,
+    'VISIBILITY_TIMEOUT': 300,
+}
+
+
+@override_settings(BACKGROUND_JOBS=TEST_JOBS)
+class BackgroundJobTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        failed.clear()
+
+    def make_due(self, job):
+        """Move a job queued for a retry to now"""
+        BackgroundJob.objects.filter(id=job.id).update(run_after=timezone.now())
+
+    def expire_lock(self, job):
+        BackgroundJob.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('unknown', [{}])
+
+    def test_claim_and_run(self):
+        jobs.enqueue('record', [{'n': 1}, {'n': 2}])
+        job = jobs.claim('worker-1')
+        self.assertEqual((job.status, job.attempts, job.locked_by), ('running', 1, 'worker-1'))
+        self.assertTrue(jobs.run(job, 'worker-1'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertIsNone(job.locked_until)
+        self.assertEqual(calls, [{'n': 1}])
+
+    def test_claimed_job_is_not_claimed_again(self):
+        jobs.enqueue('record', [{}])
+        self.assertIsNotNone(jobs.claim('worker-1'))
+        self.assertIsNone(jobs.claim('worker-2'))
+
+    def test_delayed_job_is_not_due(self):
+        jobs.enqueue('record', [{}], delay=60)
+        self.assertIsNone(jobs.claim('worker-1'))
+
+    def test_claim_filters_kinds(self):
+        jobs.enqueue('record', [{}])
+        self.assertIsNone(jobs.claim('worker-1', kinds=['flaky']))
+        self.assertEqual(jobs.claim('worker-1', kinds=['record']).kind, 'record')
+
+    def test_failed_attempt_is_retried_after_a_backoff(self):
+        jobs.enqueue('flaky', [{'succeed_on': 2}])
+        job = jobs.claim('worker-1')
+        before = timezone.now()
+        self.assertFalse(jobs.run(job, 'worker-1'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertIn('JobError: not yet', job.last_error)
+        # Attempt 1 waits between half and all of BACKOFF_SECONDS
+        self.assertGreaterEqual(job.run_after, before + timedelta(seconds=5))
+        self.assertLessEqual(job.run_after, timezone.now() + timedelta(seconds=10))
+        self.assertIsNone(jobs.claim('worker-1'))
+
+        self.make_due(job)
+        job = jobs.claim('worker-2')
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(jobs.run(job, 'worker-2'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+
+    def test_backoff_is_capped(self):
+        for attempts in range(1, 10):
+            delay = min(60, 10 * 2 ** (attempts - 1))
+            self.assertTrue(delay / 2 <= jobs.backoff(attempts) <= delay)
+
+    def test_job_fails_after_max_attempts(self):
+        jobs.enqueue('flaky', [{'succeed_on': 10}])
+        for _ in range(3):
+            job = jobs.claim('worker-1')
+            self.assertFalse(jobs.run(job, 'worker-1'))
+            self.make_due(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(failed, [{'succeed_on': 10}])
+        self.assertIsNone(jobs.claim('worker-1'))
+
+    def test_expired_lock_is_claimed_again(self):
+        jobs.enqueue('record', [{}])
+        stalled = jobs.claim('worker-1')
+        self.expire_lock(stalled)
+
+        job = jobs.claim('worker-2')
+        self.assertEqual((job.id, job.attempts, job.locked_by), (stalled.id, 2, 'worker-2'))
+        self.assertTrue(jobs.run(job, 'worker-2'))
+
+        # The outcome of the stalled attempt is ignored
+        self.assertFalse(jobs._finish(stalled, 'worker-1', status='queued'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+
+    def test_expired_last_attempt_fails_the_job(self):
+        jobs.enqueue('flaky', [{'succeed_on': 1}], max_attempts=1)
+        self.expire_lock(jobs.claim('worker-1'))
+
+        job = jobs.claim('worker-2')
+        self.assertFalse(jobs.run(job, 'worker-2'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('Visibility timeout', job.last_error)
+        self.assertEqual(calls, [])
+        self.assertEqual(failed, [{'succeed_on': 1}])
+
+    def test_purge_keeps_failed_jobs(self):
+        jobs.enqueue('record', [{}, {}])
+        old = timezone.now() - timedelta(days=30)
+        first, second = BackgroundJob.objects.order_by('id')
+        BackgroundJob.objects.filter(id=first.id).update(status='succeeded', finished_at=old)
+        BackgroundJob.objects.filter(id=second.id).update(status='failed', finished_at=old)
+
+        self.assertEqual(jobs.purge_finished_jobs(), 1)
+        self.assertEqual(list(BackgroundJob.objects.values_list('status', flat=True)), ['failed'])
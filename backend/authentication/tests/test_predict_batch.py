@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from authentication.models import (
+    DoctorProfile, Notification, PatientProfile, PatientRiskSummary, Prediction, TestResult, User,
+)
+
+
+class PredictBatchTests(TestCase):
+    def setUp(self):
+        doctor_user = User.objects.create_user(
+            email='doctor@example.com', password='password', first_name='Dana', last_name='Doctor', user_role='Doctor')
+        self.doctor = DoctorProfile.objects.create(user=doctor_user, specialization='Cardiology', license_number='D-1')
+        patient_user = User.objects.create_user(
+            email='patient@example.com', password='password', first_name='Pat', last_name='Patient', gender='Male')
+        self.patient = PatientProfile.objects.create(user=patient_user, age=50, emergency_contact='0')
+        self.doctor.patients.add(self.patient)
+
+        self.test_results = [
+            TestResult.objects.create(
+                patient=self.patient, glucose=glucose, blood_pressure=80.0, skin_thickness=20.0, insulin=80.0,
+                bmi=28.0, cholesterol=cholesterol, fasting_bs='N', resting_ecg='Normal', max_hr=150,
+                exercise_angina='N', chest_pain_type='ATA')
+            for glucose, cholesterol in ((90.0, 180.0), (180.0, 320.0))
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(doctor_user)
+
+    def predict_batch(self, test_result_ids):
+        return self.client.post('/api/test-results/predict-batch/', {'test_result_ids': test_result_ids}, format='json')
+
+    def test_matches_single_predictions(self):
+        notifications = Notification.objects.filter(user=self.doctor.user).count()
+        batch = self.predict_batch([test_result.id for test_result in self.test_results] + [0])
+        self.assertEqual(batch.status_code, 201)
+        self.assertEqual(batch.data['missing_test_result_ids'], [0])
+        # One notification per patient, however many of their test results were scored
+        self.assertEqual(Notification.objects.filter(user=self.doctor.user).count(), notifications + 1)
+
+        batch_test_results = dict(Prediction.objects.values_list('id', 'test_result_id'))
+        for test_result in self.test_results:
+            single = self.client.post(f'/api/test-results/{test_result.id}/predict/')
+            self.assertEqual(single.status_code, 201)
+            self.assertEqual(
+                sorted((p['condition'], p['confidence']) for p in single.data['predictions']),
+                sorted(
+                    (p['condition'], p['confidence']) for p in batch.data['predictions']
+                    if batch_test_results[p['id']] == test_result.id
+                )
+            )
+
+    def test_unknown_categories_are_skipped(self):
+        unknown = TestResult.objects.create(
+            patient=self.patient, glucose=120.0, blood_pressure=80.0, skin_thickness=20.0, insulin=80.0, bmi=28.0,
+            cholesterol=200.0, fasting_bs='N', resting_ecg='Normal', max_hr=150, exercise_angina='N',
+            chest_pain_type='XYZ')
+        response = self.predict_batch([self.test_results[0].id, unknown.id])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['unscorable_test_result_ids'], [unknown.id])
+        self.assertEqual(response.data['missing_test_result_ids'], [])
+        self.assertEqual(set(Prediction.objects.values_list('test_result_id', flat=True)), {self.test_results[0].id})
+
+    def test_only_unknown_categories(self):
+        self.test_results[0].chest_pain_type = 'XYZ'
+        self.test_results[0].save()
+        response = self.predict_batch([self.test_results[0].id])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['predictions'], response.data['unscorable_test_result_ids']),
+                         ([], [self.test_results[0].id]))
+
+    def test_failure_stores_nothing(self):
+        with mock.patch.object(Notification.objects, 'bulk_create', side_effect=RuntimeError('database is locked')):
+            response = self.predict_batch([test_result.id for test_result in self.test_results])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Prediction.objects.exists())
+        self.assertFalse(PatientRiskSummary.objects.exists())
+
+    def test_validation(self):
+        for test_result_ids in (None, [], ['a'], list(range(settings.PREDICTION_BATCH_MAX_SIZE + 1))):
+            self.assertEqual(self.predict_batch(test_result_ids).status_code, 400)
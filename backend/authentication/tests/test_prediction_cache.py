@@ -0,0 +1,56 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from authentication.caches import LocalLRUCache, PredictionCache
+
+
+class PredictionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = PredictionCache(LocalLRUCache(100))
+        self.calls = []
+
+    def predict(self, features):
+        self.calls.append(len(features['diabetes']))
+        return {
+            'diabetes': features['diabetes'][:, 0],
+            'heart_disease': features['heart'][:, 0],
+        }
+
+    def features(self, *values):
+        rows = np.array([[value] * 3 for value in values], dtype=np.float32)
+        return {'diabetes': rows, 'heart': rows + 1}
+
+    def test_only_misses_are_predicted(self):
+        outputs = ['diabetes', 'heart_disease']
+        first = self.cache.get_or_predict('v1', self.features(0.1, 0.2), outputs, self.predict)
+        second = self.cache.get_or_predict('v1', self.features(0.2, 0.3, 0.1), outputs, self.predict)
+
+        self.assertEqual(self.calls, [2, 1])
+        np.testing.assert_allclose(first['diabetes'], [0.1, 0.2])
+        np.testing.assert_allclose(second['diabetes'], [0.2, 0.3, 0.1])
+        np.testing.assert_allclose(second['heart_disease'], [1.2, 1.3, 1.1])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+
+    def test_model_version_is_part_of_the_key(self):
+        self.cache.get_or_predict('v1', self.features(0.1), ['diabetes'], self.predict)
+        self.cache.get_or_predict('v2', self.features(0.1), ['diabetes'], self.predict)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_entry_missing_an_output_is_predicted_again(self):
+        self.cache.get_or_predict('v1', self.features(0.1), ['diabetes'], self.predict)
+        self.cache.get_or_predict('v1', self.features(0.1), ['diabetes', 'heart_disease'], self.predict)
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache = PredictionCache(LocalLRUCache(2))
+        for value in (0.1, 0.2, 0.1, 0.3, 0.1, 0.2):
+            self.cache.get_or_predict('v1', self.features(value), ['diabetes'], self.predict)
+        # 0.2 was evicted by 0.3, 0.1 stayed in use throughout
+        self.assertEqual(len(self.calls), 4)
+
+    def test_disabled_cache_always_predicts(self):
+        cache = PredictionCache(None)
+        cache.get_or_predict('v1', self.features(0.1), ['diabetes'], self.predict)
+        cache.get_or_predict('v1', self.features(0.1), ['diabetes'], self.predict)
+        self.assertEqual(self.calls, [1, 1])
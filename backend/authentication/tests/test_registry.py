@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from authentication.bundle import ModelBundle, write_bundle
+from authentication.inference import score_test_results
+from authentication.model_loader import ModelHandle
+from authentication.models import PatientProfile, TestResult, User
+from authentication.registry import activate_version, register_bundle
+
+
+class RegistryTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        registry = override_settings(MODEL_REGISTRY={'DIRECTORY': os.path.join(self.directory, 'registry'), 'POLL_INTERVAL': 0})
+        registry.enable()
+        self.addCleanup(registry.disable)
+
+        user = User.objects.create_user(
+            email='patient@example.com', password='password', first_name='Pat', last_name='Patient', gender='Female')
+        patient = PatientProfile.objects.create(user=user, age=60, emergency_contact='0')
+        self.test_results = [
+            TestResult.objects.create(
+                patient=patient, glucose=glucose, blood_pressure=85.0, skin_thickness=25.0, insulin=90.0, bmi=31.0,
+                cholesterol=240.0, fasting_bs='Y', resting_ecg='ST', max_hr=130, exercise_angina='Y',
+                chest_pain_type='ASY')
+            for glucose in (90.0, 140.0, 190.0)
+        ]
+
+    def shifted_bundle(self, shift):
+        """Copy of the serving bundle whose heart failure margin is shifted by shift"""
+        bundle = ModelBundle(settings.MODEL_BUNDLE_PATH)
+        heart_failure = {**bundle.metadata['heart_failure']}
+        heart_failure['base_margin'] += shift
+        path = os.path.join(self.directory, f'shifted-{shift}.bundle')
+        write_bundle(path, bundle.arrays, {**bundle.metadata, 'heart_failure': heart_failure})
+        return path
+
+    def heart_disease_confidences(self, models):
+        confidences, _ = score_test_results(self.test_results, models, use_cache=False)
+        return confidences['heart_disease']
+
+    def test_handle_follows_the_active_version(self):
+        handle = ModelHandle()
+        serving = handle.get()
+        self.assertEqual(serving.version, ModelBundle(settings.MODEL_BUNDLE_PATH).version)
+
+        model_version = register_bundle(self.shifted_bundle(2.0))
+        self.assertIs(handle.get(), serving)
+
+        activate_version(model_version.version)
+        swapped = handle.get()
+        self.assertEqual(swapped.version, model_version.version)
+        self.assertTrue((self.heart_disease_confidences(swapped) > self.heart_disease_confidences(serving)).all())
+
+        # A request that still holds the previous models finishes on them
+        self.assertEqual(serving.version, ModelBundle(settings.MODEL_BUNDLE_PATH).version)
+
+    def test_activation_switches_between_registered_versions(self):
+        handle = ModelHandle()
+        first = register_bundle(self.shifted_bundle(1.0), activate=True)
+        second = register_bundle(self.shifted_bundle(-1.0), activate=True)
+        self.assertEqual(handle.get().version, second.version)
+
+        activate_version(first.version)
+        self.assertEqual(handle.get().version, first.version)
+        self.assertEqual(handle.get_version(second.version).version, second.version)
+
+    def test_registering_a_bundle_twice(self):
+        path = self.shifted_bundle(1.0)
+        self.assertEqual(register_bundle(path).pk, register_bundle(path).pk)
+
+    def test_unregistered_version(self):
+        with self.assertRaises(LookupError):
+            ModelHandle().get_version('0000000000000000')
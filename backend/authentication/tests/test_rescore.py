@@ -0,0 +1,105 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from authentication.inference import predict_test_results
+from authentication.model_loader import get_models
+from authentication.models import PatientProfile, Prediction, RescoreCheckpoint, TestResult, User
+
+COMMAND = 'authentication.management.commands.rescore_test_results'
+
+
+class RescoreTests(TestCase):
+    def setUp(self):
+        self.patients = [
+            PatientProfile.objects.create(
+                user=User.objects.create_user(
+                    email=f'patient{age}@example.com', password='password', first_name='Pat', last_name=str(age),
+                    gender='Male'),
+                age=age, emergency_contact='0')
+            for age in (35, 55, 75)
+        ]
+        self.test_results = [
+            self.create_test_result(self.patients[index % 3], glucose=80.0 + 5 * index, cholesterol=150.0 + 10 * index)
+            for index in range(10)
+        ]
+        self.version = get_models().version
+
+    def create_test_result(self, patient, glucose=120.0, cholesterol=200.0, chest_pain_type='ATA'):
+        return TestResult.objects.create(
+            patient=patient, glucose=glucose, blood_pressure=80.0, skin_thickness=20.0, insulin=80.0, bmi=28.0,
+            cholesterol=cholesterol, fasting_bs='N', resting_ecg='Normal', max_hr=150, exercise_angina='N',
+            chest_pain_type=chest_pain_type)
+
+    def rescore(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('rescore_test_results', '--chunk-size', '3', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def scored_ids(self):
+        return list(
+            Prediction.objects.filter(model_version=self.version)
+            .order_by('test_result_id').values_list('test_result_id', flat=True).distinct()
+        )
+
+    def test_rescores_every_test_result(self):
+        self.rescore()
+        self.assertEqual(self.scored_ids(), [test_result.id for test_result in self.test_results])
+        checkpoint = RescoreCheckpoint.objects.get(model_version=self.version)
+        self.assertTrue(checkpoint.completed)
+        self.assertEqual(checkpoint.processed, 10)
+
+    def test_interrupted_run_resumes_after_the_last_chunk(self):
+        chunks = []
+
+        def fail_on_third_chunk(test_results, *args, **kwargs):
+            chunks.append([test_result.id for test_result in test_results])
+            if len(chunks) == 3:
+                raise RuntimeError('interrupted')
+            return predict_test_results(test_results, *args, **kwargs)
+
+        with mock.patch(f'{COMMAND}.predict_test_results', fail_on_third_chunk):
+            with self.assertRaises(RuntimeError):
+                self.rescore()
+
+        checkpoint = RescoreCheckpoint.objects.get(model_version=self.version)
+        self.assertFalse(checkpoint.completed)
+        self.assertEqual(checkpoint.last_test_result_id, self.test_results[5].id)
+        # The failed chunk rolled back with its checkpoint
+        self.assertEqual(self.scored_ids(), [test_result.id for test_result in self.test_results[:6]])
+
+        with mock.patch(f'{COMMAND}.predict_test_results', wraps=predict_test_results) as predict:
+            self.rescore()
+        resumed = [test_result.id for call in predict.call_args_list for test_result in call.args[0]]
+        self.assertEqual(resumed, [test_result.id for test_result in self.test_results[6:]])
+
+        # Every test result was scored exactly once with the version
+        self.assertEqual(self.scored_ids(), [test_result.id for test_result in self.test_results])
+        per_test_result = Prediction.objects.filter(model_version=self.version).values('test_result_id', 'condition')
+        self.assertEqual(per_test_result.count(), per_test_result.distinct().count())
+
+    def test_completed_run_is_not_repeated(self):
+        self.rescore()
+        predictions = Prediction.objects.filter(model_version=self.version).count()
+        stdout, _ = self.rescore()
+        self.assertIn('already rescored', stdout)
+        self.assertEqual(Prediction.objects.filter(model_version=self.version).count(), predictions)
+
+        self.rescore('--restart')
+        self.assertEqual(Prediction.objects.filter(model_version=self.version).count(), 2 * predictions)
+
+    def test_unknown_categories_are_skipped(self):
+        unknown = self.create_test_result(self.patients[0], chest_pain_type='XYZ')
+        stdout, stderr = self.rescore()
+
+        self.assertIn(str(unknown.id), stderr)
+        self.assertIn('skipped 1 with unknown categories', stdout)
+        self.assertNotIn(unknown.id, self.scored_ids())
+        self.assertEqual(len(self.scored_ids()), 10)
+        self.assertTrue(RescoreCheckpoint.objects.get(model_version=self.version).completed)
+
+    def test_unregistered_model_version(self):
+        with self.assertRaisesMessage(CommandError, 'is not registered'):
+            self.rescore('--model-version', '0000000000000000')
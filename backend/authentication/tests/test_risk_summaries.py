@@ -0,0 +1,101 @@
+import numpy as np
+from django.conf import settings
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from authentication.inference import predict_test_results, update_risk_summaries
+from authentication.model_loader import LoadedModels
+from authentication.models import DoctorProfile, PatientProfile, PatientRiskSummary, Prediction, TestResult, User
+
+
+class RiskSummaryTestCase(TestCase):
+    def setUp(self):
+        doctor_user = User.objects.create_user(
+            email='doctor@example.com', password='password', first_name='Dana', last_name='Doctor', user_role='Doctor')
+        self.doctor = DoctorProfile.objects.create(user=doctor_user, specialization='Cardiology', license_number='D-1')
+        self.admin = User.objects.create_user(
+            email='admin@example.com', password='password', first_name='Ada', last_name='Admin', is_staff=True)
+        self.mine, self.other = (
+            PatientProfile.objects.create(
+                user=User.objects.create_user(
+                    email=f'{name}@example.com', password='password', first_name=name, last_name='Patient',
+                    gender='Male'),
+                age=55, emergency_contact='0')
+            for name in ('mine', 'other')
+        )
+        self.doctor.patients.add(self.mine)
+
+    def create_test_result(self, patient):
+        return TestResult.objects.create(
+            patient=patient, glucose=120.0, blood_pressure=80.0, skin_thickness=20.0, insulin=80.0, bmi=28.0,
+            cholesterol=200.0, fasting_bs='N', resting_ecg='Normal', max_hr=150, exercise_angina='N',
+            chest_pain_type='ATA')
+
+
+class RiskSummaryTests(RiskSummaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.older = self.create_test_result(self.mine)
+        self.newer = self.create_test_result(self.mine)
+
+    def test_summary_follows_the_latest_test_result(self):
+        models = LoadedModels.from_bundle(settings.MODEL_BUNDLE_PATH)
+        predict_test_results([self.older], models, use_cache=False)
+        predict_test_results([self.newer], models, use_cache=False)
+        summary = PatientRiskSummary.objects.get(patient=self.mine)
+        self.assertEqual(summary.test_result_id, self.newer.id)
+        self.assertEqual(summary.model_version, models.version)
+        self.assertTrue(Prediction.objects.filter(test_result=self.newer, model_version=models.version).exists())
+
+    def test_older_test_result_does_not_replace_the_summary(self):
+        confidences = {'diabetes': np.array([10.0]), 'heart_disease': np.array([20.0])}
+        update_risk_summaries([self.newer], confidences, 'v1')
+        update_risk_summaries([self.older], {key: values + 50 for key, values in confidences.items()}, 'v2')
+
+        summary = PatientRiskSummary.objects.get(patient=self.mine)
+        self.assertEqual(summary.test_result_id, self.newer.id)
+        self.assertEqual((summary.diabetes_confidence, summary.risk_confidence, summary.model_version), (10.0, 20.0, 'v1'))
+
+    def test_latest_test_result_of_a_batch_wins(self):
+        confidences = {'diabetes': np.array([30.0, 10.0]), 'heart_disease': np.array([40.0, 5.0])}
+        update_risk_summaries([self.newer, self.older], confidences)
+        summary = PatientRiskSummary.objects.get(patient=self.mine)
+        self.assertEqual((summary.test_result_id, summary.risk_confidence), (self.newer.id, 40.0))
+
+
+class AtRiskPatientsTests(RiskSummaryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mine_result, self.other_result = self.create_test_result(self.mine), self.create_test_result(self.other)
+        update_risk_summaries(
+            [self.mine_result, self.other_result],
+            {'diabetes': np.array([30.0, 80.0]), 'heart_disease': np.array([60.0, 10.0])}
+        )
+
+    def ranked(self, user, query=''):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(f'/api/patients/at-risk/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [summary['test_result'] for summary in response.data]
+
+    def status_code(self, user, query=''):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(f'/api/patients/at-risk/?{query}').status_code
+
+    def test_doctor_needs_scope_mine(self):
+        self.assertEqual(self.status_code(self.doctor.user), 403)
+        self.assertEqual(self.ranked(self.doctor.user, 'scope=mine'), [self.mine_result.id])
+
+    def test_scope_mine_needs_a_doctor(self):
+        self.assertEqual(self.status_code(self.admin, 'scope=mine'), 403)
+
+    def test_admin_ranks_every_patient(self):
+        self.assertEqual(self.ranked(self.admin), [self.other_result.id, self.mine_result.id])
+        self.assertEqual(self.ranked(self.admin, 'condition=heart_disease'), [self.mine_result.id, self.other_result.id])
+        self.assertEqual(self.ranked(self.admin, 'k=1'), [self.other_result.id])
+
+    def test_validation(self):
+        for query in ('condition=cancer', 'k=x', 'k=0', f'k={settings.AT_RISK_PATIENTS_MAX_K + 1}'):
+            self.assertEqual(self.status_code(self.admin, query), 400, query)
@@ -0,0 +1,79 @@
+import os
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from authentication import similarity
+from authentication.model_loader import get_models
+from authentication.models import DeletedTestResult, PatientProfile, TestResult, User
+
+
+class SimilarTestResultsTests(TestCase):
+    def setUp(self):
+        index = mock.patch.object(similarity, '_index', None)
+        index.start()
+        self.addCleanup(index.stop)
+
+        first, second = (
+            PatientProfile.objects.create(
+                user=User.objects.create_user(
+                    email=f'patient{age}@example.com', password='password', first_name='Pat', last_name=str(age),
+                    gender='Female'),
+                age=age, emergency_contact='0')
+            for age in (40, 42)
+        )
+        self.query = self.create_test_result(first, glucose=120.0)
+        self.near = self.create_test_result(second, glucose=121.0)
+        self.far = self.create_test_result(second, glucose=199.0, cholesterol=390.0, max_hr=80)
+
+        doctor = User.objects.create_user(
+            email='doctor@example.com', password='password', first_name='Dana', last_name='Doctor', user_role='Doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(doctor)
+
+    def create_test_result(self, patient, glucose, cholesterol=200.0, max_hr=150):
+        return TestResult.objects.create(
+            patient=patient, glucose=glucose, blood_pressure=80.0, skin_thickness=20.0, insulin=80.0, bmi=28.0,
+            cholesterol=cholesterol, fasting_bs='N', resting_ecg='Normal', max_hr=max_hr, exercise_angina='N',
+            chest_pain_type='ATA')
+
+    def neighbours(self, k=10):
+        response = self.client.get(f'/api/test-results/{self.query.id}/similar/?k={k}')
+        self.assertEqual(response.status_code, 200)
+        return [neighbour['test_result_id'] for neighbour in response.data['neighbours']]
+
+    def test_not_ready_until_the_index_is_built(self):
+        with mock.patch.object(similarity, 'start_similarity_index_build') as start_build:
+            response = self.client.get(f'/api/test-results/{self.query.id}/similar/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        start_build.assert_called_once()
+
+        similarity.build_similarity_index(get_models().vectorizer)
+        self.assertEqual(self.neighbours(k=2), [self.near.id, self.far.id])
+
+    def test_build_inherited_from_a_forked_parent_is_ignored(self):
+        vectorizer = get_models().vectorizer
+        with mock.patch.object(similarity, '_building', (os.getpid() + 1, vectorizer.preprocessing_version)), \
+                mock.patch.object(similarity.threading, 'Thread') as thread:
+            similarity.start_similarity_index_build(vectorizer)
+            # A second call while this process's build is under way does not start another
+            similarity.start_similarity_index_build(vectorizer)
+        thread.assert_called_once()
+
+    def test_changes_are_synced(self):
+        index = similarity.build_similarity_index(get_models().vectorizer)
+        self.far.glucose, self.far.cholesterol, self.far.max_hr = 120.5, 200.0, 150
+        self.far.save()
+        deleted_id = self.near.id
+        self.near.delete()
+        index.sync(force=True)
+
+        self.assertEqual(self.neighbours(), [self.far.id])
+        self.assertTrue(DeletedTestResult.objects.filter(test_result_id=deleted_id).exists())
+
+    def test_validation(self):
+        for query in ('k=x', 'k=0', f'k={settings.SIMILAR_TEST_RESULTS_MAX_K + 1}'):
+            self.assertEqual(self.client.get(f'/api/test-results/{self.query.id}/similar/?{query}').status_code, 400)
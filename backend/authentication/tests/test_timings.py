@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from authentication.caches import prediction_cache
+from authentication.conditions import ConditionModel, condition_models
+from authentication.models import PatientProfile, PredictionTiming, TestResult, User
+
+
+@override_settings(PREDICTION_TIMING_ENABLED=True)
+class PredictionTimingTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            email='admin@example.com', password='password', first_name='Ada', last_name='Admin', is_staff=True)
+        patient_user = User.objects.create_user(
+            email='patient@example.com', password='password', first_name='Pat', last_name='Patient', gender='Male')
+        patient = PatientProfile.objects.create(user=patient_user, age=50, emergency_contact='0')
+        self.test_result = TestResult.objects.create(
+            patient=patient, glucose=120.0, blood_pressure=80.0, skin_thickness=20.0, insulin=80.0, bmi=28.0,
+            cholesterol=200.0, fasting_bs='N', resting_ecg='Normal', max_hr=150, exercise_angina='N',
+            chest_pain_type='ATA')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        if prediction_cache.backend is not None:
+            prediction_cache.backend.clear()
+
+    def predict(self):
+        response = self.client.post(f'/api/test-results/{self.test_result.id}/predict/')
+        self.assertEqual(response.status_code, 201)
+        return PredictionTiming.objects.filter(test_result=self.test_result).latest('created_at')
+
+    def test_prediction_records_its_stages(self):
+        timing = self.predict()
+        for name in ('fetch', 'encode', 'save', 'total'):
+            self.assertIn(name, timing.stages)
+        self.assertFalse(timing.cache_hit)
+        self.assertEqual(len(timing.input_hash), 32)
+
+        stats = self.client.get('/api/admin/model/timings/')
+        self.assertEqual(stats.status_code, 200)
+        self.assertEqual(stats.data['requests'], 1)
+        self.assertEqual(stats.data['stages']['total']['count'], 1)
+
+    def test_cache_hit(self):
+        if prediction_cache.backend is None:
+            self.skipTest('The prediction cache is disabled')
+        self.predict()
+        self.assertTrue(self.predict().cache_hit)
+        self.assertEqual(self.client.get('/api/admin/model/timings/').data['cache_hit_requests'], 1)
+
+    def test_configured_condition_stage_is_recorded(self):
+        conditions = [
+            ConditionModel(
+                condition.key, condition.condition, condition.features, condition.predict, condition.threshold,
+                stage='custom_model' if condition.key == 'diabetes' else condition.stage)
+            for condition in condition_models
+        ]
+        with mock.patch('authentication.inference.condition_models', conditions):
+            timing = self.predict()
+        self.assertIn('custom_model', timing.stages)
+        self.assertIn('custom_model', self.client.get('/api/admin/model/timings/').data['stages'])
+
+    def test_hours_validation(self):
+        self.assertEqual(self.client.get('/api/admin/model/timings/?hours=0.5').status_code, 200)
+        for hours in ('x', '0', '-1', 'nan', 'inf', str(settings.STATS_MAX_HOURS + 1)):
+            response = self.client.get(f'/api/admin/model/timings/?hours={hours}')
+            self.assertEqual(response.status_code, 400, hours)
+            self.assertIn('hours must be', response.data['error'])
@@ -0,0 +1,52 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.models import TrainingJob, User
+
+
+@mock.patch('authentication.training.subprocess.Popen')
+class RetrainEndpointTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            email='admin@example.com', password='password', first_name='Ada', last_name='Admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_one_job_at_a_time(self, popen):
+        first = self.client.post('/api/admin/model/retrain/')
+        self.assertEqual(first.status_code, 202)
+        popen.assert_called_once()
+
+        second = self.client.post('/api/admin/model/retrain/')
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(TrainingJob.objects.filter(status__in=['queued', 'running']).count(), 1)
+
+    def test_stale_job_does_not_block(self, popen):
+        stale = TrainingJob.objects.create(requested_by=self.admin, status='running')
+        TrainingJob.objects.filter(id=stale.id).update(
+            updated_at=timezone.now() - timedelta(seconds=settings.RETRAINING['STALE_AFTER'] + 1))
+
+        self.assertEqual(self.client.post('/api/admin/model/retrain/').status_code, 202)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+
+    def test_job_fails_when_the_worker_cannot_start(self, popen):
+        popen.side_effect = OSError('no worker')
+        self.assertEqual(self.client.post('/api/admin/model/retrain/').status_code, 400)
+        self.assertEqual(TrainingJob.objects.get().status, 'failed')
+        # The failed job does not block the next request
+        popen.side_effect = None
+        self.assertEqual(self.client.post('/api/admin/model/retrain/').status_code, 202)
+
+    def test_admin_only(self, popen):
+        user = User.objects.create_user(
+            email='doctor@example.com', password='password', first_name='Dana', last_name='Doctor', user_role='Doctor')
+        client = APIClient()
+        client.force_authenticate(user)
+        self.assertEqual(client.post('/api/admin/model/retrain/').status_code, 403)
+        popen.assert_not_called()
@@ -0,0 +1,215 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication import jobs
+from authentication.caches import recommendation_cache
+from authentication.llm import FakeLLMClient, LLMError
+from authentication.models import (
+    BackgroundJob, DoctorProfile, Notification, PatientProfile, Prediction, TestResult, TreatmentPlan, User,
+)
+from authentication.treatment_plans import claim_treatment_plan, run_treatment_plan_job, treatment_plan_failed
+
+
+class TreatmentPlanTestCase(TestCase):
+    def setUp(self):
+        doctor_user = User.objects.create_user(
+            email='doctor@example.com', password='password', first_name='Dana', last_name='Doctor', user_role='Doctor')
+        self.doctor = DoctorProfile.objects.create(user=doctor_user, specialization='Cardiology', license_number='D-1')
+        patient_user = User.objects.create_user(
+            email='patient@example.com', password='password', first_name='Pat', last_name='Patient', gender='Male')
+        patient = PatientProfile.objects.create(user=patient_user, age=50, emergency_contact='0')
+        self.doctor.patients.add(patient)
+        test_result = TestResult.objects.create(
+            patient=patient, glucose=160.0, blood_pressure=90.0, skin_thickness=20.0, insulin=80.0, bmi=33.0,
+            cholesterol=260.0, fasting_bs='Y', resting_ecg='ST', max_hr=120, exercise_angina='Y',
+            chest_pain_type='ASY')
+        self.prediction = Prediction.objects.create(
+            patient=patient, test_result=test_result, condition='Diabetes', confidence=75.0)
+
+        self.client = APIClient()
+        self.client.force_authenticate(doctor_user)
+        self.url = f'/api/predictions/{self.prediction.id}/treatment-plan/'
+
+        if recommendation_cache.backend is not None:
+            recommendation_cache.backend.clear()
+        self.llm = FakeLLMClient({'DISTRIBUTION': 'constant', 'MEDIAN_MS': 0}, first_chunk_ms=0)
+        llm = mock.patch('authentication.treatment_plans.get_llm_client', return_value=self.llm)
+        llm.start()
+        self.addCleanup(llm.stop)
+
+    def run_jobs(self):
+        """Run every due job, as a worker would"""
+        while True:
+            job = jobs.claim('test-worker')
+            if job is None:
+                return
+            jobs.run(job, 'test-worker')
+
+
+class TreatmentPlanJobTests(TreatmentPlanTestCase):
+    def test_request_is_queued_once(self):
+        first, second = self.client.post(self.url), self.client.post(self.url)
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(second.data['plan_status'], 'pending')
+        self.assertEqual(BackgroundJob.objects.count(), 1)
+
+        response = self.client.get(self.url)
+        self.assertEqual((response.status_code, response.data['plan_status']), (404, 'pending'))
+
+    def test_job_stores_the_plan(self):
+        self.client.post(self.url)
+        self.run_jobs()
+
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.plan_status, 'ready')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['primary_recommendation'])
+        self.assertEqual(BackgroundJob.objects.get().status, 'succeeded')
+        self.assertTrue(Notification.objects.filter(user=self.doctor.user, notification_type='treatment_plan').exists())
+
+    def test_ready_plan_is_regenerated(self):
+        self.client.post(self.url)
+        self.run_jobs()
+        old_plan = TreatmentPlan.objects.get()
+
+        with mock.patch.object(self.llm, 'generate', wraps=self.llm.generate) as generate:
+            response = self.client.post(f'{self.url}?bypass_cache=true')
+            self.assertEqual((response.status_code, response.data['plan_status']), (202, 'pending'))
+            # The old plan is served until the new one is stored
+            self.assertEqual(self.client.get(self.url).data['id'], old_plan.id)
+            self.run_jobs()
+        generate.assert_called_once()
+
+        new_plan = TreatmentPlan.objects.get()
+        self.assertNotEqual(new_plan.id, old_plan.id)
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.plan_status, 'ready')
+
+    def test_get_returns_the_latest_plan(self):
+        plans = [
+            TreatmentPlan.objects.create(
+                prediction=self.prediction, patient=self.prediction.patient, primary_recommendation=text)
+            for text in ('older', 'newer')
+        ]
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], plans[1].id)
+
+    def test_failed_calls_are_retried_then_marked_failed(self):
+        self.client.post(self.url)
+        with mock.patch.object(self.llm, 'generate', side_effect=LLMError('down')), \
+                self.assertLogs('authentication.treatment_plans', 'WARNING'):
+            with self.assertRaises(jobs.JobError):
+                run_treatment_plan_job(BackgroundJob.objects.get().payload)
+        self.assertFalse(TreatmentPlan.objects.exists())
+
+        treatment_plan_failed(BackgroundJob.objects.get().payload)
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.plan_status, 'failed')
+
+
+class RecommendationCacheTests(TreatmentPlanTestCase):
+    def setUp(self):
+        super().setUp()
+        if recommendation_cache.backend is None:
+            self.skipTest('The recommendation cache is disabled')
+
+    def test_similar_patient_is_served_from_the_cache(self):
+        self.client.post(self.url)
+        self.run_jobs()
+
+        # Same condition and inputs within the same buckets
+        other = Prediction.objects.create(
+            patient=self.prediction.patient, test_result=self.prediction.test_result, condition='Diabetes',
+            confidence=75.2)
+        with mock.patch.object(self.llm, 'generate') as generate:
+            self.client.post(f'/api/predictions/{other.id}/treatment-plan/')
+            self.run_jobs()
+        generate.assert_not_called()
+        self.assertTrue(TreatmentPlan.objects.get(prediction=other).from_cache)
+
+    def test_bypass_cache(self):
+        self.client.post(self.url)
+        self.run_jobs()
+
+        other = Prediction.objects.create(
+            patient=self.prediction.patient, test_result=self.prediction.test_result, condition='Diabetes',
+            confidence=75.0)
+        with mock.patch.object(self.llm, 'generate', wraps=self.llm.generate) as generate:
+            self.client.post(f'/api/predictions/{other.id}/treatment-plan/?bypass_cache=true')
+            self.run_jobs()
+        generate.assert_called_once()
+        self.assertFalse(TreatmentPlan.objects.get(prediction=other).from_cache)
+
+
+class JobQueueStatsTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create_user(
+            email='admin@example.com', password='password', first_name='Ada', last_name='Admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+    def test_hours_validation(self):
+        self.assertEqual(self.client.get('/api/admin/jobs/?hours=0.5').status_code, 200)
+        for hours in ('x', '0', '-1', 'nan', 'inf', str(settings.STATS_MAX_HOURS + 1)):
+            response = self.client.get(f'/api/admin/jobs/?hours={hours}')
+            self.assertEqual(response.status_code, 400, hours)
+            self.assertIn('hours must be', response.data['error'])
+
+
+class StreamTreatmentPlanTests(TreatmentPlanTestCase):
+    def stream(self, prediction_id=None):
+        if prediction_id is None:
+            prediction_id = self.prediction.id
+        return self.client.post(f'/api/predictions/{prediction_id}/treatment-plan/stream/')
+
+    def events(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [
+            event.split('\n')[0].removeprefix('event: ')
+            for event in b''.join(response.streaming_content).decode().split('\n\n') if event
+        ]
+
+    def test_stream_sends_chunks_then_the_plan(self):
+        events = self.events(self.stream())
+        self.assertEqual(events[-1], 'plan')
+        self.assertEqual(set(events[:-1]), {'chunk'})
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.plan_status, 'ready')
+        self.assertEqual(TreatmentPlan.objects.filter(prediction=self.prediction).count(), 1)
+
+    def test_failed_stream_is_queued(self):
+        with mock.patch.object(self.llm, 'stream', side_effect=LLMError('down')), \
+                self.assertLogs('authentication.treatment_plans', 'WARNING'):
+            self.assertEqual(self.events(self.stream()), ['error'])
+        self.assertEqual(BackgroundJob.objects.count(), 1)
+
+        self.run_jobs()
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.plan_status, 'ready')
+
+    def test_stream_conflicts_with_a_pending_plan(self):
+        self.client.post(self.url)
+        self.assertEqual(self.stream().status_code, 409)
+
+    def test_expired_claim_is_taken_over(self):
+        # A process killed mid-stream leaves the plan pending without a job
+        self.assertTrue(claim_treatment_plan(self.prediction))
+        self.assertEqual(self.stream().status_code, 409)
+        Prediction.objects.filter(id=self.prediction.id).update(
+            plan_claimed_at=timezone.now() - timedelta(seconds=settings.TREATMENT_PLANS['CLAIM_TIMEOUT'] + 1))
+
+        self.assertEqual(self.client.post(self.url).status_code, 202)
+        self.assertEqual(BackgroundJob.objects.count(), 1)
+        self.run_jobs()
+        self.prediction.refresh_from_db()
+        self.assertEqual(self.prediction.plan_status, 'ready')
+
+    def test_missing_prediction(self):
+        self.assertEqual(self.stream(0).status_code, 404)
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from authentication.models import PatientProfile, TestResult, User
+
+
+class WhatIfCurveTests(TestCase):
+    def setUp(self):
+        patient_user = User.objects.create_user(
+            email='patient@example.com', password='password', first_name='Pat', last_name='Patient', gender='Male')
+        patient = PatientProfile.objects.create(user=patient_user, age=50, emergency_contact='0')
+        test_result = TestResult.objects.create(
+            patient=patient, glucose=120.0, blood_pressure=80.0, skin_thickness=20.0, insulin=80.0, bmi=28.0,
+            cholesterol=200.0, fasting_bs='N', resting_ecg='Normal', max_hr=150, exercise_angina='N',
+            chest_pain_type='ATA')
+        doctor = User.objects.create_user(
+            email='doctor@example.com', password='password', first_name='Dana', last_name='Doctor', user_role='Doctor')
+        self.client = APIClient()
+        self.client.force_authenticate(doctor)
+        self.url = f'/api/test-results/{test_result.id}/what-if/'
+
+    def test_range_is_scored(self):
+        response = self.client.get(f'{self.url}?feature=cholesterol&range=150:300:50')
+        self.assertEqual(response.status_code, 200)
+
+    def test_range_validation(self):
+        too_many = settings.WHAT_IF_MAX_POINTS
+        for value_range, error in (
+            ('150:300', 'range must be start:stop:step'),
+            ('a:b:c', 'range must be start:stop:step'),
+            ('nan:300:5', 'must be finite'),
+            ('150:inf:5', 'must be finite'),
+            ('150:300:nan', 'must be finite'),
+            ('-inf:inf:1', 'must be finite'),
+            ('150:300:0', 'positive step'),
+            ('150:300:-5', 'positive step'),
+            ('300:150:5', 'stop >= start'),
+            (f'0:{too_many}:1', f'At most {too_many} values'),
+            ('0:1:1e-300', f'At most {too_many} values'),
+        ):
+            response = self.client.get(f'{self.url}?feature=cholesterol&range={value_range}')
+            self.assertEqual(response.status_code, 400, value_range)
+            self.assertIn(error, response.data['error'], value_range)
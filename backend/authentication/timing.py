@@ -0,0 +1,73 @@
+"""
+Per-stage timing of the prediction path.
+
+A StageTimer is threaded through a request and accumulates the wall-clock
+time of each named stage on the monotonic clock. The timings are stored as
+PredictionTiming rows, keyed by stage name so the stages of configured
+condition models are kept too, and summarized by stage_percentiles().
+"""
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+from .models import PredictionTiming
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class StageTimer:
+    """Accumulates milliseconds per stage; details holds facts about the run such as input hashes"""
+
+    def __init__(self):
+        self.timings = {}
+        self.details = {}
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + (time.perf_counter() - start) * 1000
+
+    def elapsed(self):
+        """Milliseconds since the timer was created"""
+        return (time.perf_counter() - self._started) * 1000
+
+
+def stage(timer, name):
+    """timer.stage(name), or a context that does nothing when timer is None"""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def record_timing(timer, test_result, model_version):
+    """Store the timings of one scored test result"""
+    return PredictionTiming.objects.create(
+        test_result=test_result,
+        model_version=model_version,
+        input_hash=timer.details.get('input_hashes', [''])[0],
+        cache_hit=bool(timer.details.get('cache_hits')),
+        stages={**timer.timings, 'total': timer.elapsed()}
+    )
+
+
+def stage_percentiles(timings):
+    """Summarize each stage of a PredictionTiming queryset: count, mean, percentiles and max in ms"""
+    # Stages a request did not go through are absent from its row
+    by_stage = {}
+    for stages in timings.values_list('stages', flat=True):
+        for name, ms in stages.items():
+            by_stage.setdefault(name, []).append(ms)
+
+    summary = {}
+    for name, values in by_stage.items():
+        values = np.array(values, dtype=np.float64)
+        summary[name] = {
+            'count': len(values),
+            'mean': round(float(values.mean()), 3),
+            **{f'p{p}': round(float(v), 3) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+            'max': round(float(values.max()), 3),
+        }
+    return summary
@@ -0,0 +1,262 @@
+"""
+Retraining of the heart failure model from reviewed predictions.
+
+The web process only records a TrainingJob and starts
+`manage.py retrain_heart_model` in a separate process, which streams the
+labelled test results, warm-starts the booster of the serving bundle, and
+registers the result as a new model version.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import registry
+from .bundle import ModelBundle, replace_heart_failure_model, write_bundle
+from .engines import TreeEnsemble
+from .feature_store import refresh_stale_features, stored_features
+from .features import DIABETES_COLUMNS, HEART_COLUMNS
+from .models import TestResult, TrainingJob
+
+# Reviewed predictions that say whether the patient has a condition. A
+# confirmed 'Healthy' prediction is a negative; an incorrect one only says
+# that some condition was missed, so it is not used.
+HEART_LABELS = {
+    ('Heart Disease', 'confirmed'): 1,
+    ('Heart Disease', 'incorrect'): 0,
+    ('Healthy', 'confirmed'): 0,
+}
+DIABETES_LABELS = {
+    ('Diabetes', 'confirmed'): 1,
+    ('Diabetes', 'incorrect'): 0,
+    ('Healthy', 'confirmed'): 0,
+}
+
+
+class TrainingJobRunning(Exception):
+    """Another training job is still queued or running"""
+
+
+def start_training_job(requested_by=None, activate=False):
+    """
+    Record a training job and start its worker process.
+
+    Returns immediately; the job row reports progress. A job that has not
+    reported progress for RETRAINING['STALE_AFTER'] seconds is assumed dead,
+    marked failed, and no longer blocks new ones. The one_active_training_job
+    constraint makes the insert fail while another job is queued or running,
+    so concurrent requests cannot both start one.
+    """
+    now = timezone.now()
+    TrainingJob.objects.filter(
+        status__in=['queued', 'running'],
+        updated_at__lt=now - timedelta(seconds=settings.RETRAINING['STALE_AFTER'])
+    ).update(status='failed', message='No progress reported; assumed dead', finished_at=now, updated_at=now)
+
+    try:
+        with transaction.atomic():
+            job = TrainingJob.objects.create(requested_by=requested_by, activate=activate)
+    except IntegrityError:
+        running = TrainingJob.objects.filter(status__in=['queued', 'running']).first()
+        raise TrainingJobRunning(
+            f'Training job {running.pk} is still {running.status}' if running else 'A training job is still running'
+        )
+
+    try:
+        subprocess.Popen(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'retrain_heart_model', '--job', str(job.pk)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            # Detach so the worker outlives the request and is not killed with the web worker
+            start_new_session=True,
+            close_fds=True
+        )
+    except Exception as e:
+        # Otherwise the job would block new ones until it went stale
+        update_job(job, status='failed', message=f'Could not start the worker process: {e}', finished_at=timezone.now())
+        raise
+    return job
+
+
+def update_job(job, **fields):
+    """Save progress fields of a job without touching the rest of the row"""
+    fields['updated_at'] = timezone.now()
+    for name, value in fields.items():
+        setattr(job, name, value)
+    TrainingJob.objects.filter(pk=job.pk).update(**fields)
+
+
+def serving_bundle():
+    """The bundle workers are serving: the active registry version, or MODEL_BUNDLE_PATH"""
+    active = registry.active_version()
+    return ModelBundle(registry.bundle_file(active) if active is not None else settings.MODEL_BUNDLE_PATH)
+
+
+def labelled_test_results(condition_labels):
+    """Test results joined with their reviewed predictions, oldest review first"""
+    conditions = {condition for condition, _ in condition_labels}
+    statuses = {status for _, status in condition_labels}
+    return (
+        TestResult.objects
+        .filter(predictions__condition__in=conditions, predictions__status__in=statuses)
+        .order_by('predictions__id')
+        .values('id', 'predictions__condition', 'predictions__status', 'feature_vector', 'feature_version')
+    )
+
+
+def load_training_data(vectorizer, condition_labels, chunk_size, on_progress=None):
+    """
+    Stream the stored feature vectors of the labelled test results into
+    preallocated arrays.
+
+    condition_labels maps (condition, status) of a reviewed prediction to a
+    label, e.g. HEART_LABELS. Returns the scaled diabetes and heart features,
+    the labels and the test result ids.
+
+    Stale vectors are recomputed before reading. Rows are then read with a
+    server-side cursor in chunks, so memory is bounded by the output arrays.
+    When a test result was reviewed more than once, the latest review wins.
+    """
+    queryset = labelled_test_results(condition_labels)
+    refresh_stale_features(queryset, vectorizer, chunk_size)
+
+    capacity = queryset.count()
+    diabetes_features = np.empty((capacity, len(DIABETES_COLUMNS)), dtype=np.float32)
+    heart_features = np.empty((capacity, len(HEART_COLUMNS)), dtype=np.float32)
+    labels = np.empty(capacity, dtype=np.float32)
+    ids = np.empty(capacity, dtype=np.int64)
+    positions = {}
+
+    def store(chunk):
+        # Test results the encoders cannot read have no vector and are left out
+        indices, diabetes_chunk, heart_chunk = stored_features(chunk, vectorizer, refresh=False)
+        for index, diabetes_row, heart_row in zip(indices, diabetes_chunk, heart_chunk):
+            row = chunk[index]
+            label = condition_labels.get((row['predictions__condition'], row['predictions__status']))
+            if label is None:
+                continue
+            position = positions.setdefault(row['id'], len(positions))
+            diabetes_features[position] = diabetes_row
+            heart_features[position] = heart_row
+            labels[position] = label
+            ids[position] = row['id']
+
+    chunk = []
+    for read, row in enumerate(queryset.iterator(chunk_size=chunk_size), start=1):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            store(chunk)
+            chunk = []
+            if on_progress is not None:
+                on_progress(read / capacity)
+    if chunk:
+        store(chunk)
+
+    rows = len(positions)
+    return diabetes_features[:rows], heart_features[:rows], labels[:rows], ids[:rows]
+
+
+def _evaluate(booster, features, labels):
+    import xgboost as xgb
+
+    predictions = booster.predict(xgb.DMatrix(features))
+    clipped = np.clip(predictions, 1e-7, 1 - 1e-7)
+    return {
+        'logloss': round(float(-np.mean(labels * np.log(clipped) + (1 - labels) * np.log(1 - clipped))), 5),
+        'accuracy': round(float(np.mean((predictions >= 0.5) == labels)), 5),
+    }
+
+
+def run_training_job(job):
+    """Retrain the heart failure model for a job and register the result"""
+    import xgboost as xgb
+
+    config = settings.RETRAINING
+    update_job(job, status='running', stage='loading data', progress=0, started_at=timezone.now())
+
+    bundle = serving_bundle()
+    base_booster = bundle.heart_failure_booster()
+    if base_booster is None:
+        raise ValueError(f'Bundle {bundle.version} has no XGBoost booster to warm-start from')
+
+    _, features, labels, ids = load_training_data(
+        bundle.vectorizer(),
+        HEART_LABELS,
+        config['CHUNK_SIZE'],
+        lambda fraction: update_job(job, progress=round(30 * fraction, 1))
+    )
+    update_job(job, samples=len(labels))
+    if len(labels) < config['MIN_SAMPLES']:
+        raise ValueError(f"Only {len(labels)} reviewed test results, at least {config['MIN_SAMPLES']} are needed")
+
+    # Hold out a stable fifth of the test results to compare the old and new models
+    holdout = ids % 5 == 0
+    train = ~holdout
+    if not train.any():
+        train = holdout
+
+    update_job(job, stage='training', progress=30)
+    rounds = config['NUM_BOOST_ROUND']
+    params = {
+        'objective': 'binary:logistic',
+        'tree_method': 'hist',
+        'eta': config['LEARNING_RATE'],
+        'eval_metric': 'logloss',
+    }
+    if config['NTHREAD']:
+        params['nthread'] = config['NTHREAD']
+
+    class ProgressCallback(xgb.callback.TrainingCallback):
+        def after_iteration(self, model, epoch, evals_log):
+            if (epoch + 1) % max(rounds // 20, 1) == 0:
+                update_job(job, progress=round(30 + 60 * (epoch + 1) / rounds, 1))
+            return False
+
+    booster = xgb.train(
+        params,
+        xgb.DMatrix(features[train], label=labels[train]),
+        num_boost_round=rounds,
+        # Continue boosting from the serving model instead of starting over
+        xgb_model=base_booster,
+        callbacks=[ProgressCallback()]
+    )
+
+    update_job(job, stage='exporting', progress=90)
+    metrics = {'samples': int(len(labels)), 'holdout_samples': int(holdout.sum()), 'base_version': bundle.version}
+    if holdout.any():
+        metrics['base'] = _evaluate(base_booster, features[holdout], labels[holdout])
+        metrics['retrained'] = _evaluate(booster, features[holdout], labels[holdout])
+
+    booster_json = booster.save_raw('json')
+    arrays, metadata = replace_heart_failure_model(
+        bundle, TreeEnsemble.from_xgboost_model(json.loads(booster_json)), booster_json)
+
+    os.makedirs(settings.MODEL_REGISTRY['DIRECTORY'], exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=settings.MODEL_REGISTRY['DIRECTORY']) as directory:
+        path = os.path.join(directory, 'retrained.bundle')
+        write_bundle(path, arrays, metadata)
+        model_version = registry.register_bundle(
+            path,
+            description=f'Heart failure model retrained from {bundle.version} by training job {job.pk}',
+            metrics=metrics,
+            activate=job.activate
+        )
+
+    update_job(
+        job,
+        status='succeeded',
+        stage='',
+        progress=100,
+        metrics=metrics,
+        model_version=model_version.version,
+        finished_at=timezone.now()
+    )
+    return model_version
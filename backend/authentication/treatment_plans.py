@@ -0,0 +1,412 @@
+"""
+Treatment plans generated with Gemini, or the language model client
+configured in settings.LLM_CLIENT (see llm.py).
+
+A Gemini round-trip takes seconds, so plans are not generated in the request
+that made the prediction: request_treatment_plans() queues a background job
+per test result (see jobs.py) and sets the plan_status of its predictions to
+'pending'. The job stores the plans and sets their status to 'ready', or to
+'failed' once its retries are exhausted; clients poll the status and then
+fetch the plan. Requesting the plan of a prediction that already has one
+regenerates it, and the new plan replaces the old one.
+
+The Gemini calls of a job are made concurrently, so a patient flagged for
+several conditions waits for the slowest call rather than for their sum.
+Each call has a timeout and the job a deadline (settings.TREATMENT_PLANS);
+predictions left without a plan are retried with the job. Recommendations
+are looked up in the recommendation cache first (see caches.py), unless the
+request asked to bypass it.
+
+stream_treatment_plan() is the interactive alternative to a job: it relays
+Gemini's response to the client as server-sent events while it is generated
+and stores the plan when the response is complete.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .caches import recommendation_cache
+from .jobs import JobError, enqueue
+from .llm import get_llm_client
+from .models import Notification, NotificationType, Prediction, TreatmentPlan
+from .serializers import TreatmentPlanSerializer
+
+logger = logging.getLogger(__name__)
+
+TREATMENT_PLAN_JOB = 'treatment_plan'
+
+# Shared by the job workers of a process, so concurrent Gemini calls stay bounded
+_executor = ThreadPoolExecutor(max_workers=settings.TREATMENT_PLANS['THREADS'], thread_name_prefix='treatment-plan')
+
+
+def build_prompt(test_result, prediction):
+    """The Gemini prompt asking for the treatment plan of a prediction"""
+    # Convert choice codes to full names
+    fasting_bs = 'Yes' if test_result.fasting_bs == 'Y' else 'No'
+    exercise_angina = 'Yes' if test_result.exercise_angina == 'Y' else 'No'
+    
+    # Get full name for chest pain type
+    chest_pain_map = {
+        'TA': 'Typical Angina',
+        'ATA': 'Atypical Angina',
+        'NAP': 'Non-Anginal Pain',
+        'ASY': 'Asymptomatic'
+    }
+    chest_pain = chest_pain_map.get(test_result.chest_pain_type)
+
+    # Get full name for resting ECG
+    resting_ecg_map = {
+        'Normal': 'Normal',
+        'ST': 'ST-T Wave Abnormality',
+        'LVH': 'Left Ventricular Hypertrophy'
+    }
+    resting_ecg = resting_ecg_map.get(test_result.resting_ecg)
+
+    return f"""As a medical AI assistant, provide a brief but comprehensive treatment plan for a patient with the following:
+
+Condition: {prediction.condition}
+Confidence: {prediction.confidence}%
+
+Patient Details:
+- Age: {test_result.patient.age}
+- Gender: {test_result.patient.user.gender}
+
+Test Results:
+- Glucose: {test_result.glucose}
+- Blood Pressure: {test_result.blood_pressure}
+- BMI: {test_result.bmi}
+- Cholesterol: {test_result.cholesterol}
+- Heart Rate: {test_result.max_hr}
+- Fasting Blood Sugar < 120 mg/dL: {fasting_bs}
+- Resting ECG: {resting_ecg}
+- Exercise Angina: {exercise_angina}
+- Chest Pain Type: {chest_pain}
+
+Please provide a concise treatment plan with:
+1. Brief Primary Treatment Plan (2-3 sentences)
+2. Key Medications (if needed)
+3. Essential Lifestyle Changes
+4. Follow-up Timeline
+5. Critical Warning Signs
+
+Keep each section brief and focused on the most important points."""
+
+
+def parse_recommendation(response_text):
+    """Structure the text of a Gemini response into the fields of a TreatmentPlan"""
+    return {
+        'primary_recommendation': response_text.split('\n\n')[0],
+        'detailed_plan': parse_treatment_sections(response_text),
+        'warnings': extract_warnings(response_text)
+    }
+
+
+def generate_treatment_recommendation(test_result, prediction, timeout=None):
+    """Generate AI treatment recommendations using Gemini, waiting at most timeout seconds"""
+    try:
+        prompt = build_prompt(test_result, prediction)
+
+        # Generate recommendation using Gemini
+        response_text = get_llm_client().generate(prompt, timeout)
+        
+        # Parse and structure the response
+        return parse_recommendation(response_text)
+        
+    except Exception as e:
+        logger.warning('Error generating treatment recommendation: %s', e)
+        return None
+
+
+def parse_treatment_sections(response_text):
+    """Parse the response text into structured sections"""
+    sections = []
+    current_section = None
+    current_recommendations = []
+    
+    for line in response_text.split('\n'):
+        if any(header in line.lower() for header in ['medications:', 'lifestyle changes:', 'follow-up:']):
+            if current_section:
+                sections.append({
+                    'category': current_section,
+                    'recommendations': current_recommendations
+                })
+            current_section = line.strip(':')
+            current_recommendations = []
+        elif line.strip() and current_section:
+            if line.startswith('- '):
+                current_recommendations.append(line[2:])
+            elif line.startswith('• '):
+                current_recommendations.append(line[2:])
+            else:
+                current_recommendations.append(line)
+    
+    if current_section:
+        sections.append({
+            'category': current_section,
+            'recommendations': current_recommendations
+        })
+    
+    return sections
+
+
+def extract_warnings(response_text):
+    """Extract warning signs from the response"""
+    warnings = []
+    warning_section = False
+    
+    for line in response_text.split('\n'):
+        if 'warning' in line.lower() or 'monitor' in line.lower():
+            warning_section = True
+        elif warning_section and line.strip():
+            if line.startswith('- '):
+                warnings.append(line[2:])
+            elif line.startswith('• '):
+                warnings.append(line[2:])
+            elif not line.endswith(':'):
+                warnings.append(line)
+    
+    return warnings
+
+
+def request_treatment_plans(predictions, doctor=None, requested_by=None, use_cache=True):
+    """
+    Queue the generation of a treatment plan for each prediction, one job per
+    test result. The jobs are inserted in the caller's transaction, so they
+    run once it commits. doctor is stored on the plans; requested_by is
+    notified when they are ready. Without use_cache, Gemini is asked even for
+    predictions with a cached recommendation.
+    """
+    now = timezone.now()
+    Prediction.objects.filter(id__in=[prediction.id for prediction in predictions]).update(
+        plan_status='pending', plan_claimed_at=now)
+    by_test_result = {}
+    for prediction in predictions:
+        prediction.plan_status, prediction.plan_claimed_at = 'pending', now
+        by_test_result.setdefault(prediction.test_result_id, []).append(prediction.id)
+    return enqueue(TREATMENT_PLAN_JOB, [
+        {
+            'prediction_ids': prediction_ids,
+            'doctor_id': doctor.id if doctor else None,
+            'requested_by': requested_by.id if requested_by else None,
+            'use_cache': use_cache,
+            # Plans stored before the request are regenerated by the job
+            'requested_at': now.isoformat(),
+        }
+        for prediction_ids in by_test_result.values()
+    ])
+
+
+def _prediction_ids(payload):
+    # Jobs queued before plans were grouped by test result name a single prediction
+    return payload.get('prediction_ids') or [payload['prediction_id']]
+
+
+def generate_recommendations(predictions, use_cache=True):
+    """
+    Look up the recommendations of predictions in the cache, and generate the
+    others concurrently. Returns {prediction id: recommendation}, without the
+    predictions whose call failed or did not finish before the deadline, and
+    the ids of the predictions served from the cache.
+    """
+    config = settings.TREATMENT_PLANS
+    cached = recommendation_cache.get_many(predictions) if use_cache else {}
+    predictions = [prediction for prediction in predictions if prediction.id not in cached]
+
+    futures = {
+        _executor.submit(generate_treatment_recommendation, prediction.test_result, prediction, config['CALL_TIMEOUT']):
+            prediction
+        for prediction in predictions
+    }
+    done, not_done = wait(futures, timeout=config['DEADLINE'])
+    for future in not_done:
+        # Calls that have not started are dropped; running ones end with their timeout
+        future.cancel()
+    generated = {
+        futures[future].id: future.result()
+        for future in done
+        if future.result() is not None
+    }
+    recommendation_cache.set_many(predictions, generated)
+    return {**cached, **generated}, set(cached)
+
+
+def save_treatment_plans(predictions, recommendations, cached=(), doctor_id=None, requested_by=None):
+    """
+    Store the plans of predictions from their {prediction id: recommendation},
+    replacing any earlier plan, and mark them ready. cached holds the ids served from the recommendation
+    cache; requested_by is the id of the user to notify, with the patients.
+    """
+    with transaction.atomic():
+        TreatmentPlan.objects.filter(prediction__in=predictions).delete()
+        TreatmentPlan.objects.bulk_create([
+            TreatmentPlan(
+                prediction=prediction,
+                patient=prediction.test_result.patient,
+                doctor_id=doctor_id,
+                primary_recommendation=recommendations[prediction.id]['primary_recommendation'],
+                detailed_plan=recommendations[prediction.id]['detailed_plan'],
+                warnings=recommendations[prediction.id]['warnings'],
+                from_cache=prediction.id in cached
+            )
+            for prediction in predictions
+        ])
+        Prediction.objects.filter(id__in=[prediction.id for prediction in predictions]).update(plan_status='ready')
+
+        if requested_by:
+            notifications = []
+            for prediction in predictions:
+                patient = prediction.test_result.patient
+                notifications += [
+                    Notification(
+                        user=patient.user,
+                        message=f"New treatment plan created for your {prediction.condition} prediction",
+                        notification_type=NotificationType.TREATMENT_PLAN,
+                        priority='high',
+                        related_patient=patient
+                    ),
+                    Notification(
+                        user_id=requested_by,
+                        message=f"New treatment plan created for patient {patient.user.get_full_name()}",
+                        notification_type=NotificationType.TREATMENT_PLAN,
+                        priority='high',
+                        related_patient=patient
+                    ),
+                ]
+            Notification.objects.bulk_create(notifications)
+
+
+def run_treatment_plan_job(payload):
+    """Generate and store the missing treatment plans of a job's predictions; the handler of TREATMENT_PLAN_JOB"""
+    prediction_ids = _prediction_ids(payload)
+    # Plans stored by an earlier attempt, e.g. one whose worker lost its lock or missed the deadline.
+    # Plans older than the request are regenerated; jobs queued without requested_at keep any plan.
+    plans = TreatmentPlan.objects.filter(prediction_id__in=prediction_ids)
+    if payload.get('requested_at'):
+        plans = plans.filter(created_at__gte=parse_datetime(payload['requested_at']))
+    planned = set(plans.values_list('prediction_id', flat=True))
+    Prediction.objects.filter(id__in=planned).update(plan_status='ready')
+    # Predictions deleted since the job was queued are skipped
+    predictions = list(
+        Prediction.objects.select_related('test_result__patient__user')
+        .filter(id__in=prediction_ids).exclude(id__in=planned).order_by('id')
+    )
+    if not predictions:
+        return
+
+    recommendations, cached = generate_recommendations(predictions, payload.get('use_cache', True))
+    generated = [prediction for prediction in predictions if prediction.id in recommendations]
+
+    save_treatment_plans(generated, recommendations, cached, payload.get('doctor_id'), payload.get('requested_by'))
+
+    missing = [prediction.id for prediction in predictions if prediction.id not in recommendations]
+    if missing:
+        # The stored plans are kept; the next attempt only generates these
+        raise JobError(f"No treatment recommendation was generated for predictions {missing}")
+
+
+def treatment_plan_failed(payload):
+    """Mark the plans still missing as failed once their job has exhausted its retries"""
+    Prediction.objects.filter(id__in=_prediction_ids(payload), plan_status='pending').update(plan_status='failed')
+
+
+def _event(name, data):
+    """One server-sent event; data is sent as JSON, so newlines in the text cannot end the event early"""
+    return f'event: {name}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+def _plan_event(prediction):
+    plan = TreatmentPlan.objects.filter(prediction=prediction).latest('created_at')
+    return _event('plan', TreatmentPlanSerializer(plan).data)
+
+
+def claim_treatment_plan(prediction):
+    """
+    Mark a prediction's plan pending for a caller about to generate it.
+    Returns False when the plan is already pending, i.e. being generated by
+    another request or a queued job. A claim older than
+    TREATMENT_PLANS['CLAIM_TIMEOUT'] has expired and is taken over, so a
+    process killed mid-stream does not leave the plan pending forever.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.TREATMENT_PLANS['CLAIM_TIMEOUT'])
+    claimed = Prediction.objects.filter(id=prediction.id).filter(
+        ~Q(plan_status='pending') | Q(plan_claimed_at__isnull=True) | Q(plan_claimed_at__lt=expired)
+    ).update(plan_status='pending', plan_claimed_at=now)
+    if claimed:
+        prediction.plan_status, prediction.plan_claimed_at = 'pending', now
+    return bool(claimed)
+
+
+def stream_treatment_plan(prediction, doctor=None, requested_by=None, use_cache=True):
+    """
+    Generate the treatment plan of a prediction, with its test result, patient
+    and user loaded, as server-sent events. The caller must have claimed the
+    plan with claim_treatment_plan().
+
+    'chunk' events carry the text of the response as Gemini generates it, and
+    a 'plan' event the stored plan once the response is complete. An existing
+    plan, or a cached recommendation, is sent as the plan right away. When
+    Gemini fails, or the client disconnects before the plan is stored, the
+    plan is queued as a background job instead, and an 'error' event reports
+    its pending status if the client is still there.
+    """
+    if TreatmentPlan.objects.filter(prediction=prediction).exists():
+        Prediction.objects.filter(id=prediction.id).update(plan_status='ready')
+        yield _plan_event(prediction)
+        return
+
+    doctor_id = doctor.id if doctor else None
+    requested_by_id = requested_by.id if requested_by else None
+    cached = recommendation_cache.get_many([prediction]) if use_cache else {}
+    if cached:
+        save_treatment_plans([prediction], cached, set(cached), doctor_id, requested_by_id)
+        yield _plan_event(prediction)
+        return
+
+    def queue_instead():
+        with transaction.atomic():
+            request_treatment_plans([prediction], doctor, requested_by, use_cache)
+
+    # Set once the plan is stored or queued
+    handled = False
+    try:
+        chunks = []
+        for chunk in get_llm_client().stream(
+                build_prompt(prediction.test_result, prediction), settings.TREATMENT_PLANS['CALL_TIMEOUT']):
+            chunks.append(chunk)
+            yield _event('chunk', {'text': chunk})
+
+        recommendation = {prediction.id: parse_recommendation(''.join(chunks))}
+        save_treatment_plans([prediction], recommendation, (), doctor_id, requested_by_id)
+        handled = True
+        recommendation_cache.set_many([prediction], recommendation)
+        yield _plan_event(prediction)
+    except Exception as e:
+        logger.warning('Error streaming treatment recommendation, queued it instead: %s', e)
+        queue_instead()
+        handled = True
+        yield _event('error', {'error': str(e), 'plan_status': 'pending'})
+    finally:
+        if not handled:
+            # The client disconnected mid-stream
+            queue_instead()
+
+
+def recommendation_cache_stats(since):
+    """How many of the treatment plans created since a time were served from the recommendation cache"""
+    plans = TreatmentPlan.objects.filter(created_at__gte=since).aggregate(
+        plans=Count('id'),
+        from_cache=Count('id', filter=Q(from_cache=True))
+    )
+    return {
+        'backend': settings.RECOMMENDATION_CACHE.get('BACKEND', 'local'),
+        **plans,
+        'hit_rate': round(plans['from_cache'] / plans['plans'], 4) if plans['plans'] else 0,
+    }
@@ -11,6 +11,7 @@ urlpatterns = [
     path('user-info/', views.get_user_info, name='user-info'),
     path('dashboard-stats/', views.get_dashboard_stats, name='dashboard-stats'),
     path('patients/', views.get_patients, name='get_patients'),
+    path('patients/at-risk/', views.get_at_risk_patients, name='at-risk-patients'),
     path('patient/<int:patient_id>/', views.get_patient_details, name='patient-details'),
     path('notifications/', views.NotificationViewSet.as_view({
         'get': 'list',
@@ -49,6 +50,13 @@ urlpatterns = [
     path('admin/users/<int:user_id>/', views.manage_users, name='manage-user'),
     path('admin/resources/', views.manage_resources, name='manage-resources'),
     path('admin/model/retrain/', views.retrain_model, name='retrain-model'),
+    path('admin/model/retrain/<int:job_id>/', views.get_training_job, name='training-job'),
+    path('admin/model/inference-stats/', views.get_inference_stats, name='inference-stats'),
+    path('admin/jobs/', views.get_job_queue_stats, name='job-queue-stats'),
+    path('admin/model/timings/', views.get_prediction_timings, name='prediction-timings'),
+    path('admin/model/drift/', views.get_input_drift, name='input-drift'),
+    path('admin/model/versions/', views.list_model_versions, name='model-versions'),
+    path('admin/model/versions/<str:version>/activate/', views.activate_model_version, name='activate-model-version'),
     path('get_profile/', views.get_profile, name='get_profile'),
     path('update_profile/', views.update_profile, name='update_profile'),
     path('change_password/', views.change_password, name='change_password'),
@@ -58,12 +66,24 @@ urlpatterns = [
     path('test-results/<int:test_result_id>/predict/', 
          views.generate_prediction, 
          name='generate-prediction'),
+    path('test-results/predict-batch/', 
+         views.predict_batch, 
+         name='predict-batch'),
+    path('test-results/<int:test_result_id>/what-if/', 
+         views.what_if_curve, 
+         name='what-if'),
+    path('test-results/<int:test_result_id>/similar/', 
+         views.similar_test_results, 
+         name='similar-test-results'),
     path('test-results/<int:test_result_id>/predictions/', 
          views.get_predictions, 
          name='get-predictions'),
     path('predictions/<int:prediction_id>/treatment-plan/', 
          views.treatment_plan, 
          name='treatment-plan'),
+    path('predictions/<int:prediction_id>/treatment-plan/stream/',
+         views.stream_treatment_plan_view,
+         name='treatment-plan-stream'),
     path('treatment-plans/all/', views.get_treatment_plans, name='get_treatment_plans'),
     path('predictions/stats/', 
          views.get_prediction_stats, 
@@ -1,12 +1,14 @@
 import json
+import math
 from re import M
 import subprocess
-import xgboost as xgb
+import numpy as np
 from django.dispatch import receiver
 from django.shortcuts import render
 from rest_framework import viewsets
 from datetime import datetime, timedelta
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils import timezone
 
 from rest_framework.response import Response
@@ -15,14 +17,30 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.core.mail import send_mail, EmailMultiAlternatives
 from prognosys import settings
 from threading import Thread
 
 from .models import *
-from .model_loader import diabetes_model, heart_failure_model, diabetes_scaler, heart_failure_scaler, heart_failure_encoder
+from .conditions import RISK_SUMMARY_CONDITIONS
+from .inference import (
+    WHAT_IF_CATEGORICAL_FEATURES, WHAT_IF_NUMERIC_FEATURES, save_predictions,
+    score_test_results, what_if
+)
+from .model_loader import get_models, inference_stats
+from .drift import drift_report, record_test_result
+from .feature_store import assign_features, split_scorable
+from .jobs import queue_stats
+from .registry import activate_version
+from .similarity import SimilarityIndexNotReady, get_similarity_index, index_test_result, unindex_test_result
+from .training import TrainingJobRunning, start_training_job
+from .treatment_plans import (
+    claim_treatment_plan, recommendation_cache_stats, request_treatment_plans, stream_treatment_plan
+)
+from .timing import StageTimer, record_timing, stage_percentiles
+from .caches import prediction_cache
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .serializers import *
 from rest_framework import status
@@ -39,131 +57,8 @@ from django.db.models import Q
 from django.db.models import Count
 from django.db.models import Sum
 
-import google.generativeai as genai
 from django.conf import settings
 
-genai.configure(api_key=settings.GEMINI_API_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
-print(settings.GEMINI_API_KEY)
-
-def generate_treatment_recommendation(test_result, prediction):
-    """Generate AI treatment recommendations using Gemini"""
-    try:
-        # Convert choice codes to full names
-        fasting_bs = 'Yes' if test_result.fasting_bs == 'Y' else 'No'
-        exercise_angina = 'Yes' if test_result.exercise_angina == 'Y' else 'No'
-        
-        # Get full name for chest pain type
-        chest_pain_map = {
-            'TA': 'Typical Angina',
-            'ATA': 'Atypical Angina',
-            'NAP': 'Non-Anginal Pain',
-            'ASY': 'Asymptomatic'
-        }
-        chest_pain = chest_pain_map.get(test_result.chest_pain_type)
-
-        # Get full name for resting ECG
-        resting_ecg_map = {
-            'Normal': 'Normal',
-            'ST': 'ST-T Wave Abnormality',
-            'LVH': 'Left Ventricular Hypertrophy'
-        }
-        resting_ecg = resting_ecg_map.get(test_result.resting_ecg)
-
-        prompt = f"""As a medical AI assistant, provide a brief but comprehensive treatment plan for a patient with the following:
-
-Condition: {prediction.condition}
-Confidence: {prediction.confidence}%
-
-Patient Details:
-- Age: {test_result.patient.age}
-- Gender: {test_result.patient.user.gender}
-
-Test Results:
-- Glucose: {test_result.glucose}
-- Blood Pressure: {test_result.blood_pressure}
-- BMI: {test_result.bmi}
-- Cholesterol: {test_result.cholesterol}
-- Heart Rate: {test_result.max_hr}
-- Fasting Blood Sugar < 120 mg/dL: {fasting_bs}
-- Resting ECG: {resting_ecg}
-- Exercise Angina: {exercise_angina}
-- Chest Pain Type: {chest_pain}
-
-Please provide a concise treatment plan with:
-1. Brief Primary Treatment Plan (2-3 sentences)
-2. Key Medications (if needed)
-3. Essential Lifestyle Changes
-4. Follow-up Timeline
-5. Critical Warning Signs
-
-Keep each section brief and focused on the most important points."""
-
-        # Generate recommendation using Gemini
-        response = model.generate_content(prompt)
-        
-        # Parse and structure the response
-        recommendation = {
-            'primary_recommendation': response.text.split('\n\n')[0],
-            'detailed_plan': parse_treatment_sections(response.text),
-            'warnings': extract_warnings(response.text)
-        }
-        
-        return recommendation
-        
-    except Exception as e:
-        print(f"Error generating treatment recommendation: {str(e)}")
-        return None
-
-def parse_treatment_sections(response_text):
-    """Parse the response text into structured sections"""
-    sections = []
-    current_section = None
-    current_recommendations = []
-    
-    for line in response_text.split('\n'):
-        if any(header in line.lower() for header in ['medications:', 'lifestyle changes:', 'follow-up:']):
-            if current_section:
-                sections.append({
-                    'category': current_section,
-                    'recommendations': current_recommendations
-                })
-            current_section = line.strip(':')
-            current_recommendations = []
-        elif line.strip() and current_section:
-            if line.startswith('- '):
-                current_recommendations.append(line[2:])
-            elif line.startswith('• '):
-                current_recommendations.append(line[2:])
-            else:
-                current_recommendations.append(line)
-    
-    if current_section:
-        sections.append({
-            'category': current_section,
-            'recommendations': current_recommendations
-        })
-    
-    return sections
-
-def extract_warnings(response_text):
-    """Extract warning signs from the response"""
-    warnings = []
-    warning_section = False
-    
-    for line in response_text.split('\n'):
-        if 'warning' in line.lower() or 'monitor' in line.lower():
-            warning_section = True
-        elif warning_section and line.strip():
-            if line.startswith('- '):
-                warnings.append(line[2:])
-            elif line.startswith('• '):
-                warnings.append(line[2:])
-            elif not line.endswith(':'):
-                warnings.append(line)
-    
-    return warnings
-
 # Create your views here.
 class TokenGenerator(PasswordResetTokenGenerator):  
     def _make_hash_value(self, user, timestamp):  
@@ -421,7 +316,7 @@ def submit_test_results(request, patient_id):
                     'error': f'Invalid value for field: {field}'
                 }, status=status.HTTP_400_BAD_REQUEST)
         # Create test result with all fields
-        test_result = TestResult.objects.create(
+        test_result = TestResult(
             patient=patient,
             glucose=float(request.data['glucose']),
             blood_pressure=float(request.data['bloodPressure']),
@@ -435,6 +330,13 @@ def submit_test_results(request, patient_id):
             exercise_angina=request.data['exerciseAngina'],
             chest_pain_type=request.data['chestPainType']
         )
+        # Store the model inputs with the row, so batch jobs need not encode it again
+        try:
+            assign_features(test_result, get_models().vectorizer)
+        except ValueError:
+            # Values the encoders do not know are not model inputs; the row has no vector
+            pass
+        test_result.save()
         
         # Create medical record
         medical_record = MedicalRecord.objects.create(
@@ -490,6 +392,62 @@ def notify_test_results(sender, instance, created, **kwargs):
                 related_patient=instance.patient
             )
 
+@receiver(post_save, sender=TestResult)
+def update_similarity_index(sender, instance, **kwargs):
+    index_test_result(instance)
+
+@receiver(post_save, sender=TestResult)
+def record_input_drift(sender, instance, created, **kwargs):
+    if created and settings.DRIFT_MONITOR['ENABLED']:
+        transaction.on_commit(lambda: record_test_result(instance, get_models().vectorizer))
+
+@receiver(post_save, sender=TestResult)
+def refresh_feature_vector(sender, instance, created, update_fields=None, **kwargs):
+    """Keep the stored feature vector of an edited test result in step with its fields"""
+    if created or (update_fields and set(update_fields) <= {'feature_vector', 'feature_version'}):
+        return
+    previous = instance.feature_vector
+    try:
+        assign_features(instance, get_models().vectorizer)
+    except ValueError:
+        instance.feature_vector, instance.feature_version = None, ''
+    if previous is None or instance.feature_vector is None or bytes(previous) != bytes(instance.feature_vector):
+        TestResult.objects.filter(pk=instance.pk).update(
+            feature_vector=instance.feature_vector, feature_version=instance.feature_version)
+
+def stored_value(instance, field, update_fields):
+    """The value of a field in the database before instance is saved, or instance's own when the save leaves it alone"""
+    if instance.pk is None or (update_fields is not None and field not in update_fields):
+        return getattr(instance, field)
+    return type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+@receiver(pre_save, sender=PatientProfile)
+def remember_patient_age(sender, instance, update_fields=None, **kwargs):
+    instance._stored_age = stored_value(instance, 'age', update_fields)
+
+@receiver(post_save, sender=PatientProfile)
+def clear_patient_feature_vectors(sender, instance, created, **kwargs):
+    # Age is a model input; the vectors are recomputed when next read
+    if not created and instance.age != instance._stored_age:
+        TestResult.objects.filter(patient=instance).update(
+            feature_vector=None, feature_version='', updated_at=timezone.now())
+
+@receiver(pre_save, sender=User)
+def remember_user_gender(sender, instance, update_fields=None, **kwargs):
+    # Logins and other partial saves without gender cost no query
+    instance._stored_gender = stored_value(instance, 'gender', update_fields)
+
+@receiver(post_save, sender=User)
+def clear_user_feature_vectors(sender, instance, created, **kwargs):
+    # Gender is a model input
+    if not created and instance.gender != instance._stored_gender:
+        TestResult.objects.filter(patient__user=instance).update(
+            feature_vector=None, feature_version='', updated_at=timezone.now())
+
+@receiver(post_delete, sender=TestResult)
+def remove_from_similarity_index(sender, instance, **kwargs):
+    unindex_test_result(instance.id)
+
 def create_critical_alert(patient, vital_signs):
     """Create urgent notification for abnormal vital signs"""
     if (
@@ -788,19 +746,135 @@ def manage_resources(request):
             return Response(serializer.data, status=201)
         return Response(serializer.errors, status=400)
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
+@api_view(['GET', 'POST'])
+@permission_classes([IsAdminUser])
 def retrain_model(request):
-    """Trigger model retraining"""
-    try:
+    """Start a background retraining job, or list the recent ones"""
+    if request.method == 'GET':
+        jobs = TrainingJob.objects.all()[:20]
+        return Response(TrainingJobSerializer(jobs, many=True).data)
 
+    try:
+        job = start_training_job(request.user, activate=bool(request.data.get('activate', False)))
         return Response({
             'message': 'Model retraining initiated successfully',
-            'status': 'pending'
+            'status': job.status,
+            'job': TrainingJobSerializer(job).data
+        }, status=status.HTTP_202_ACCEPTED)
+    except TrainingJobRunning as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    except Exception as e:
+        return Response({'error': str(e)}, status=400)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_training_job(request, job_id):
+    """Get the status and progress of a retraining job"""
+    try:
+        return Response(TrainingJobSerializer(TrainingJob.objects.get(id=job_id)).data)
+    except TrainingJob.DoesNotExist:
+        return Response({'error': 'Training job not found'}, status=status.HTTP_404_NOT_FOUND)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_input_drift(request):
+    """Histograms and drift scores of the model inputs of test results, and the alerts raised"""
+    preprocessing_version = get_models().vectorizer.preprocessing_version
+    alerts = DriftAlert.objects.filter(preprocessing_version=preprocessing_version)
+    return Response({
+        'preprocessing_version': preprocessing_version,
+        'psi_alert': settings.DRIFT_MONITOR['PSI_ALERT'],
+        'features': drift_report(preprocessing_version),
+        'alerts': list(alerts.values('feature', 'psi', 'samples', 'created_at')),
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def list_model_versions(request):
+    """List the registered model versions and the version this worker serves"""
+    return Response({
+        'serving': get_models().version,
+        'versions': ModelVersionSerializer(ModelVersion.objects.all(), many=True).data
+    })
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def activate_model_version(request, version):
+    """Make a registered model version active; workers pick it up without a restart"""
+    try:
+        model_version = activate_version(version)
+        return Response({
+            'message': f'Model version {version} activated',
+            'version': ModelVersionSerializer(model_version).data,
+            'poll_interval': settings.MODEL_REGISTRY['POLL_INTERVAL']
         })
+    except ModelVersion.DoesNotExist:
+        return Response({'error': 'Model version not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': str(e)}, status=400)
 
+def stats_window_hours(request, default=24):
+    """The ?hours= window of a statistics endpoint; raises ValueError unless it is a positive number up to STATS_MAX_HOURS"""
+    try:
+        hours = float(request.query_params.get('hours', default))
+    except ValueError:
+        raise ValueError('hours must be a number')
+    # float() accepts 'inf' and 'nan', which timedelta cannot take
+    if not math.isfinite(hours) or not 0 < hours <= settings.STATS_MAX_HOURS:
+        raise ValueError(f'hours must be a number greater than 0 and at most {settings.STATS_MAX_HOURS}')
+    return hours
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_prediction_timings(request):
+    """Get per-stage latency percentiles of generate_prediction over the last `hours` hours"""
+    try:
+        hours = stats_window_hours(request)
+        since = timezone.now() - timedelta(hours=hours)
+        timings = PredictionTiming.objects.filter(created_at__gte=since)
+
+        model_version = request.query_params.get('model_version')
+        if model_version:
+            timings = timings.filter(model_version=model_version)
+
+        return Response({
+            'since': since,
+            'hours': hours,
+            'model_version': model_version,
+            'requests': timings.count(),
+            'cache_hit_requests': timings.filter(cache_hit=True).count(),
+            'stages': stage_percentiles(timings)
+        })
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_inference_stats(request):
+    """Get the model inference scheduler counters and prediction cache hit rate"""
+    return Response({
+        **inference_stats(),
+        'prediction_cache': prediction_cache.stats()
+    })
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAdminUser])
+def get_job_queue_stats(request):
+    """
+    Depth of the background job queue per job kind, and the share of the
+    treatment plans of the last ?hours= (default 24) served from the
+    recommendation cache
+    """
+    try:
+        since = timezone.now() - timedelta(hours=stats_window_hours(request))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({
+        'kinds': queue_stats(),
+        'recommendation_cache': recommendation_cache_stats(since)
+    })
+
 @api_view(['GET'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
@@ -923,100 +997,38 @@ def get_predictions(request, test_result_id):
 @permission_classes([IsAuthenticated])
 def generate_prediction(request, test_result_id):
     """Generate prediction for test results using ML models"""
+    timer = StageTimer()
     try:
-        test_result = TestResult.objects.get(id=test_result_id)
-        gender = 'M' if test_result.patient.user.gender == 'Male' else 'F'
-        
-        # Prepare data for prediction
-        features = {
-            'diabetes': [
-                test_result.glucose,
-                test_result.blood_pressure,
-                test_result.skin_thickness,
-                test_result.insulin,
-                test_result.bmi,
-                test_result.patient.age,
-            ],
-            'heart': [
-                test_result.patient.age,
-                float(test_result.patient.user.gender == 'Male'),
-                int(heart_failure_encoder["chest_pain_encoder"].transform([test_result.chest_pain_type])[0]),
-                test_result.blood_pressure,
-                test_result.cholesterol,
-                int(heart_failure_encoder["label_encoder"].transform([test_result.fasting_bs])[0]),
-                int(heart_failure_encoder["resting_ecg_encoder"].transform([test_result.resting_ecg])[0]),
-                test_result.max_hr,
-                int(heart_failure_encoder["label_encoder"].transform([test_result.exercise_angina])[0]),
-            ]
-        }
-
-        print(features)
-
-        # Scale features
-        diabetes_features = diabetes_scaler.transform([features['diabetes']])
-        heart_features = heart_failure_scaler.transform([features['heart']])
+        with timer.stage('fetch'):
+            test_result = TestResult.objects.select_related('patient__user').get(id=test_result_id)
 
         # Get predictions
-        diabetes_pred = diabetes_model.predict(diabetes_features)
-        heart_pred = heart_failure_model.predict(xgb.DMatrix([heart_features[0]]))
+        confidences, model_version = score_test_results([test_result], timer=timer)
 
-        # Calculate confidence scores
-        diabetes_confidence = float(int(diabetes_pred[0][0] * 1000) / 10)
-        heart_confidence = float(int(heart_pred[0] * 1000) / 10)
+        with timer.stage('save'), transaction.atomic():
+            # Create predictions in database
+            predictions = save_predictions([test_result], confidences, model_version)
 
-        # Create predictions in database
-        predictions = []
-        
-        # If both predictions have low confidence, create a "Healthy" prediction
-        if diabetes_confidence < 50 and heart_confidence < 50:
-            healthy_confidence = (100 - diabetes_confidence + 100 - heart_confidence) / 2
-            predictions.append(Prediction.objects.create(
-                patient=test_result.patient,
-                test_result=test_result,
-                condition='Healthy',
-                confidence=healthy_confidence
-            ))
-        else:
-            # Create predictions for conditions with confidence > 50%
-            if diabetes_confidence >= 50:
-                predictions.append(Prediction.objects.create(
-                    patient=test_result.patient,
-                    test_result=test_result,
-                    condition='Diabetes',
-                    confidence=diabetes_confidence
-                ))
-
-            if heart_confidence >= 50:
-                predictions.append(Prediction.objects.create(
-                    patient=test_result.patient,
-                    test_result=test_result,
-                    condition='Heart Disease',
-                    confidence=heart_confidence
-                ))
-
-        # Create notifications for doctors
-        for doctor in test_result.patient.doctors.all():
-            Notification.objects.create(
-                user=doctor.user,
-                message=f"New predictions available for {test_result.patient.user.get_full_name()}",
-                notification_type=NotificationType.PREDICTION,
-                priority='high',
-                related_patient=test_result.patient
+            # Treatment plans are generated by the job workers once the predictions commit
+            request_treatment_plans(
+                predictions,
+                doctor=request.user.doctorprofile if hasattr(request.user, 'doctorprofile') else None
             )
 
-        # Generate treatment recommendations for each prediction
-        for prediction in predictions:
-            recommendation = generate_treatment_recommendation(test_result, prediction)
-            if recommendation:
-                # Create or update treatment plan
-                TreatmentPlan.objects.create(
-                    prediction=prediction,
-                    patient=test_result.patient,
-                    doctor=request.user.doctorprofile if hasattr(request.user, 'doctorprofile') else None,
-                    primary_recommendation=recommendation['primary_recommendation'],
-                    detailed_plan=recommendation['detailed_plan'],
-                    warnings=recommendation['warnings']
+            # Create notifications for doctors
+            Notification.objects.bulk_create([
+                Notification(
+                    user_id=doctor.user_id,
+                    message=f"New predictions available for {test_result.patient.user.get_full_name()}",
+                    notification_type=NotificationType.TEST_RESULTS,
+                    priority='high',
+                    related_patient=test_result.patient
                 )
+                for doctor in test_result.patient.doctors.all()
+            ])
+
+        if settings.PREDICTION_TIMING_ENABLED:
+            record_timing(timer, test_result, model_version)
 
         return Response({
             'predictions': PredictionSerializer(predictions, many=True).data
@@ -1030,7 +1042,192 @@ def generate_prediction(request, test_result_id):
         return Response({
             'error': str(e)
         }, status=status.HTTP_400_BAD_REQUEST)
-    
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def predict_batch(request):
+    """
+    Generate predictions for many test results in one vectorized pass.
+
+    Test results with values the encoders do not know are skipped and listed
+    in unscorable_test_result_ids. Treatment plans are not generated here;
+    they can be requested per prediction through the treatment-plan endpoint.
+    """
+    try:
+        test_result_ids = request.data.get('test_result_ids')
+        if not isinstance(test_result_ids, list) or not test_result_ids:
+            return Response({
+                'error': 'test_result_ids must be a non-empty list'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(test_result_ids) > settings.PREDICTION_BATCH_MAX_SIZE:
+            return Response({
+                'error': f'At most {settings.PREDICTION_BATCH_MAX_SIZE} test results can be scored per request'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            test_result_ids = [int(test_result_id) for test_result_id in test_result_ids]
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'test_result_ids must contain integers'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        test_results = list(
+            TestResult.objects.select_related('patient__user')
+            .filter(id__in=test_result_ids)
+            .order_by('id')
+        )
+        found_ids = {test_result.id for test_result in test_results}
+        missing_ids = [test_result_id for test_result_id in test_result_ids if test_result_id not in found_ids]
+
+        # One row with a value the encoders do not know must not fail the whole batch
+        models = get_models()
+        test_results, unscorable = split_scorable(test_results, models.vectorizer)
+
+        predictions = []
+        if test_results:
+            confidences, model_version = score_test_results(test_results, models)
+
+            with transaction.atomic():
+                predictions = save_predictions(test_results, confidences, model_version)
+
+                # Notify each assigned doctor once per patient rather than once per test result
+                patient_ids = {test_result.patient_id for test_result in test_results}
+                assignments = DoctorProfile.patients.through.objects.filter(
+                    patientprofile_id__in=patient_ids
+                ).select_related('doctorprofile', 'patientprofile__user')
+                Notification.objects.bulk_create([
+                    Notification(
+                        user_id=assignment.doctorprofile.user_id,
+                        message=f"New predictions available for {assignment.patientprofile.user.get_full_name()}",
+                        notification_type=NotificationType.TEST_RESULTS,
+                        priority='high',
+                        related_patient_id=assignment.patientprofile_id
+                    )
+                    for assignment in assignments
+                ])
+
+        return Response({
+            'predictions': PredictionSerializer(predictions, many=True).data,
+            'missing_test_result_ids': missing_ids,
+            'unscorable_test_result_ids': [test_result.id for test_result in unscorable]
+        }, status=status.HTTP_201_CREATED)
+
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def what_if_curve(request, test_result_id):
+    """
+    Risk curves of a test result as one feature varies, e.g.
+    ?feature=cholesterol&range=150:300:5 (start:stop:step, stop included).
+
+    Categorical features need no range; every category is scored.
+    """
+    try:
+        feature = request.query_params.get('feature')
+        if feature not in WHAT_IF_NUMERIC_FEATURES + WHAT_IF_CATEGORICAL_FEATURES:
+            return Response({
+                'error': f"feature must be one of {', '.join(WHAT_IF_NUMERIC_FEATURES + WHAT_IF_CATEGORICAL_FEATURES)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        values = None
+        if feature in WHAT_IF_NUMERIC_FEATURES:
+            try:
+                start, stop, step = (float(part) for part in request.query_params.get('range', '').split(':'))
+            except ValueError:
+                return Response({
+                    'error': 'range must be start:stop:step'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            # float() accepts 'inf' and 'nan', which np.arange cannot take
+            if not all(math.isfinite(part) for part in (start, stop, step)):
+                return Response({
+                    'error': 'range start, stop and step must be finite numbers'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if step <= 0 or stop < start:
+                return Response({
+                    'error': 'range needs a positive step and stop >= start'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            if (stop - start) / step + 1 > settings.WHAT_IF_MAX_POINTS:
+                return Response({
+                    'error': f'At most {settings.WHAT_IF_MAX_POINTS} values can be scored per request'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            # Half a step of slack keeps stop in the grid despite rounding
+            values = np.arange(start, stop + step / 2, step)
+
+        test_result = TestResult.objects.select_related('patient__user').get(id=test_result_id)
+        return Response(what_if(test_result, feature, values))
+
+    except TestResult.DoesNotExist:
+        return Response({'error': 'Test result not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def similar_test_results(request, test_result_id):
+    """
+    The ?k= (default 10) past test results of other patients nearest to this
+    one in model feature space, with their predictions and review status.
+    """
+    try:
+        try:
+            k = int(request.query_params.get('k', 10))
+        except ValueError:
+            return Response({'error': 'k must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= k <= settings.SIMILAR_TEST_RESULTS_MAX_K:
+            return Response({
+                'error': f'k must be between 1 and {settings.SIMILAR_TEST_RESULTS_MAX_K}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        test_result = TestResult.objects.select_related('patient__user').get(id=test_result_id)
+        try:
+            neighbours = get_similarity_index().query(test_result, k)
+        except SimilarityIndexNotReady as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '5'})
+
+        neighbour_ids = [neighbour_id for neighbour_id, _ in neighbours]
+        test_results = TestResult.objects.in_bulk(neighbour_ids)
+        predictions = {}
+        for prediction in Prediction.objects.filter(test_result_id__in=neighbour_ids).order_by('-created_at'):
+            predictions.setdefault(prediction.test_result_id, []).append({
+                'id': prediction.id,
+                'condition': prediction.condition,
+                'confidence': prediction.confidence,
+                'status': prediction.status,
+                'created_at': prediction.created_at,
+            })
+
+        return Response({
+            'test_result_id': test_result.id,
+            'neighbours': [
+                {
+                    'test_result_id': neighbour_id,
+                    'patient_id': test_results[neighbour_id].patient_id,
+                    'distance': round(distance, 4),
+                    'created_at': test_results[neighbour_id].created_at,
+                    'predictions': predictions.get(neighbour_id, []),
+                }
+                # Skip rows deleted by another process since they were indexed
+                for neighbour_id, distance in neighbours if neighbour_id in test_results
+            ]
+        })
+
+    except TestResult.DoesNotExist:
+        return Response({'error': 'Test result not found'}, status=status.HTTP_404_NOT_FOUND)
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
 def treatment_plan(request, prediction_id):
@@ -1038,57 +1235,80 @@ def treatment_plan(request, prediction_id):
         # Logic from get_treatment_plan
         try:
             prediction = Prediction.objects.get(id=prediction_id)
-            treatment_plan = TreatmentPlan.objects.get(prediction=prediction)
+            # A regenerated plan replaces the old one, but a concurrent save may briefly leave both
+            treatment_plan = TreatmentPlan.objects.filter(prediction=prediction).latest('created_at')
             return Response(TreatmentPlanSerializer(treatment_plan).data)
-        except (Prediction.DoesNotExist, TreatmentPlan.DoesNotExist):
+        except Prediction.DoesNotExist:
             return Response({'error': 'Treatment plan not found'}, status=404)
+        except TreatmentPlan.DoesNotExist:
+            # plan_status tells the client whether to keep polling
+            return Response({'error': 'Treatment plan not found', 'plan_status': prediction.plan_status}, status=404)
             
     elif request.method == 'POST':
-        """Create a new treatment plan"""
+        """Queue the generation of a treatment plan, replacing any existing one; poll GET until plan_status is ready"""
         try:
             prediction = Prediction.objects.get(id=prediction_id)
-            test_result = prediction.test_result
 
-            recommendation = generate_treatment_recommendation(test_result, prediction)
-
-            if recommendation:
-                # Create or update treatment plan
-                treatment_plan = TreatmentPlan.objects.create(
-                    prediction=prediction,
-                    patient=test_result.patient,
+            # bypass_cache asks Gemini even when a similar patient's recommendation is cached
+            bypass_cache = str(request.data.get('bypass_cache', request.query_params.get('bypass_cache', ''))).lower()
+            with transaction.atomic():
+                if not claim_treatment_plan(prediction):
+                    # Already queued, or being streamed to another client
+                    return Response({
+                        'prediction_id': prediction.id,
+                        'plan_status': 'pending'
+                    }, status=status.HTTP_202_ACCEPTED)
+                request_treatment_plans(
+                    [prediction],
                     doctor=request.user.doctorprofile if hasattr(request.user, 'doctorprofile') else None,
-                    primary_recommendation=recommendation['primary_recommendation'],
-                    detailed_plan=recommendation['detailed_plan'],
-                    warnings=recommendation['warnings']
+                    requested_by=request.user,
+                    use_cache=bypass_cache not in ('1', 'true')
                 )
 
-                # Create notification for the patient
-                Notification.objects.create(
-                    user=test_result.patient.user,
-                    message=f"New treatment plan created for your {prediction.condition} prediction",
-                    notification_type=NotificationType.TREATMENT_PLAN,
-                    priority='high',
-                    related_patient=test_result.patient
-                )
-
-                # Create notifications for all assigned doctors
-                Notification.objects.create(
-                    user=request.user,
-                    message=f"New treatment plan created for patient {test_result.patient.user.get_full_name()}",
-                    notification_type=NotificationType.TREATMENT_PLAN,
-                    priority='high',
-                    related_patient=test_result.patient
-                )
-
-                return Response(status=status.HTTP_201_CREATED, data=TreatmentPlanSerializer(treatment_plan).data)
-            else:
-                return Response(status=status.HTTP_400_BAD_REQUEST)
+            return Response({
+                'prediction_id': prediction.id,
+                'plan_status': prediction.plan_status
+            }, status=status.HTTP_202_ACCEPTED)
                 
         except Prediction.DoesNotExist:
             return Response({'error': 'Prediction not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def stream_treatment_plan_view(request, prediction_id):
+    """
+    Create a treatment plan, relaying Gemini's response as server-sent
+    events while it is generated: 'chunk' events with the text, then a
+    'plan' event with the stored plan, or an 'error' event.
+    """
+    try:
+        prediction = Prediction.objects.select_related('test_result__patient__user').get(id=prediction_id)
+    except Prediction.DoesNotExist:
+        return Response({'error': 'Prediction not found'}, status=status.HTTP_404_NOT_FOUND)
+    if not claim_treatment_plan(prediction):
+        return Response({
+            'error': 'The treatment plan is already being generated',
+            'plan_status': 'pending'
+        }, status=status.HTTP_409_CONFLICT)
+
+    bypass_cache = str(request.data.get('bypass_cache', request.query_params.get('bypass_cache', ''))).lower()
+    response = StreamingHttpResponse(
+        stream_treatment_plan(
+            prediction,
+            doctor=request.user.doctorprofile if hasattr(request.user, 'doctorprofile') else None,
+            requested_by=request.user,
+            use_cache=bypass_cache not in ('1', 'true')
+        ),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Keep nginx from buffering the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_view(['GET', 'POST', 'DELETE', 'PUT'])
 @permission_classes([IsAdminUser])
 def manage_users(request, user_id=None):
@@ -1355,6 +1575,51 @@ def get_vital_signs(request, patient_id):
             status=status.HTTP_400_BAD_REQUEST
         )
 
+# Ordering column of the at-risk ranking for each ?condition= value
+RISK_ORDERING = {'any': 'risk_confidence', **RISK_SUMMARY_CONDITIONS}
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def get_at_risk_patients(request):
+    """
+    The ?k= (default 20) patients with the highest latest model confidence,
+    for ?condition=any|diabetes|heart_disease. With ?scope=mine only the
+    requesting doctor's patients are ranked; ranking every patient is for admins.
+    """
+    try:
+        condition = request.query_params.get('condition', 'any')
+        if condition not in RISK_ORDERING:
+            return Response({
+                'error': f"condition must be one of {', '.join(RISK_ORDERING)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            k = int(request.query_params.get('k', 20))
+        except ValueError:
+            return Response({'error': 'k must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= k <= settings.AT_RISK_PATIENTS_MAX_K:
+            return Response({
+                'error': f'k must be between 1 and {settings.AT_RISK_PATIENTS_MAX_K}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        summaries = PatientRiskSummary.objects.select_related('patient__user')
+        if request.query_params.get('scope') == 'mine':
+            if not hasattr(request.user, 'doctorprofile'):
+                return Response({'error': 'Only doctors have patients'}, status=status.HTTP_403_FORBIDDEN)
+            summaries = summaries.filter(patient__doctors=request.user.doctorprofile)
+        elif not (request.user.is_staff or request.user.user_role == UserRoleChoices.admin_user):
+            return Response({
+                'error': 'Only admins can rank every patient; doctors can use scope=mine'
+            }, status=status.HTTP_403_FORBIDDEN)
+        summaries = summaries.order_by(f'-{RISK_ORDERING[condition]}')[:k]
+
+        return Response(PatientRiskSummarySerializer(summaries, many=True).data)
+
+    except Exception as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
 @api_view(['GET'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
@@ -14,3 +14,19 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'prognosys.settings')
 
 application = get_asgi_application()
+
+# Load the models and trace the inference graph before the worker accepts traffic
+from django.conf import settings
+
+if settings.MODEL_WARMUP_ON_STARTUP:
+    from django.db import connection
+
+    from authentication.model_loader import warmup
+    warmup()
+    # Workers forked from this process must not share its database connection
+    connection.close()
+
+# Build the similarity index in the background, so no request waits for it
+if settings.SIMILARITY_INDEX['BUILD_ON_STARTUP']:
+    from authentication.similarity import start_similarity_index_build
+    start_similarity_index_build()
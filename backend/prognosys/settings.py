@@ -170,3 +170,229 @@ EMAIL_HOST_PASSWORD = 'your-app-password'
 
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+
+# Maximum number of test results accepted by the batch prediction endpoint
+PREDICTION_BATCH_MAX_SIZE = 1000
+
+# Condition models scored for every test result (see authentication/conditions.py).
+# FEATURES names the block of scaled inputs the model takes, one of
+# features.FEATURE_BLOCKS, and PREDICT the function called with those rows and
+# the LoadedModels. A condition is reported from THRESHOLD percent; STAGE names
+# the PredictionTiming stage the model is timed under. The 'diabetes' and
+# 'heart_disease' keys are required: PatientRiskSummary stores and ranks
+# patients by those two (see conditions.RISK_SUMMARY_CONDITIONS), and startup
+# fails with ImproperlyConfigured without them.
+PREDICTION_CONDITIONS = [
+    {
+        'KEY': 'diabetes',
+        'CONDITION': 'Diabetes',
+        'FEATURES': 'diabetes',
+        'PREDICT': 'authentication.model_loader.predict_diabetes',
+        'THRESHOLD': 50,
+    },
+    {
+        'KEY': 'heart_disease',
+        'CONDITION': 'Heart Disease',
+        'FEATURES': 'heart',
+        'PREDICT': 'authentication.model_loader.predict_heart_failure',
+        'THRESHOLD': 50,
+        'STAGE': 'heart_model',
+    },
+]
+
+# Prediction stored when no condition reaches its threshold; None stores nothing
+HEALTHY_PREDICTION = {'CONDITION': 'Healthy'}
+
+# Threads scoring condition models concurrently, shared by all requests of a worker
+CONDITION_MODEL_THREADS = int(os.getenv('CONDITION_MODEL_THREADS', 8))
+
+# Drift monitoring of the model inputs (see authentication/drift.py). Every
+# CHECK_EVERY test results the PSI of each input is compared with PSI_ALERT,
+# once at least MIN_SAMPLES test results have been counted.
+DRIFT_MONITOR = {
+    'ENABLED': os.getenv('DRIFT_MONITOR_ENABLED', 'True') == 'True',
+    'PSI_ALERT': float(os.getenv('DRIFT_PSI_ALERT', 0.25)),
+    'MIN_SAMPLES': int(os.getenv('DRIFT_MIN_SAMPLES', 200)),
+    'CHECK_EVERY': int(os.getenv('DRIFT_CHECK_EVERY', 100)),
+}
+
+# Background jobs run by manage.py run_workers (see authentication/jobs.py).
+# HANDLERS maps each job kind to the function called with its payload, and
+# FAILED_HANDLERS to the function called once its attempts are exhausted.
+# Attempt n is retried after BACKOFF_SECONDS * 2 ** (n - 1) seconds, capped at
+# BACKOFF_MAX_SECONDS, and a job whose worker has not finished it within
+# VISIBILITY_TIMEOUT seconds is run again by another worker.
+BACKGROUND_JOBS = {
+    'HANDLERS': {
+        'treatment_plan': 'authentication.treatment_plans.run_treatment_plan_job',
+    },
+    'FAILED_HANDLERS': {
+        'treatment_plan': 'authentication.treatment_plans.treatment_plan_failed',
+    },
+    'WORKERS': int(os.getenv('BACKGROUND_JOB_WORKERS', 4)),
+    'MAX_ATTEMPTS': int(os.getenv('BACKGROUND_JOB_MAX_ATTEMPTS', 5)),
+    'BACKOFF_SECONDS': float(os.getenv('BACKGROUND_JOB_BACKOFF_SECONDS', 10)),
+    'BACKOFF_MAX_SECONDS': float(os.getenv('BACKGROUND_JOB_BACKOFF_MAX_SECONDS', 600)),
+    'VISIBILITY_TIMEOUT': float(os.getenv('BACKGROUND_JOB_VISIBILITY_TIMEOUT', 300)),
+    'POLL_INTERVAL': float(os.getenv('BACKGROUND_JOB_POLL_INTERVAL', 1)),
+    'KEEP_SUCCEEDED_DAYS': int(os.getenv('BACKGROUND_JOB_KEEP_SUCCEEDED_DAYS', 7)),
+}
+
+# Generation of treatment plans with Gemini (see authentication/treatment_plans.py).
+# The plans of a test result are generated concurrently by up to THREADS calls
+# per worker process. A call is abandoned after CALL_TIMEOUT seconds and a job
+# stops waiting after DEADLINE seconds, which must stay below the job
+# VISIBILITY_TIMEOUT; plans missing at the deadline are retried.
+TREATMENT_PLANS = {
+    'THREADS': int(os.getenv('TREATMENT_PLAN_THREADS', 8)),
+    'CALL_TIMEOUT': float(os.getenv('TREATMENT_PLAN_CALL_TIMEOUT', 30)),
+    'DEADLINE': float(os.getenv('TREATMENT_PLAN_DEADLINE', 60)),
+    # Seconds after which a pending plan may be claimed again, e.g. when the
+    # process streaming it was killed before it could queue a job instead
+    'CLAIM_TIMEOUT': float(os.getenv('TREATMENT_PLAN_CLAIM_TIMEOUT', 300)),
+}
+
+# Maximum number of feature values scored by one what-if request
+WHAT_IF_MAX_POINTS = 1000
+
+# Maximum number of neighbours returned by the similar test results endpoint
+SIMILAR_TEST_RESULTS_MAX_K = 100
+
+# Similarity index of test results (see authentication/similarity.py), built in
+# the background when a WSGI/ASGI worker starts if BUILD_ON_STARTUP. Changes
+# made by other processes are read at most every SYNC_INTERVAL seconds, going
+# back SYNC_OVERLAP seconds for transactions that committed late or clocks that
+# differ between hosts. Deleted test results are recorded for
+# KEEP_DELETIONS_DAYS; an index idle for longer compares all ids instead.
+SIMILARITY_INDEX = {
+    'BUILD_ON_STARTUP': os.getenv('SIMILARITY_INDEX_BUILD_ON_STARTUP', 'True') == 'True',
+    'SYNC_INTERVAL': float(os.getenv('SIMILARITY_INDEX_SYNC_INTERVAL', 1)),
+    'SYNC_OVERLAP': float(os.getenv('SIMILARITY_INDEX_SYNC_OVERLAP', 60)),
+    'KEEP_DELETIONS_DAYS': int(os.getenv('SIMILARITY_INDEX_KEEP_DELETIONS_DAYS', 7)),
+}
+
+# Maximum number of patients returned by the at-risk patients endpoint
+AT_RISK_PATIENTS_MAX_K = 200
+
+# Micro-batching of concurrent single-row model calls: a request waits at most
+# INFERENCE_BATCH_MAX_WAIT_MS for others to join its batch (0 disables batching),
+# and at most INFERENCE_BATCH_TIMEOUT seconds for the batch to be scored
+INFERENCE_BATCH_MAX_WAIT_MS = float(os.getenv('INFERENCE_BATCH_MAX_WAIT_MS', 2))
+INFERENCE_BATCH_MAX_SIZE = int(os.getenv('INFERENCE_BATCH_MAX_SIZE', 64))
+INFERENCE_BATCH_TIMEOUT = float(os.getenv('INFERENCE_BATCH_TIMEOUT', 30))
+
+# Load the models and run a dummy inference when a WSGI/ASGI worker starts
+# instead of on its first prediction request
+MODEL_WARMUP_ON_STARTUP = os.getenv('MODEL_WARMUP_ON_STARTUP', 'True') == 'True'
+
+# Engine used to serve the diabetes network: 'numpy' runs the forward pass in
+# plain NumPy (no TensorFlow import), 'keras' loads the model with TensorFlow
+DIABETES_INFERENCE_ENGINE = os.getenv('DIABETES_INFERENCE_ENGINE', 'numpy')
+
+# Engine used to serve the heart failure booster: 'compiled' evaluates the
+# trees from flat NumPy arrays, 'xgboost' uses xgb.Booster with a DMatrix
+HEART_INFERENCE_ENGINE = os.getenv('HEART_INFERENCE_ENGINE', 'compiled')
+
+# Cache of model probabilities keyed by the encoded feature vector and model
+# version. BACKEND is 'local' (in-process LRU bounded by MAX_ENTRIES),
+# 'django' (the CACHES alias in CACHE_ALIAS, shared between workers) or 'none'.
+# TIMEOUT is in seconds; None keeps entries until they are evicted.
+PREDICTION_CACHE = {
+    'BACKEND': os.getenv('PREDICTION_CACHE_BACKEND', 'local'),
+    'MAX_ENTRIES': int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', 10000)),
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': None,
+}
+
+# Language model writing the treatment plans (see authentication/llm.py):
+# 'gemini' calls the Gemini API with MODEL, 'fake' answers locally with canned
+# text for load tests and offline development. The fake's LATENCY is
+# 'constant' (MEDIAN_MS), 'uniform' (MIN_MS to MAX_MS) or 'lognormal'
+# (MEDIAN_MS and SIGMA, clipped to MIN_MS and MAX_MS when set). A failed call
+# raises at ERROR_RATE; streams send CHUNKS chunks, the first after
+# FIRST_CHUNK_MS. SEED makes the latencies and errors reproducible.
+LLM_CLIENT = {
+    'BACKEND': os.getenv('LLM_BACKEND', 'gemini'),
+    'MODEL': 'gemini-1.5-flash',
+    'FAKE': {
+        'LATENCY': {
+            'DISTRIBUTION': os.getenv('LLM_FAKE_LATENCY_DISTRIBUTION', 'lognormal'),
+            'MEDIAN_MS': float(os.getenv('LLM_FAKE_LATENCY_MEDIAN_MS', 2000)),
+            'SIGMA': float(os.getenv('LLM_FAKE_LATENCY_SIGMA', 0.5)),
+            'MIN_MS': float(os.getenv('LLM_FAKE_LATENCY_MIN_MS', 200)),
+            'MAX_MS': float(os.getenv('LLM_FAKE_LATENCY_MAX_MS', 20000)),
+        },
+        'FIRST_CHUNK_MS': float(os.getenv('LLM_FAKE_FIRST_CHUNK_MS', 300)),
+        'CHUNKS': int(os.getenv('LLM_FAKE_CHUNKS', 8)),
+        'ERROR_RATE': float(os.getenv('LLM_FAKE_ERROR_RATE', 0)),
+        'SEED': None,
+    },
+}
+
+# Cache of treatment recommendations, keyed by the condition, the categorical
+# prompt inputs and the numeric ones bucketed by the BUCKETS widths (see
+# RecommendationCache). Plans are generated by the job workers, so the 'local'
+# backend is per worker process; 'django' shares the CACHE_ALIAS cache.
+# TIMEOUT is in seconds; bump VERSION when the prompt changes.
+RECOMMENDATION_CACHE = {
+    'BACKEND': os.getenv('RECOMMENDATION_CACHE_BACKEND', 'local'),
+    'MAX_ENTRIES': int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES', 5000)),
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': int(os.getenv('RECOMMENDATION_CACHE_TIMEOUT', 7 * 24 * 3600)),
+    'VERSION': 1,
+    'BUCKETS': {
+        'confidence': 10,
+        'age': 5,
+        'glucose': 10,
+        'blood_pressure': 10,
+        'bmi': 2,
+        'cholesterol': 20,
+        'max_hr': 10,
+    },
+}
+
+# Standalone inference server (manage.py run_inference_server). When ENABLED,
+# web workers load only the preprocessing artifacts and send feature rows to
+# the server over SOCKET_PATH, scoring in-process if it cannot be reached and
+# retrying the server after RETRY_INTERVAL seconds. TIMEOUT is in seconds.
+INFERENCE_SERVER = {
+    'ENABLED': os.getenv('INFERENCE_SERVER_ENABLED', 'False') == 'True',
+    'SOCKET_PATH': os.getenv('INFERENCE_SERVER_SOCKET', '/tmp/prognosys-inference.sock'),
+    'POOL_SIZE': 8,
+    'TIMEOUT': 5.0,
+    'RETRY_INTERVAL': 5.0,
+}
+
+# Single-file model bundle written by manage.py build_model_bundle. It is read
+# whenever the NumPy and compiled engines are selected; set MODEL_BUNDLE_PATH
+# to an empty string to load the loose artifacts in models/ instead.
+MODEL_BUNDLE_PATH = os.getenv('MODEL_BUNDLE_PATH', os.path.join(BASE_DIR, 'models', 'prognosys.bundle'))
+
+# Registered model bundles (manage.py register_model_bundle). Workers check the
+# active ModelVersion row every POLL_INTERVAL seconds and swap to its bundle
+# without a restart; with no active version they serve MODEL_BUNDLE_PATH.
+MODEL_REGISTRY = {
+    'DIRECTORY': os.getenv('MODEL_REGISTRY_DIRECTORY', os.path.join(BASE_DIR, 'models', 'registry')),
+    'POLL_INTERVAL': float(os.getenv('MODEL_REGISTRY_POLL_INTERVAL', 5)),
+}
+
+# Heart failure model retraining (POST /api/admin/model/retrain/). The booster
+# of the serving bundle is boosted for NUM_BOOST_ROUND more rounds with the
+# hist tree method on NTHREAD threads (0 uses every core). Labelled rows are
+# streamed CHUNK_SIZE at a time, and a job that has not reported progress for
+# STALE_AFTER seconds no longer blocks new ones.
+RETRAINING = {
+    'MIN_SAMPLES': int(os.getenv('RETRAINING_MIN_SAMPLES', 50)),
+    'NUM_BOOST_ROUND': int(os.getenv('RETRAINING_NUM_BOOST_ROUND', 20)),
+    'LEARNING_RATE': 0.1,
+    'NTHREAD': int(os.getenv('RETRAINING_NTHREAD', 0)),
+    'CHUNK_SIZE': 2000,
+    'STALE_AFTER': 3600,
+}
+
+# Store the time spent in each stage of generate_prediction as PredictionTiming
+# rows (summarized by GET /api/admin/model/timings/)
+PREDICTION_TIMING_ENABLED = os.getenv('PREDICTION_TIMING_ENABLED', 'True') == 'True'
+
+# Longest ?hours= window accepted by the admin statistics endpoints
+STATS_MAX_HOURS = 24 * 366